@@ -6,33 +6,100 @@ Attributes:
     app: A flask Flask object creating the flask app
     ITEMS_PER_PAGE: An int representing the number of items return in a single
         API call
+    asset_manifest: A dict mapping the source names of the static assets to
+        their built, content-hashed names
+    casting_cli: A flask AppGroup holding the "flask casting" commands
+    HEALTH_ROUTES: A tuple of strs representing the paths of the health
+        checks, which skip the request set-up
+    prerendered: A dict mapping names to PrerenderedResponse objects for the
+        responses that only change between deployments
+    RETURN_MODES: A tuple of strs representing the accepted values of the
+        return query parameter on write endpoints
 """
 
+import json
+import os
+
+import click
 from flask import (
     Flask,
+    Response,
     abort,
-    jsonify,
+    g,
+)
+from flask import jsonify as flask_jsonify
+from flask import (
     redirect,
     render_template,
     request,
+    stream_with_context,
     url_for,
 )
-from flask_cors import CORS
+from flask.cli import AppGroup
 
+from assets import asset_url, build_assets, load_manifest, send_asset
 from auth import (
     API_IDENTIFIER,
     AUTH0_CLIENT_ID,
     AUTH0_DOMAIN,
     AuthError,
+    key_set,
     requires_auth,
 )
-from models import Actor, Movie, setup_db
+from changes import (
+    RETRY_MILLISECONDS,
+    TICKET_SECONDS,
+    change_feed,
+    issue_ticket,
+    redeem_ticket,
+)
+from compression import compress_response, compression_stats
+from cors import add_cors_headers, handle_preflight
+from delta import changed_since, is_expired, parse_timestamp
+from idempotency import idempotent
+from importer import import_file
+from jobs import job_runner
+from limits import LimitError, rate_limited
+from models import (
+    Actor,
+    Job,
+    Movie,
+    cast_page,
+    cast_size,
+    cast_summaries,
+    db,
+    dispose_engines,
+    find_live,
+    setup_db,
+)
+from prerendered import PrerenderedResponse
+from profiler import PROFILE_ENABLED, PROFILE_MAX_SECONDS, profile
+from records import (
+    ActorRecord,
+    MovieRecord,
+    document_count,
+    document_page,
+    export_ndjson,
+)
+from replicas import record_write, route_request
+from slowlog import current_route, slow_query_log
+from tokens import ROLES, TOKEN_SECONDS, generate_key, mint_token
+from tracing import add_traceparent, tracer
 
 app = Flask(__name__)
 setup_db(app)
-CORS(app)
+slow_query_log.watch()
+tracer.watch()
+job_runner.init_app(app)
 
+casting_cli = AppGroup("casting", help="Casting agency commands.")
+app.cli.add_command(casting_cli)
+asset_manifest = load_manifest()
+prerendered = {}
+
+HEALTH_ROUTES = ("/healthz", "/readyz")
 ITEMS_PER_PAGE = 25
+RETURN_MODES = ("minimal", "diff", "full")
 
 
 def get_actors_from_names(actor_names):
@@ -49,7 +116,7 @@ def get_actors_from_names(actor_names):
 
     if actor_names is not None:
         for actor_name in actor_names:
-            actor = Actor.query.filter_by(name=actor_name).first()
+            actor = find_live(Actor, name=actor_name)
 
             if actor is None:
                 raise AttributeError
@@ -73,7 +140,7 @@ def get_movies_from_titles(movie_titles):
 
     if movie_titles is not None:
         for movie_title in movie_titles:
-            movie = Movie.query.filter_by(title=movie_title).first()
+            movie = find_live(Movie, title=movie_title)
 
             if movie is None:
                 raise AttributeError
@@ -83,53 +150,635 @@ def get_movies_from_titles(movie_titles):
     return movies
 
 
+def get_actor_ids_from_names(actor_names):
+    """Gets a list of actor ids from a list of actor names in one query.
+
+    Args:
+        actor_names: A list of strs representing the names of actors
+
+    Returns:
+        actor_ids: A list of ints representing the identifiers of the actors
+            with the names passed in
+    """
+    if not actor_names:
+        return []
+
+    ids_by_name = {}
+    rows = (
+        db.session.query(Actor.name, Actor.id)
+        .filter(Actor.name.in_(actor_names), Actor.deleted_at.is_(None))
+        .order_by(Actor.id)
+    )
+
+    for name, actor_id in rows:
+        ids_by_name.setdefault(name, actor_id)
+
+    if not ids_by_name.keys() >= set(actor_names):
+        raise AttributeError
+
+    return list(ids_by_name.values())
+
+
+def get_movie_ids_from_titles(movie_titles):
+    """Gets a list of movie ids from a list of movie titles in one query.
+
+    Args:
+        movie_titles: A list of strs representing the titles of movies
+
+    Returns:
+        movie_ids: A list of ints representing the identifiers of the movies
+            with the titles passed in
+    """
+    if not movie_titles:
+        return []
+
+    ids_by_title = {}
+    rows = (
+        db.session.query(Movie.title, Movie.id)
+        .filter(Movie.title.in_(movie_titles), Movie.deleted_at.is_(None))
+        .order_by(Movie.id)
+    )
+
+    for title, movie_id in rows:
+        ids_by_title.setdefault(title, movie_id)
+
+    if not ids_by_title.keys() >= set(movie_titles):
+        raise AttributeError
+
+    return list(ids_by_title.values())
+
+
+def update_movie_actors(movie):
+    """Applies the actor changes in the request body to a movie.
+
+    "actors" replaces the whole cast, while "actors_add" and "actors_remove"
+    only write the movie_actors rows that change.
+
+    Args:
+        movie: A Movie object to update
+    """
+    actor_names = request.json.get("actors")
+    actors_add = request.json.get("actors_add")
+    actors_remove = request.json.get("actors_remove")
+
+    if actor_names is not None:
+        if actors_add or actors_remove:
+            raise AttributeError
+
+        movie.actors = get_actors_from_names(actor_names)
+
+    if actors_add:
+        movie.add_actors(get_actor_ids_from_names(actors_add))
+
+    if actors_remove:
+        movie.remove_actors(get_actor_ids_from_names(actors_remove))
+
+
+def update_actor_movies(actor):
+    """Applies the movie changes in the request body to an actor.
+
+    "movies" replaces the whole filmography, while "movies_add" and
+    "movies_remove" only write the movie_actors rows that change.
+
+    Args:
+        actor: An Actor object to update
+    """
+    movie_titles = request.json.get("movies")
+    movies_add = request.json.get("movies_add")
+    movies_remove = request.json.get("movies_remove")
+
+    if movie_titles is not None:
+        if movies_add or movies_remove:
+            raise AttributeError
+
+        actor.movies = get_movies_from_titles(movie_titles)
+
+    if movies_add:
+        actor.add_movies(get_movie_ids_from_titles(movies_add))
+
+    if movies_remove:
+        actor.remove_movies(get_movie_ids_from_titles(movies_remove))
+
+
+def get_requested_fields():
+    """Gets the set of fields requested with the fields query parameter.
+
+    Returns:
+        fields: A set of strs representing the requested fields (always
+            including "id"), or None if every field was requested
+    """
+    fields = request.args.get("fields")
+
+    if not fields:
+        return None
+
+    fields = {field.strip() for field in fields.split(",") if field.strip()}
+    fields.add("id")
+
+    return fields
+
+
+@tracer.traced("jsonify")
+def jsonify(*args, **kwargs):
+    """Creates a json response, timed as a span of the request's trace.
+
+    Args:
+        *args: The positional arguments of flask's jsonify
+        **kwargs: The keyword arguments of flask's jsonify
+
+    Returns:
+        A json response object
+    """
+    return flask_jsonify(*args, **kwargs)
+
+
+def conditional_jsonify(payload):
+    """Creates a json response that can be revalidated with an ETag.
+
+    Args:
+        payload: A dict representing the body of the response
+
+    Returns:
+        response: A json response object, or an empty 304 response if the
+            client already holds the current representation
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+def delta_jsonify(record_class, resource_name, cast_name):
+    """Responds with the rows changed since the updated_since query param.
+
+    The after_id query parameter continues a sync from the cursor returned
+    by the previous page, and the fields query parameter selects the fields
+    of the changed rows.
+
+    Args:
+        record_class: The MovieRecord or ActorRecord class being synced
+        resource_name: A str representing the resource type, "movie" or
+            "actor"
+        cast_name: A str representing the cast type, "actor" or "movie"
+
+    Returns:
+        response: A json object holding the changed rows, the ids of the
+            deleted rows and the cursor to continue from
+    """
+    try:
+        since = parse_timestamp(request.args["updated_since"])
+    except ValueError:
+        abort(400)
+
+    if is_expired(since):
+        abort(410)
+
+    fields = get_requested_fields()
+    rows, (next_since, next_after_id), has_more = changed_since(
+        record_class, since, request.args.get("after_id", 0, type=int)
+    )
+    summaries = {}
+
+    if fields is None or f"{cast_name}s" in fields:
+        summaries = cast_summaries(
+            record_class.model, [row.id for row in rows]
+        )
+    with tracer.span("format", rows=len(rows)):
+        formatted = [
+            row.format(fields, summaries.get(row.id, ([], 0)))
+            for row in rows
+            if row.deleted_at is None
+        ]
+
+    return jsonify(
+        {
+            "success": True,
+            f"{resource_name}s": formatted,
+            f"deleted_{resource_name}_ids": [
+                row.id for row in rows if row.deleted_at is not None
+            ],
+            "next_updated_since": next_since.isoformat(),
+            "next_after_id": next_after_id,
+            "has_more": has_more,
+        }
+    )
+
+
+def documents_response(model, resource_name):
+    """Responds with a page of movies or actors read from the read model.
+
+    The rows hold the json of each movie or actor, so the page is joined
+    together as it is stored, without loading any model objects.
+
+    Args:
+        model: The Movie or Actor model being paged
+        resource_name: A str representing the resource type, "movie" or
+            "actor"
+
+    Returns:
+        response: A json response holding the page and the total number of
+            movies or actors
+    """
+    page = request.args.get("page", 1, type=int)
+
+    if page < 1:
+        abort(404)
+
+    bodies = document_page(model, page, ITEMS_PER_PAGE)
+
+    if not bodies:
+        abort(404)
+
+    total = document_count(model)
+
+    return Response(
+        f'{{"{resource_name}s":[{",".join(bodies)}],"success":true,'
+        f'"total_{resource_name}s":{total}}}\n',
+        mimetype="application/json",
+    )
+
+
+def cast_page_response(model, resource_id, cast_name):
+    """Responds with a page of the cast of a movie or actor.
+
+    Pages are continued with the after_id query parameter, set to the
+    next_after_id of the previous page.
+
+    Args:
+        model: The Movie or Actor model of the resource
+        resource_id: An int representing the identifier of the resource
+        cast_name: A str representing the cast type, "actor" or "movie"
+
+    Returns:
+        response: A json object holding the page, the size of the cast and
+            the id to continue from, None on the last page
+    """
+    if find_live(model, id=resource_id) is None:
+        abort(404)
+
+    entries = cast_page(
+        model,
+        resource_id,
+        request.args.get("after_id", 0, type=int),
+        ITEMS_PER_PAGE + 1,
+    )
+    has_more = len(entries) > ITEMS_PER_PAGE
+    entries = entries[:ITEMS_PER_PAGE]
+
+    return jsonify(
+        {
+            "success": True,
+            f"{cast_name}s": entries,
+            f"total_{cast_name}s": cast_size(model, resource_id),
+            "next_after_id": entries[-1]["id"] if has_more else None,
+        }
+    )
+
+
+def get_return_mode():
+    """Gets the response mode requested with the return query parameter.
+
+    Returns:
+        mode: A str representing the requested mode, one of RETURN_MODES
+            (default: "full")
+    """
+    mode = request.args.get("return", "full")
+
+    if mode not in RETURN_MODES:
+        abort(400)
+
+    return mode
+
+
+def get_changed_fields(fields):
+    """Gets the fields that the request body sets to a new value.
+
+    Args:
+        fields: A tuple of strs representing the writable fields
+
+    Returns:
+        changed_fields: A set of strs representing the fields present and not
+            None in the request body, either directly or through their _add
+            and _remove variants
+    """
+    changed_fields = {
+        field
+        for field in fields
+        for key in (field, f"{field}_add", f"{field}_remove")
+        if request.json.get(key) is not None
+    }
+
+    return changed_fields
+
+
+@tracer.traced("format")
+def format_for_mode(resource, mode, fields=None):
+    """Formats a movie or actor only as far as the response mode needs it.
+
+    Args:
+        resource: A Movie or Actor object to format
+        mode: A str representing the response mode, one of RETURN_MODES
+        fields: A collection of strs representing the fields a diff covers
+            (default: None, meaning all fields)
+
+    Returns:
+        A dict representing the resource, or None in minimal mode
+    """
+    if mode == "minimal":
+        return None
+
+    if mode == "diff":
+        return resource.format(fields)
+
+    return resource.format()
+
+
+def build_write_payload(resource_name, action, resource_id, mode, old, new):
+    """Builds the body of a create, update or delete response.
+
+    Args:
+        resource_name: A str representing the resource type, "movie" or
+            "actor"
+        action: A str representing the write, "created", "updated" or
+            "deleted"
+        resource_id: An int representing the identifier of the resource
+        mode: A str representing the response mode, one of RETURN_MODES
+        old: A dict representing the resource before the write, or None
+        new: A dict representing the resource after the write, or None
+
+    Returns:
+        payload: A dict representing the body of the response
+    """
+    payload = {"success": True, f"{action}_{resource_name}_id": resource_id}
+
+    if mode == "diff":
+        old = old or {}
+        new = new or {}
+        payload["changes"] = {
+            field: {"old": old.get(field), "new": new.get(field)}
+            for field in sorted(old.keys() | new.keys())
+            if old.get(field) != new.get(field)
+        }
+
+    elif mode == "full":
+        payload[f"old_{resource_name}"] = old
+        payload[f"new_{resource_name}"] = new
+
+    return payload
+
+
+def prerender():
+    """Renders the home page and authentication configuration once.
+
+    Both only change between deployments (or asset builds), so they are
+    served from memory with an ETag instead of running the template engine
+    and json serializer on every request.
+    """
+    with app.test_request_context("/"):
+        prerendered["index"] = PrerenderedResponse(
+            render_template("index.html"), "text/html", "public, no-cache"
+        )
+
+    prerendered["auth_config"] = PrerenderedResponse(
+        json.dumps(
+            {
+                "domain": AUTH0_DOMAIN,
+                "client_id": AUTH0_CLIENT_ID,
+                "audience": API_IDENTIFIER,
+            }
+        ),
+        "application/json",
+        "public, max-age=3600",
+    )
+
+
+def after_fork():
+    """Resets the state a worker must not share with its parent process.
+
+    Run by gunicorn in each worker forked from the preloaded app. The
+    connections pooled while loading the app are dropped so workers do not
+    share their sockets, and the change feed buffer starts empty.
+    """
+    dispose_engines(app)
+    change_feed.reset()
+
+
+@app.context_processor
+def inject_asset_url():
+    """Makes asset_url available to templates.
+
+    Returns:
+        A dict mapping "asset_url" to a function returning the url of the
+            built version of a static asset, or of the source when the
+            assets have not been built
+    """
+    return {"asset_url": lambda name: asset_url(asset_manifest, name)}
+
+
+@casting_cli.command("build-assets")
+def build_assets_command():
+    """Bundles, fingerprints and precompresses the static assets."""
+    for source_name, built_name in build_assets().items():
+        print(f"{source_name} -> {built_name}")
+
+    asset_manifest.clear()
+    asset_manifest.update(load_manifest())
+    prerender()
+
+
+@casting_cli.command("import")
+@click.option("--movies", type=click.Path(exists=True, dir_okay=False))
+@click.option("--actors", type=click.Path(exists=True, dir_okay=False))
+@click.option("--cast", type=click.Path(exists=True, dir_okay=False))
+def import_command(movies, actors, cast):
+    """Loads movies, actors and cast links from CSV or NDJSON files.
+
+    Rows are matched on their ids. Cast files hold movie_id and actor_id
+    columns and are loaded after the movies and actors.
+    """
+    files = (("movies", movies), ("actors", actors), ("cast", cast))
+
+    for resource, path in files:
+        if path is None:
+            continue
+
+        try:
+            count, seconds = import_file(resource, path)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+
+        print(
+            f"{resource}: {count} rows in {seconds:.1f}s "
+            f"({count / max(seconds, 1e-6):.0f} rows/s)"
+        )
+
+
+@casting_cli.command("rebuild-read-model")
+def rebuild_read_model_command():
+    """Rebuilds the pre-encoded json of every movie and actor."""
+    job = Job(kind="rebuild")
+    job.insert()
+    job_id = job.id
+    job_runner.run(job_id)
+    job = Job.query.get(job_id)
+    print(f"rebuild {job.status}: {job.format()['result'] or job.error}")
+
+
+@casting_cli.command("generate-key")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--kid", default="local", show_default=True)
+def generate_key_command(directory, kid):
+    """Generates a key for minting access tokens offline.
+
+    The private key is written to DIRECTORY/private.pem and the key set
+    verifying its tokens to DIRECTORY/jwks.json, for AUTH0_JWKS_FILE.
+    """
+    private_key, jwks = generate_key(kid)
+    os.makedirs(directory, exist_ok=True)
+    private_path = os.path.join(directory, "private.pem")
+    jwks_path = os.path.join(directory, "jwks.json")
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+    with open(os.open(private_path, flags, 0o600), "w") as f:
+        f.write(private_key)
+
+    with open(jwks_path, "w") as f:
+        json.dump(jwks, f, indent=2)
+
+    print(f"{private_path}\n{jwks_path}")
+
+
+@casting_cli.command("mint-token")
+@click.option(
+    "--key", required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option("--kid", default="local", show_default=True)
+@click.option("--role", type=click.Choice(sorted(ROLES)))
+@click.option("--permission", multiple=True)
+@click.option("--sub", default="offline|user", show_default=True)
+@click.option("--seconds", default=TOKEN_SECONDS, show_default=True)
+def mint_token_command(key, kid, role, permission, sub, seconds):
+    """Prints an access token signed with a key made by generate-key.
+
+    The token is granted the permissions of the role along with any given
+    with --permission.
+    """
+    with open(key) as f:
+        private_key = f.read()
+
+    permissions = [*ROLES.get(role, []), *permission]
+    print(mint_token(private_key, kid, permissions, sub, seconds))
+
+
+@casting_cli.command("purge")
+def purge_command():
+    """Removes the expired movie and actor tombstones and their cast links."""
+    job = Job(kind="purge")
+    job.insert()
+    job_id = job.id
+    job_runner.run(job_id)
+    job = Job.query.get(job_id)
+    print(f"purge {job.status}: {job.format()['result'] or job.error}")
+
+
+@app.before_request
+def before_request():
+    """Answers preflights and routes read-only requests to a read replica.
+
+    The trace of the request is started first, continuing the caller's when
+    it sends a traceparent header. The unfinished jobs are resumed on the
+    first request a worker handles. The health checks skip all of it, so a
+    liveness probe never waits on the db.
+
+    Returns:
+        A preflight response, or None to continue handling the request
+    """
+    if request.path in HEALTH_ROUTES:
+        return None
+
+    tracer.start_trace(current_route(), request.headers.get("traceparent"))
+    job_runner.start()
+    preflight = handle_preflight()
+
+    if preflight is not None:
+        return preflight
+
+    route_request()
+
+    return None
+
+
 @app.after_request
 def after_request(response):
     """Adds response headers after request.
 
+    Keeps clients that just wrote reading from the primary db, adds the
+    CORS headers and the traceparent of the request, and compresses the
+    response last so it covers the final body.
+
     Args:
         response: The response object to add headers to
 
     Returns:
         response: The response object that the headers were added to
     """
-    response.headers.add(
-        "Access-Control-Allow-Headers", "Content-Type, Authorization, true"
-    )
-    response.headers.add(
-        "Access-Control-Allow-Methods", "GET, POST, PATCH, DELETE, OPTIONS"
-    )
+    record_write(response)
+    add_cors_headers(response)
+    add_traceparent(response)
 
-    return response
+    return compress_response(response)
+
+
+@app.teardown_request
+def teardown_request(error):
+    """Finishes and exports the trace of the request.
+
+    Args:
+        error: The exception that ended the request, or None
+    """
+    tracer.finish_trace(error)
 
 
 @app.route("/", methods=["GET"])
 def index():
     """Route handler for the home page.
 
+    The page is rendered once by prerender() rather than on every request.
+
+    Returns:
+        A response representing the home page
+    """
+    return prerendered["index"].serve()
+
+
+@app.route("/assets/<path:filename>", methods=["GET"])
+def asset(filename):
+    """Route handler for the built static assets.
+
+    Args:
+        filename: A str representing the content-hashed name of the asset
+
     Returns:
-        A template representing the home page
+        response: The asset, precompressed when the client accepts it, with
+            long-lived immutable cache headers
     """
-    return render_template("index.html")
+    return send_asset(filename)
 
 
 @app.route("/auth_config", methods=["GET"])
 def auth_config():
     """Route handler for retrieving authentication configuration.
 
+    The configuration is serialized once by prerender() rather than on every
+    request.
+
     Returns:
         response: A json object containing the Auth0 authentication
             configuration information
     """
-    response = jsonify(
-        {
-            "domain": AUTH0_DOMAIN,
-            "client_id": AUTH0_CLIENT_ID,
-            "audience": API_IDENTIFIER,
-        }
-    )
-
-    return response
+    return prerendered["auth_config"].serve()
 
 
 @app.route("/api/movies", methods=["GET"])
@@ -137,35 +786,32 @@ def auth_config():
 def get_movies():
     """Route handler for the endpoint showing paginated movies.
 
+    With the updated_since query parameter, only the movies changed or
+    deleted since then are returned instead.
+
     Returns:
         response: A json object representing a page of movies
     """
-    page = request.args.get("page", 1, type=int)
-    movies = Movie.query.order_by(Movie.title).paginate(page, ITEMS_PER_PAGE)
-    current_movies = [movie.format() for movie in movies.items]
-
-    if len(current_movies) == 0:
-        abort(404)
-
-    response = jsonify(
-        {
-            "success": True,
-            "movies": current_movies,
-            "total_movies": movies.total,
-        }
-    )
+    if "updated_since" in request.args:
+        return delta_jsonify(MovieRecord, "movie", "actor")
 
-    return response
+    return documents_response(Movie, "movie")
 
 
 @app.route("/api/movies", methods=["POST"])
 @requires_auth("create:movies")
+@idempotent
+@rate_limited("create:movies")
 def create_movie():
     """Route handler for the endpoint for creating a new movie.
 
+    The return query parameter selects a minimal, diff or full response.
+
     Returns:
         response: A json object representing info about the created movie
     """
+    mode = get_return_mode()
+
     try:
 
         movie = Movie(
@@ -178,12 +824,14 @@ def create_movie():
         movie.insert()
 
         response = jsonify(
-            {
-                "success": True,
-                "created_movie_id": movie.id,
-                "old_movie": None,
-                "new_movie": movie.format(),
-            }
+            build_write_payload(
+                "movie",
+                "created",
+                movie.id,
+                mode,
+                None,
+                format_for_mode(movie, mode),
+            )
         )
 
     except AttributeError:
@@ -192,28 +840,93 @@ def create_movie():
     return response
 
 
+@app.route("/api/movies/export", methods=["GET"])
+@requires_auth("read:movies")
+def export_movies():
+    """Route handler for the endpoint exporting every movie.
+
+    Returns:
+        response: A streamed response of one json object per line and movie
+    """
+    return Response(
+        stream_with_context(export_ndjson(MovieRecord)),
+        mimetype="application/x-ndjson",
+    )
+
+
+@app.route("/api/movies/<int:movie_id>", methods=["GET"])
+@requires_auth("read:movies")
+def get_movie(movie_id):
+    """Route handler for the endpoint showing a single movie.
+
+    The movie and its first actors are read in two queries without loading
+    model objects, and the actors are skipped entirely when excluded by the
+    fields query parameter.
+
+    Args:
+        movie_id: An int representing the identifier for the movie to show
+
+    Returns:
+        response: A json object representing the movie
+    """
+    fields = get_requested_fields()
+    movie = MovieRecord.first_live(movie_id)
+
+    if movie is None:
+        abort(404)
+
+    response = conditional_jsonify(
+        {
+            "success": True,
+            "movie": movie.format(fields),
+        }
+    )
+
+    return response
+
+
+@app.route("/api/movies/<int:movie_id>/actors", methods=["GET"])
+@requires_auth("read:movies")
+def get_movie_actors(movie_id):
+    """Route handler for the endpoint showing a page of a movie's actors.
+
+    Args:
+        movie_id: An int representing the identifier for the movie
+
+    Returns:
+        response: A json object representing a page of the movie's actors
+    """
+    return cast_page_response(Movie, movie_id, "actor")
+
+
 @app.route("/api/movies/<int:movie_id>", methods=["PATCH"])
 @requires_auth("update:movies")
+@rate_limited("update:movies")
 def update_movie(movie_id):
     """Route handler for endpoint updating a single movie.
 
+    The return query parameter selects a minimal, diff or full response.
+
     Args:
         movie_id: An int representing the identifier for the movie to update
 
     Returns:
         response: A json object representing info about the updated movie
     """
-    movie = Movie.query.get(movie_id)
+    mode = get_return_mode()
+    movie = find_live(Movie, id=movie_id)
 
     if movie is None:
         abort(422)
 
     try:
-        old_movie = movie.format()
+        changed_fields = get_changed_fields(
+            ("title", "release_date", "poster", "actors")
+        )
+        old_movie = format_for_mode(movie, mode, changed_fields)
         title = request.json.get("title")
         release_date = request.json.get("release_date")
         poster = request.json.get("poster")
-        actor_names = request.json.get("actors")
 
         if title is not None:
             movie.title = title
@@ -224,18 +937,18 @@ def update_movie(movie_id):
         if poster is not None:
             movie.poster = poster
 
-        if actor_names is not None:
-            movie.actors = get_actors_from_names(actor_names)
-
+        update_movie_actors(movie)
         movie.update()
 
         response = jsonify(
-            {
-                "success": True,
-                "updated_movie_id": movie_id,
-                "old_movie": old_movie,
-                "new_movie": movie.format(),
-            }
+            build_write_payload(
+                "movie",
+                "updated",
+                movie_id,
+                mode,
+                old_movie,
+                format_for_mode(movie, mode, changed_fields),
+            )
         )
 
     except AttributeError:
@@ -246,30 +959,34 @@ def update_movie(movie_id):
 
 @app.route("/api/movies/<int:movie_id>", methods=["DELETE"])
 @requires_auth("delete:movies")
+@rate_limited("delete:movies")
 def delete_movie(movie_id):
     """Route handler for endpoint to delete a single movie.
 
+    The return query parameter selects a minimal, diff or full response.
+    The movie is only marked as deleted; the purge job removes it and its
+    cast links once the tombstone expires.
+
     Args:
         movie_id: An int representing the identifier for the movie to delete
 
     Returns:
         response: A json object representing info about the deleted movie
     """
-    movie = Movie.query.get(movie_id)
+    mode = get_return_mode()
+    movie = find_live(Movie, id=movie_id)
 
     if movie is None:
         abort(422)
 
-    old_movie = movie.format()
+    old_movie = format_for_mode(movie, mode)
     movie.delete()
+    job_runner.enqueue_once("purge")
 
     response = jsonify(
-        {
-            "success": True,
-            "deleted_movie_id": movie_id,
-            "old_movie": old_movie,
-            "new_movie": None,
-        }
+        build_write_payload(
+            "movie", "deleted", movie_id, mode, old_movie, None
+        )
     )
 
     return response
@@ -280,35 +997,32 @@ def delete_movie(movie_id):
 def get_actors():
     """Route handler for the endpoint showing paginated actors.
 
+    With the updated_since query parameter, only the actors changed or
+    deleted since then are returned instead.
+
     Returns:
         response: A json object representing a page of actors
     """
-    page = request.args.get("page", 1, type=int)
-    actors = Actor.query.order_by(Actor.name).paginate(page, ITEMS_PER_PAGE)
-    current_actors = [actor.format() for actor in actors.items]
+    if "updated_since" in request.args:
+        return delta_jsonify(ActorRecord, "actor", "movie")
 
-    if len(current_actors) == 0:
-        abort(404)
-
-    response = jsonify(
-        {
-            "success": True,
-            "actors": current_actors,
-            "total_actors": actors.total,
-        }
-    )
-
-    return response
+    return documents_response(Actor, "actor")
 
 
 @app.route("/api/actors", methods=["POST"])
 @requires_auth("create:actors")
+@idempotent
+@rate_limited("create:actors")
 def create_actor():
     """Route handler for the endpoint for creating a new actor.
 
+    The return query parameter selects a minimal, diff or full response.
+
     Returns:
         response: A json object representing info about the created actor
     """
+    mode = get_return_mode()
+
     try:
 
         actor = Actor(
@@ -322,12 +1036,14 @@ def create_actor():
         actor.insert()
 
         response = jsonify(
-            {
-                "success": True,
-                "created_actor_id": actor.id,
-                "old_actor": None,
-                "new_actor": actor.format(),
-            }
+            build_write_payload(
+                "actor",
+                "created",
+                actor.id,
+                mode,
+                None,
+                format_for_mode(actor, mode),
+            )
         )
 
     except AttributeError:
@@ -336,29 +1052,94 @@ def create_actor():
     return response
 
 
+@app.route("/api/actors/export", methods=["GET"])
+@requires_auth("read:actors")
+def export_actors():
+    """Route handler for the endpoint exporting every actor.
+
+    Returns:
+        response: A streamed response of one json object per line and actor
+    """
+    return Response(
+        stream_with_context(export_ndjson(ActorRecord)),
+        mimetype="application/x-ndjson",
+    )
+
+
+@app.route("/api/actors/<int:actor_id>", methods=["GET"])
+@requires_auth("read:actors")
+def get_actor(actor_id):
+    """Route handler for the endpoint showing a single actor.
+
+    The actor and its first movies are read in two queries without loading
+    model objects, and the movies are skipped entirely when excluded by the
+    fields query parameter.
+
+    Args:
+        actor_id: An int representing the identifier for the actor to show
+
+    Returns:
+        response: A json object representing the actor
+    """
+    fields = get_requested_fields()
+    actor = ActorRecord.first_live(actor_id)
+
+    if actor is None:
+        abort(404)
+
+    response = conditional_jsonify(
+        {
+            "success": True,
+            "actor": actor.format(fields),
+        }
+    )
+
+    return response
+
+
+@app.route("/api/actors/<int:actor_id>/movies", methods=["GET"])
+@requires_auth("read:actors")
+def get_actor_movies(actor_id):
+    """Route handler for the endpoint showing a page of an actor's movies.
+
+    Args:
+        actor_id: An int representing the identifier for the actor
+
+    Returns:
+        response: A json object representing a page of the actor's movies
+    """
+    return cast_page_response(Actor, actor_id, "movie")
+
+
 @app.route("/api/actors/<int:actor_id>", methods=["PATCH"])
 @requires_auth("update:actors")
+@rate_limited("update:actors")
 def update_actor(actor_id):
     """Route handler for endpoint updating a single actor.
 
+    The return query parameter selects a minimal, diff or full response.
+
     Args:
         actor_id: An int representing the identifier for the actor to update
 
     Returns:
         response: A json object representing info about the updated actor
     """
-    actor = Actor.query.get(actor_id)
+    mode = get_return_mode()
+    actor = find_live(Actor, id=actor_id)
 
     if actor is None:
         abort(422)
 
     try:
-        old_actor = actor.format()
+        changed_fields = get_changed_fields(
+            ("name", "birthdate", "gender", "image", "movies")
+        )
+        old_actor = format_for_mode(actor, mode, changed_fields)
         name = request.json.get("name")
         birthdate = request.json.get("birthdate")
         gender = request.json.get("gender")
         image = request.json.get("image")
-        movie_titles = request.json.get("movies")
 
         if name is not None:
             actor.name = name
@@ -372,18 +1153,18 @@ def update_actor(actor_id):
         if image is not None:
             actor.image = image
 
-        if movie_titles is not None:
-            actor.movies = get_movies_from_titles(movie_titles)
-
+        update_actor_movies(actor)
         actor.update()
 
         response = jsonify(
-            {
-                "success": True,
-                "updated_actor_id": actor_id,
-                "old_actor": old_actor,
-                "new_actor": actor.format(),
-            }
+            build_write_payload(
+                "actor",
+                "updated",
+                actor_id,
+                mode,
+                old_actor,
+                format_for_mode(actor, mode, changed_fields),
+            )
         )
 
     except AttributeError:
@@ -394,35 +1175,279 @@ def update_actor(actor_id):
 
 @app.route("/api/actors/<int:actor_id>", methods=["DELETE"])
 @requires_auth("delete:actors")
+@rate_limited("delete:actors")
 def delete_actor(actor_id):
     """Route handler for endpoint to delete a single actor.
 
+    The return query parameter selects a minimal, diff or full response.
+    The actor is only marked as deleted; the purge job removes it and its
+    cast links once the tombstone expires.
+
     Args:
         actor_id: An int representing the identifier for the actor to delete
 
     Returns:
         response: A json object representing info about the deleted actor
     """
-    actor = Actor.query.get(actor_id)
+    mode = get_return_mode()
+    actor = find_live(Actor, id=actor_id)
 
     if actor is None:
         abort(422)
 
-    old_actor = actor.format()
+    old_actor = format_for_mode(actor, mode)
     actor.delete()
+    job_runner.enqueue_once("purge")
+
+    response = jsonify(
+        build_write_payload(
+            "actor", "deleted", actor_id, mode, old_actor, None
+        )
+    )
+
+    return response
+
+
+@app.route("/api/read-model/rebuild", methods=["POST"])
+@requires_auth("rebuild:read-model")
+def rebuild_read_model():
+    """Route handler for the endpoint rebuilding the read model.
+
+    The json of every movie and actor is rebuilt chunk by chunk by a
+    background job.
+
+    Returns:
+        response: A 202 json response holding the job, with its status url
+            as the Location header
+    """
+    job = job_runner.enqueue(
+        "rebuild",
+        None,
+        Movie.query.count() + Actor.query.count(),
+        g.jwt_payload.get("sub"),
+    )
+    response = jsonify({"success": True, "job": job.format()})
+    response.status_code = 202
+    response.headers["Location"] = url_for("get_job", job_id=job.id)
+
+    return response
+
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+@requires_auth("rebuild:read-model")
+def get_job(job_id):
+    """Route handler for the endpoint showing the progress of a job.
+
+    Only the user who started a job can see it. Polling an abandoned job
+    resumes it.
+
+    Args:
+        job_id: An int representing the identifier for the job to show
+
+    Returns:
+        response: A json object representing the job
+    """
+    job = Job.query.get(job_id)
+
+    if job is None or job.owner != g.jwt_payload.get("sub"):
+        abort(404)
+
+    if job.status in ("queued", "running"):
+        job_runner.submit(job.id)
+
+    return jsonify({"success": True, "job": job.format()})
+
+
+@app.route("/api/changes/tickets", methods=["POST"])
+@requires_auth("read:movies")
+def create_change_ticket():
+    """Route handler issuing a ticket to open a change feed stream.
+
+    Browsers cannot set headers on an EventSource, so instead of sending the
+    access token in the url of the stream they exchange it here for a
+    ticket that is redeemed once and expires after TICKET_SECONDS.
+
+    Returns:
+        response: A json object holding the ticket and its lifetime
+    """
+    ticket = issue_ticket(g.jwt_payload.get("permissions", []))
+
+    return jsonify(
+        {"success": True, "ticket": ticket, "expires_in": TICKET_SECONDS}
+    )
+
+
+@app.route("/api/changes", methods=["GET"])
+def get_changes():
+    """Route handler for the server-sent events stream of catalog changes.
+
+    The stream is opened with a ticket from POST /api/changes/tickets, sent
+    as the ticket query parameter. Clients resume from the Last-Event-ID
+    header (or the last_event_id query parameter) on any worker, and
+    receive a reset event when they must refetch instead. Actor events are
+    only sent to clients allowed to read actors. A worker keeps at most
+    MAX_STREAMS streams open and answers 503 beyond them.
+
+    Returns:
+        response: A streamed text/event-stream response
+    """
+    # Redeeming the ticket writes, so it must not go to a replica
+    g.use_replica = False
+    permissions = redeem_ticket(request.args.get("ticket", ""))
+
+    if permissions is None or "read:movies" not in permissions:
+        raise AuthError(
+            {
+                "error_code": "invalid_ticket",
+                "description": "A valid, unused stream ticket is expected",
+            },
+            401,
+        )
+
+    if not change_feed.open_stream():
+        raise LimitError(
+            {
+                "error_code": "service_unavailable",
+                "description": "Too many change streams are open",
+            },
+            503,
+            RETRY_MILLISECONDS // 1000,
+        )
+
+    last_event_id = request.headers.get(
+        "Last-Event-ID", request.args.get("last_event_id")
+    )
+    resources = ["movie"]
+
+    if "read:actors" in permissions:
+        resources.append("actor")
 
+    response = Response(
+        change_feed.stream(last_event_id, resources),
+        mimetype="text/event-stream",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(change_feed.close_stream)
+
+    return response
+
+
+@app.route("/api/metrics", methods=["GET"])
+@requires_auth("read:metrics")
+def get_metrics():
+    """Route handler for the endpoint showing the instrumentation totals.
+
+    Returns:
+        response: A json object holding, per route, the bytes in and out,
+            compression ratio and CPU time spent compressing responses
+    """
     response = jsonify(
         {
             "success": True,
-            "deleted_actor_id": actor_id,
-            "old_actor": old_actor,
-            "new_actor": None,
+            "compression": compression_stats.snapshot(),
         }
     )
 
     return response
 
 
+@app.route("/api/metrics/slow_queries", methods=["GET"])
+@requires_auth("read:metrics")
+def get_slow_queries():
+    """Route handler for the endpoint listing the slow db statements.
+
+    Only the statements run by the worker handling the request are listed.
+
+    Returns:
+        response: A json object holding the threshold, the number of slow
+            statements logged and the most recent of them, each with its
+            duration, route, redacted parameters and sampled plan
+    """
+    response = jsonify({"success": True, **slow_query_log.snapshot()})
+
+    return response
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Route handler for the liveness check of the worker process.
+
+    It does not touch the db or the access token keys, so it only fails
+    when the process cannot answer requests at all.
+
+    Returns:
+        response: A json object holding success
+    """
+    return jsonify({"success": True})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Route handler for the readiness check of the worker process.
+
+    Checks out a connection from the primary db pool and loads the keys
+    signing access tokens if they were never loaded, so a worker that
+    passes is warm.
+
+    Returns:
+        response: A json object holding whether each check passed, with
+            status 503 if any failed
+    """
+    checks = {}
+
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(db.select([1]))
+        checks["database"] = True
+    except Exception:  # pylint: disable=broad-except
+        checks["database"] = False
+
+    try:
+        checks["keys"] = key_set.is_ready()
+    except Exception:  # pylint: disable=broad-except
+        checks["keys"] = False
+
+    ready = all(checks.values())
+    response = jsonify({"success": ready, **checks})
+    response.status_code = 200 if ready else 503
+
+    return response
+
+
+@app.route("/debug/profile", methods=["GET"])
+@requires_auth("debug:profile")
+def get_profile():
+    """Route handler for a sampling profile of the worker process.
+
+    Only available when DEBUG_PROFILE is set. The threads of the worker
+    handling the request are sampled for the given number of seconds.
+
+    Returns:
+        response: The folded stacks of the profile as an attachment, for
+            flamegraph.pl, inferno or speedscope
+    """
+    if not PROFILE_ENABLED:
+        abort(404)
+
+    seconds = request.args.get("seconds", 10, type=int)
+
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        abort(400)
+
+    folded = profile(seconds)
+
+    if folded is None:
+        abort(409)
+
+    response = Response(folded, mimetype="text/plain")
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=profile-{os.getpid()}.folded"
+    )
+
+    return response
+
+
 @app.errorhandler(400)
 def bad_request(error):  # pylint: disable=unused-argument
     """Error handler for 400 bad request.
@@ -447,7 +1472,7 @@ def bad_request(error):  # pylint: disable=unused-argument
 def not_found(error):  # pylint: disable=unused-argument
     """Error handler for 404 not found.
 
-    Redirects to the homepage unless searching for an API resource
+    Redirects to the homepage unless searching for an API or debug resource
 
     Args:
         error: unused
@@ -455,7 +1480,7 @@ def not_found(error):  # pylint: disable=unused-argument
     Returns:
         Response: A json object with the error code and message
     """
-    if not request.path.startswith("/api/"):
+    if not request.path.startswith(("/api/", "/debug/")):
         return redirect(url_for("index"))
 
     response = jsonify(
@@ -488,6 +1513,46 @@ def method_not_allowed(error):  # pylint: disable=unused-argument
     return response, 405
 
 
+@app.errorhandler(409)
+def conflict(error):  # pylint: disable=unused-argument
+    """Error handler for 409 conflict.
+
+    Args:
+        error: unused
+
+    Returns:
+        Response: A json object with the error code and message
+    """
+    response = jsonify(
+        {
+            "success": False,
+            "error_code": "conflict",
+            "description": "The request conflicts with one in progress",
+        }
+    )
+    return response, 409
+
+
+@app.errorhandler(410)
+def gone(error):  # pylint: disable=unused-argument
+    """Error handler for 410 gone.
+
+    Args:
+        error: unused
+
+    Returns:
+        Response: A json object with the error code and message
+    """
+    response = jsonify(
+        {
+            "success": False,
+            "error_code": "gone",
+            "description": "Changes this old are no longer kept, resync fully",
+        }
+    )
+    return response, 410
+
+
 @app.errorhandler(422)
 def unprocessable_entity(error):  # pylint: disable=unused-argument
     """Error handler for 422 unprocessable entity.
@@ -545,5 +1610,25 @@ def authorization_error(error):
     return response
 
 
+@app.errorhandler(LimitError)
+def limit_error(error):
+    """Error handler for requests turned away by the rate or load limits.
+
+    Args:
+        error: A LimitError representing why the request was turned away
+
+    Returns:
+        Response: A json object with the error code and message
+    """
+    error.error["success"] = False
+    response = jsonify(error.error)
+    response.status_code = error.status_code
+    response.headers["Retry-After"] = str(error.retry_after)
+
+    return response
+
+
+prerender()
+
 if __name__ == "__main__":
     app.run(debug=True)
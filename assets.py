@@ -0,0 +1,299 @@
+"""Build and serving of the fingerprinted static assets of the SPA.
+
+The build bundles the ES modules under static/js into a single script,
+strips comments and indentation from the scripts and stylesheets, names
+every output after a hash of its content and writes gzip (and, when the
+brotli package is installed, brotli) variants next to it. A manifest maps
+the source names to the built names so templates can link to them.
+
+Usage: assets.py
+
+Attributes:
+    CACHE_CONTROL: A str representing the Cache-Control header of built assets
+    DIST_FOLDER: A str representing the folder the built assets are written to
+    ENCODINGS: A tuple of (str, str) tuples representing the content encodings
+        of the precompressed variants and their file suffixes, in order of
+        preference
+    ENTRY_POINT: A str representing the module the SPA is started from
+    MANIFEST: A str representing the path of the manifest in DIST_FOLDER
+    STATIC_FOLDER: A str representing the folder holding the source assets
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(__file__), "static")
+DIST_FOLDER = os.path.join(STATIC_FOLDER, "dist")
+MANIFEST = "manifest.json"
+ENTRY_POINT = "js/app.js"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMPORT_PATTERN = re.compile(
+    r"^import\s+(.+?)\s+from\s+'\./([\w.-]+)';\n", re.MULTILINE | re.DOTALL
+)
+EXPORT_PATTERN = re.compile(
+    r"^export\s+(default\s+)?(?:async\s+)?(?:const|let|function|class)\s+"
+    r"(\w+)",
+    re.MULTILINE,
+)
+
+
+def module_variable(name):
+    """Names the bundle variable holding the exports of a module.
+
+    Args:
+        name: A str representing the file name of the module
+
+    Returns:
+        A str representing a JavaScript identifier
+    """
+    return "__module_" + re.sub(r"\W", "_", name)
+
+
+def bundle_module(name, source):
+    """Wraps a module so it can be concatenated with the others.
+
+    Imports become reads from the variables holding the exports of earlier
+    modules, and the exports are returned from the module's own scope.
+
+    Args:
+        name: A str representing the file name of the module
+        source: A str representing the source of the module
+
+    Returns:
+        dependencies: A list of strs representing the file names of the
+            modules imported
+        code: A str representing the wrapped module
+    """
+    dependencies = []
+    bindings = []
+
+    for clause, dependency in IMPORT_PATTERN.findall(source):
+        dependencies.append(dependency)
+        variable = module_variable(dependency)
+
+        if clause.startswith("{"):
+            bindings.append(f"const {clause} = {variable};")
+        else:
+            bindings.append(f"const {clause} = {variable}.default;")
+
+    exports = ", ".join(
+        f"default: {export}" if default else export
+        for default, export in EXPORT_PATTERN.findall(source)
+    )
+
+    body = IMPORT_PATTERN.sub("", source)
+    body = re.sub(r"^export\s+(default\s+)?", "", body, flags=re.MULTILINE)
+    code = (
+        f"const {module_variable(name)} = (() => {{\n"
+        + "\n".join(bindings)
+        + f"\n{body}\nreturn {{{exports}}};\n}})();\n"
+    )
+
+    return dependencies, code
+
+
+def bundle(js_folder, entry_point):
+    """Bundles an entry point module and the modules it imports.
+
+    Args:
+        js_folder: A str representing the folder holding the modules
+        entry_point: A str representing the file name of the entry point
+
+    Returns:
+        A str representing the bundled script
+    """
+    modules = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+
+        visited.add(name)
+
+        with open(os.path.join(js_folder, name)) as source:
+            dependencies, code = bundle_module(name, source.read())
+
+        for dependency in dependencies:
+            visit(dependency)
+
+        modules.append(code)
+
+    visit(entry_point)
+
+    return "'use strict';\n" + "".join(modules)
+
+
+def minify(source):
+    """Removes comments, blank lines and indentation from a script or sheet.
+
+    Only whole-line comments are removed, and lines inside multi-line
+    template literals are left untouched.
+
+    Args:
+        source: A str representing the source to minify
+
+    Returns:
+        A str representing the minified source
+    """
+    lines = []
+    in_template = False
+    in_comment = False
+
+    for line in source.splitlines():
+        stripped = line.strip()
+
+        if in_comment:
+            in_comment = "*/" not in stripped
+            continue
+
+        if not in_template:
+            if stripped.startswith("/*"):
+                in_comment = "*/" not in stripped
+                continue
+
+            if not stripped or stripped.startswith("//"):
+                continue
+
+            line = stripped
+
+        lines.append(line)
+
+        if line.count("`") % 2:
+            in_template = not in_template
+
+    return "\n".join(lines) + "\n"
+
+
+def write_asset(name, content):
+    """Writes a built asset and its precompressed variants.
+
+    Args:
+        name: A str representing the source name of the asset
+        content: A str representing the built content of the asset
+
+    Returns:
+        built_name: A str representing the content-hashed name of the asset
+    """
+    data = content.encode()
+    root, extension = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    built_name = f"{root}.{digest}{extension}"
+    path = os.path.join(DIST_FOLDER, built_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as asset:
+        asset.write(data)
+
+    with open(path + ".gz", "wb") as asset:
+        asset.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        with open(path + ".br", "wb") as asset:
+            asset.write(brotli.compress(data))
+
+    return built_name
+
+
+def build_assets():
+    """Builds the assets of the SPA into DIST_FOLDER.
+
+    Returns:
+        manifest: A dict mapping the source names of the assets to their
+            built names
+    """
+    manifest = {}
+    js_folder = os.path.join(STATIC_FOLDER, os.path.dirname(ENTRY_POINT))
+    script = bundle(js_folder, os.path.basename(ENTRY_POINT))
+    manifest[ENTRY_POINT] = write_asset(ENTRY_POINT, minify(script))
+    css_folder = os.path.join(STATIC_FOLDER, "css")
+
+    for file_name in sorted(os.listdir(css_folder)):
+        with open(os.path.join(css_folder, file_name)) as source:
+            name = f"css/{file_name}"
+            manifest[name] = write_asset(name, minify(source.read()))
+
+    with open(os.path.join(DIST_FOLDER, MANIFEST), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest():
+    """Loads the manifest of the last build.
+
+    Returns:
+        manifest: A dict mapping the source names of the assets to their
+            built names, empty when the assets have not been built
+    """
+    try:
+        with open(os.path.join(DIST_FOLDER, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(manifest, name):
+    """Gets the url of an asset, preferring its built version.
+
+    Args:
+        manifest: A dict mapping the source names of the assets to their
+            built names
+        name: A str representing the source name of the asset
+
+    Returns:
+        A str representing the url of the asset
+    """
+    if name in manifest:
+        return url_for("asset", filename=manifest[name])
+
+    return url_for("static", filename=name)
+
+
+def send_asset(filename):
+    """Sends a built asset, precompressed when the client accepts it.
+
+    Args:
+        filename: A str representing the built name of the asset
+
+    Returns:
+        response: A response object for the asset with long-lived cache
+            headers
+    """
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+
+    for accepted_encoding, suffix in ENCODINGS:
+        if request.accept_encodings[accepted_encoding] and os.path.isfile(
+            os.path.join(DIST_FOLDER, filename + suffix)
+        ):
+            encoding = accepted_encoding
+            filename += suffix
+            break
+
+    response = send_from_directory(DIST_FOLDER, filename, mimetype=mimetype)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+if __name__ == "__main__":
+    for source_name, built_name in build_assets().items():
+        print(f"{source_name} -> {built_name}")
@@ -6,23 +6,44 @@ Attributes:
     ALGORITHMS: A list representing the accepted encryption algorithms for the
         access token
     API_IDENTIFIER: A str representing the unique identifier for the Auth0 api
+    AUTH0_JWKS: A str representing the json of the keys signing access
+        tokens, to verify them offline instead of fetching the keys from
+        Auth0
+    AUTH0_JWKS_FILE: A str representing the path of a file holding the json
+        of the keys signing access tokens, used like AUTH0_JWKS
+    ISSUER: A str representing the issuer of the access tokens
+    REFRESH_SECONDS: An int representing how often the keys may be reloaded
+        when a token is signed with an unknown key
+    key_set: The KeySet holding the keys signing access tokens
 
 Classes:
     AuthError()
+    KeySet()
+    RemoteKeySet()
+    LocalKeySet()
 """
 
+import abc
 import json
 import os
+import threading
+import time
 from functools import wraps
 
-from flask import request
-from jose import jwt
+from flask import g, request
+from jose import jwk, jwt
 from six.moves.urllib.request import urlopen
 
+from tracing import tracer
+
 AUTH0_CLIENT_ID = os.environ["AUTH0_CLIENT_ID"]
 AUTH0_DOMAIN = os.environ["AUTH0_DOMAIN"]
 ALGORITHMS = ["RS256"]
 API_IDENTIFIER = os.environ["API_IDENTIFIER"]
+AUTH0_JWKS = os.environ.get("AUTH0_JWKS")
+AUTH0_JWKS_FILE = os.environ.get("AUTH0_JWKS_FILE")
+ISSUER = f"https://{AUTH0_DOMAIN}/"
+REFRESH_SECONDS = int(os.environ.get("AUTH0_JWKS_REFRESH_SECONDS", 60))
 
 
 class AuthError(Exception):
@@ -40,6 +61,164 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class KeySet(abc.ABC):
+    """The base class of the sources of the keys signing access tokens.
+
+    The keys are converted to key objects once and kept by their kid, so
+    they are not rebuilt for every token. A kid that is not known reloads
+    the keys, at most once every REFRESH_SECONDS, so rotated keys are
+    picked up.
+    """
+
+    def __init__(self):
+        """Set-up for KeySet."""
+        self._keys = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def get_jwks(self):
+        """Gets the keys signing access tokens.
+
+        Returns:
+            A dict representing the JSON Web Key Set holding the keys
+        """
+
+    def load(self):
+        """Converts the keys signing access tokens to key objects."""
+        keys = {
+            key["kid"]: jwk.construct(key, ALGORITHMS[0])
+            for key in self.get_jwks()["keys"]
+            if key.get("kty") == "RSA" and "kid" in key
+        }
+        self._keys = keys
+        self._loaded = time.monotonic()
+
+    def is_ready(self):
+        """Loads the keys if they never were, checking that they can be.
+
+        Returns:
+            A bool representing whether any keys are loaded
+        """
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self.load()
+
+        return bool(self._keys)
+
+    def get_key(self, kid):
+        """Gets the key object of a kid, reloading the keys if needed.
+
+        Args:
+            kid: A str representing the identifier of the key
+
+        Returns:
+            key: A python-jose Key object, or None if there is no such key
+        """
+        key = self._keys.get(kid)
+
+        if key is not None:
+            return key
+
+        with self._lock:
+            if (
+                self._loaded is None
+                or time.monotonic() - self._loaded >= REFRESH_SECONDS
+            ):
+                self.load()
+
+        return self._keys.get(kid)
+
+
+class RemoteKeySet(KeySet):
+    """A KeySet fetching the keys from a url, such as Auth0's.
+
+    Attributes:
+        url: A str representing the url of the JSON Web Key Set
+    """
+
+    def __init__(self, url):
+        """Set-up for RemoteKeySet.
+
+        Args:
+            url: A str representing the url of the JSON Web Key Set
+        """
+        super().__init__()
+        self.url = url
+
+    @tracer.traced("auth.fetch_jwks")
+    def get_jwks(self):
+        """Fetches the keys signing access tokens.
+
+        Returns:
+            A dict representing the JSON Web Key Set holding the keys
+        """
+        jsonurl = urlopen(self.url)
+
+        return json.loads(jsonurl.read())
+
+
+class LocalKeySet(KeySet):
+    """A KeySet holding pinned keys, for deployments without Auth0 access.
+
+    Attributes:
+        jwks: A dict representing the JSON Web Key Set holding the keys
+    """
+
+    def __init__(self, jwks):
+        """Set-up for LocalKeySet.
+
+        Args:
+            jwks: A dict representing the JSON Web Key Set holding the keys
+        """
+        super().__init__()
+        self.jwks = jwks
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads the keys from a json file.
+
+        Args:
+            path: A str representing the path of the file
+
+        Returns:
+            A LocalKeySet holding the keys of the file
+        """
+        with open(path) as source:
+            return cls(json.load(source))
+
+    def get_jwks(self):
+        """Gets the keys signing access tokens.
+
+        Returns:
+            A dict representing the JSON Web Key Set holding the keys
+        """
+        return self.jwks
+
+
+def load_key_set():
+    """Chooses where the keys signing access tokens come from.
+
+    Keys given in AUTH0_JWKS, or else in the AUTH0_JWKS_FILE file, are used
+    as they are and never fetched, otherwise they are fetched from Auth0.
+
+    Returns:
+        A KeySet holding the keys
+    """
+    if AUTH0_JWKS:
+        return LocalKeySet(json.loads(AUTH0_JWKS))
+
+    if AUTH0_JWKS_FILE:
+        return LocalKeySet.from_file(AUTH0_JWKS_FILE)
+
+    return RemoteKeySet(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+
+
+key_set = load_key_set()
+
+
+@tracer.traced("auth.get_token_auth_header")
 def get_token_auth_header():
     """Obtains the access token from the Authorization Header.
 
@@ -89,32 +268,21 @@ def get_token_auth_header():
     return token
 
 
-def get_token_rsa_key(token):
-    """Retrieves the rsa key of the provided access token.
+def get_token_header(token):
+    """Decodes the header of the provided access token without verifying it.
 
     Args:
-        token: A str representing the access token to retrieve the rsa key for
+        token: A str representing the access token
 
     Returns:
-        rsa_key: A dict representing the rsa key for the the given token
+        header: A dict representing the header of the token
     """
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-
     try:
-        unverified_header = jwt.get_unverified_header(token)
+        header = jwt.get_unverified_header(token)
     except jwt.JWTError:
-        raise AuthError(
-            {
-                "error_code": "invalid_header",
-                "description": (
-                    "Invalid header. Use an RS256 signed JWT Access Token"
-                ),
-            },
-            401,
-        )
+        header = {}
 
-    if unverified_header["alg"] == "HS256":
+    if header.get("alg") not in ALGORITHMS:
         raise AuthError(
             {
                 "error_code": "invalid_header",
@@ -125,18 +293,24 @@ def get_token_rsa_key(token):
             401,
         )
 
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
-
-    if not rsa_key:
+    return header
+
+
+@tracer.traced("auth.get_token_rsa_key")
+def get_token_rsa_key(token, keys=None):
+    """Retrieves the rsa key of the provided access token.
+
+    Args:
+        token: A str representing the access token to retrieve the rsa key for
+        keys: The KeySet to look the key up in (default: global key_set)
+
+    Returns:
+        rsa_key: A python-jose Key object of the rsa key for the given token
+    """
+    header = get_token_header(token)
+    rsa_key = (keys or key_set).get_key(header.get("kid"))
+
+    if rsa_key is None:
         raise AuthError(
             {
                 "error_code": "invalid_header",
@@ -148,12 +322,14 @@ def get_token_rsa_key(token):
     return rsa_key
 
 
+@tracer.traced("auth.verify_decode_jwt")
 def verify_decode_jwt(token, rsa_key):
     """Decodes and verifies the validity of the provided access token.
 
     Args:
         token: A str representing the access token to be decoded and verified
-        rsa_key: A dict representing the rsa key for the the given token
+        rsa_key: A python-jose Key object, or a dict, representing the rsa
+            key for the given token
 
     Returns:
         payload: A dict representing the decoded and verified access token
@@ -164,7 +340,7 @@ def verify_decode_jwt(token, rsa_key):
             rsa_key,
             algorithms=ALGORITHMS,
             audience=API_IDENTIFIER,
-            issuer=f"https://{AUTH0_DOMAIN}/",
+            issuer=ISSUER,
         )
     except jwt.ExpiredSignatureError:
         raise AuthError(
@@ -229,9 +405,12 @@ def check_permissions(permission, payload):
         )
 
 
-def requires_auth(permission=""):
+def requires_auth(permission):
     """A decorator to authenticate users and verify permissions for a request.
 
+    The decoded access token is made available to the route handler as
+    g.jwt_payload.
+
     Args:
         permission: A str representing the permission required to access the
             requested resource
@@ -244,6 +423,7 @@ def requires_auth(permission=""):
             rsa_key = get_token_rsa_key(token)
             payload = verify_decode_jwt(token, rsa_key)
             check_permissions(permission, payload)
+            g.jwt_payload = payload
             return f(*args, **kwargs)
 
         return wrapper
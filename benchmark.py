@@ -0,0 +1,665 @@
+"""Benchmarks used to measure the performance of the casting agency API.
+
+Usage: benchmark.py [benchmark ...]
+
+Runs every benchmark when none are named.
+
+Attributes:
+    BENCHMARKS: A dict mapping benchmark names to the functions that run them
+    CAST_SIZES: A tuple of ints representing the cast sizes to benchmark
+    CLIENTS: An int representing the number of concurrent clients sending
+        requests to gunicorn
+    LOAD_SECONDS: An int representing how long each worker class is loaded
+    PAGES: An int representing the number of list pages read per read path
+    PORT: An int representing the local port gunicorn listens on
+    REQUESTS: An int representing the number of times each request's reads
+        are run per path
+    ROUNDS: An int representing the number of times the tracing modes take
+        turns
+    WORKER_CLASSES: A tuple of strs representing the gunicorn worker classes
+        to benchmark
+    VERIFICATIONS: An int representing the number of access tokens verified
+        per verification path
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from jose import jwt
+
+from app import (
+    ITEMS_PER_PAGE,
+    RETURN_MODES,
+    app,
+    build_write_payload,
+    format_for_mode,
+)
+import auth
+from auth import LocalKeySet, get_token_rsa_key, verify_decode_jwt
+from models import (
+    CAST_LIMIT,
+    READ_MODELS,
+    Actor,
+    Movie,
+    cast_page,
+    cast_page_statement,
+    cast_size_statement,
+    cast_summaries,
+    cast_summaries_statement,
+    db,
+    dispose_engines,
+    find_live,
+    movie_actors,
+)
+from models import cast_size as count_cast
+from records import (
+    MovieRecord,
+    document_count,
+    document_count_statement,
+    document_page,
+    document_page_statement,
+    first_live_statement,
+)
+from tokens import ROLES, generate_key, mint_token
+from tracing import TRACE_SAMPLE_RATE, MemoryExporter, tracer
+
+CAST_SIZES = (5, 50, 500)
+CLIENTS = 16
+LOAD_SECONDS = 10
+PAGES = 20
+PORT = 8089
+REQUESTS = 500
+ROUNDS = 5
+WORKER_CLASSES = ("sync", "gthread", "gevent")
+VERIFICATIONS = 2000
+
+
+def make_movie(cast_size):
+    """Creates a transient movie with a cast of the given size.
+
+    Args:
+        cast_size: An int representing the number of actors in the cast
+
+    Returns:
+        movie: A Movie object that is not attached to a db session
+    """
+    movie = Movie(
+        id=1,
+        title="Benchmark Movie",
+        poster="https://example.com/poster.jpg",
+        actors=[
+            Actor(id=actor_id, name=f"Benchmark Actor {actor_id}")
+            for actor_id in range(cast_size)
+        ],
+    )
+
+    return movie
+
+
+def benchmark_payloads():
+    """Reports the size of an update response in each return mode.
+
+    The update renames a movie, the most common write made from the SPA.
+    """
+    print(f"{'cast size':>10} {'mode':>8} {'bytes':>10}")
+
+    for cast_size in CAST_SIZES:
+        movie = make_movie(cast_size)
+        changed_fields = {"title"}
+
+        for mode in RETURN_MODES:
+            old = format_for_mode(movie, mode, changed_fields)
+            movie.title = "Benchmark Movie (Renamed)"
+            new = format_for_mode(movie, mode, changed_fields)
+            movie.title = "Benchmark Movie"
+            payload = build_write_payload(
+                "movie", "updated", movie.id, mode, old, new
+            )
+            size = len(json.dumps(payload, separators=(",", ":")))
+            print(f"{cast_size:>10} {mode:>8} {size:>10}")
+
+
+def orm_page(page):
+    """Encodes a page of movies read as Movie objects.
+
+    Args:
+        page: An int representing the page to read
+
+    Returns:
+        A str representing the json of the page
+    """
+    movies = (
+        Movie.live()
+        .order_by(Movie.title, Movie.id)
+        .limit(ITEMS_PER_PAGE)
+        .offset((page - 1) * ITEMS_PER_PAGE)
+        .all()
+    )
+    summaries = cast_summaries(Movie, [movie.id for movie in movies])
+
+    return json.dumps(
+        [
+            movie.format(cast=summaries.get(movie.id, ([], 0)))
+            for movie in movies
+        ]
+    )
+
+
+def core_page(page):
+    """Encodes a page of movies read as MovieRecord tuples.
+
+    Args:
+        page: An int representing the page to read
+
+    Returns:
+        A str representing the json of the page
+    """
+    movies = MovieRecord.fetch(
+        MovieRecord.select(Movie.deleted_at.is_(None))
+        .order_by(Movie.title, Movie.id)
+        .limit(ITEMS_PER_PAGE)
+        .offset((page - 1) * ITEMS_PER_PAGE)
+    )
+    summaries = cast_summaries(Movie, [movie.id for movie in movies])
+
+    return json.dumps(
+        [
+            movie.format(cast=summaries.get(movie.id, ([], 0)))
+            for movie in movies
+        ]
+    )
+
+
+def read_model_page(page):
+    """Encodes a page of movies read from the read model, as get_movies does.
+
+    Args:
+        page: An int representing the page to read
+
+    Returns:
+        A str representing the json of the page
+    """
+    table = READ_MODELS[Movie][0]
+    bodies = db.session.query(table.c.body).order_by(
+        table.c.sort_key, table.c.id
+    )[(page - 1) * ITEMS_PER_PAGE : page * ITEMS_PER_PAGE]
+
+    return f"[{','.join(body for (body,) in bodies)}]"
+
+
+def measure(read_page):
+    """Measures the CPU time and peak memory of reading PAGES pages.
+
+    Each page is read in a fresh session, as in a request. The time and the
+    memory are measured in separate runs, as tracing memory slows it down.
+
+    Args:
+        read_page: A function reading and encoding a page
+
+    Returns:
+        seconds: A float representing the CPU time per page
+        peak: An int representing the peak bytes allocated for a page
+    """
+    started = time.process_time()
+
+    for page in range(1, PAGES + 1):
+        read_page(page)
+        db.session.remove()
+
+    seconds = (time.process_time() - started) / PAGES
+    peak = 0
+
+    for page in range(1, PAGES + 1):
+        tracemalloc.start()
+        read_page(page)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        db.session.remove()
+
+    return seconds, peak
+
+
+def benchmark_list_pages():
+    """Reports the cost of a page of movies on each read path.
+
+    The orm path is how get_movies read pages before the read model, core
+    selects tuples without the identity map, and read_model is how
+    get_movies reads them now. The total number of movies, counted the same
+    way on every path, is left out. Uses the movies in the configured db.
+    """
+    with app.app_context():
+        if Movie.live().count() < ITEMS_PER_PAGE * PAGES:
+            print(f"needs at least {ITEMS_PER_PAGE * PAGES} movies in the db")
+            return
+
+        print(f"{'path':>10} {'ms/page':>10} {'peak KiB':>10}")
+
+        for name, read_page in (
+            ("orm", orm_page),
+            ("core", core_page),
+            ("read_model", read_model_page),
+        ):
+            read_page(1)
+            seconds, peak = measure(read_page)
+            print(f"{name:>10} {seconds * 1000:>10.2f} {peak / 1024:>10.0f}")
+
+
+def benchmark_tokens():
+    """Reports the access tokens verified per second of CPU time.
+
+    The uncached path is how requires_auth verified tokens before the keys
+    were cached, with the key rebuilt from the key set for every token. The
+    cached path is how it verifies them now. Both run on one thread, so the
+    rate is per core.
+    """
+    private_key, jwks = generate_key("benchmark")
+    keys = LocalKeySet(jwks)
+    token = mint_token(private_key, "benchmark", ROLES["executive-producer"])
+
+    def uncached():
+        header = jwt.get_unverified_header(token)
+        rsa_key = next(
+            key for key in jwks["keys"] if key["kid"] == header["kid"]
+        )
+        verify_decode_jwt(token, rsa_key)
+
+    def cached():
+        verify_decode_jwt(token, get_token_rsa_key(token, keys))
+
+    print(f"backend: {type(keys.get_key('benchmark')).__module__}")
+    print(f"{'path':>10} {'tokens/s':>10}")
+
+    for name, verify in (("uncached", uncached), ("cached", cached)):
+        verify()
+        started = time.process_time()
+
+        for _ in range(VERIFICATIONS):
+            verify()
+
+        seconds = time.process_time() - started
+        print(f"{name:>10} {VERIFICATIONS / seconds:>10.0f}")
+
+
+def run_uncached(build, *args, **params):
+    """Builds, compiles and runs a statement as if it were not cached.
+
+    Args:
+        build: A function decorated with cached_statement
+        *args: The arguments of the function
+        **params: The values of the statement's bound parameters
+
+    Returns:
+        A list of the rows
+    """
+    return db.session.execute(build.__wrapped__(*args), params).fetchall()
+
+
+def statement_requests(movie_id, actor_name):
+    """Lists the reads of the hot requests, cached and not.
+
+    Args:
+        movie_id: An int representing the identifier of a movie with a cast
+        actor_name: A str representing the name of an actor
+
+    Returns:
+        A list of tuples of a str naming the request and functions running
+        its reads with the cached statements and baked queries, and with
+        statements and queries built and compiled every time
+    """
+    return [
+        (
+            "list_page",
+            lambda: (
+                document_page(Movie, 2, ITEMS_PER_PAGE),
+                document_count(Movie),
+            ),
+            lambda: (
+                run_uncached(
+                    document_page_statement,
+                    Movie,
+                    limit=ITEMS_PER_PAGE,
+                    offset=ITEMS_PER_PAGE,
+                ),
+                run_uncached(document_count_statement, Movie),
+            ),
+        ),
+        (
+            "get_movie",
+            lambda: (
+                MovieRecord.first_live(movie_id),
+                cast_summaries(Movie, [movie_id]),
+            ),
+            lambda: (
+                run_uncached(
+                    first_live_statement, MovieRecord, resource_id=movie_id
+                ),
+                run_uncached(
+                    cast_summaries_statement,
+                    Movie,
+                    ids=[movie_id],
+                    limit=CAST_LIMIT,
+                ),
+            ),
+        ),
+        (
+            "cast_page",
+            lambda: (
+                find_live(Movie, id=movie_id),
+                cast_page(Movie, movie_id, 0, ITEMS_PER_PAGE + 1),
+                count_cast(Movie, movie_id),
+            ),
+            lambda: (
+                Movie.live().filter_by(id=movie_id).first(),
+                run_uncached(
+                    cast_page_statement,
+                    Movie,
+                    resource_id=movie_id,
+                    after_id=0,
+                    limit=ITEMS_PER_PAGE + 1,
+                ),
+                run_uncached(cast_size_statement, Movie, resource_id=movie_id),
+            ),
+        ),
+        (
+            "lookup",
+            lambda: find_live(Actor, name=actor_name),
+            lambda: Actor.live().filter_by(name=actor_name).first(),
+        ),
+    ]
+
+
+def benchmark_statements():
+    """Reports the CPU time the cached statements save per request.
+
+    Each hot request's reads are run REQUESTS times in a fresh session, as
+    in a request, with the cached statements and baked queries and with
+    statements and queries built and compiled every time. The time also
+    includes running the queries, on the db's side when it runs locally.
+    Uses the movies and actors in the configured db.
+    """
+    with app.app_context():
+        movie_id = db.session.query(movie_actors.c.movie_id).limit(1).scalar()
+        actor = Actor.live().first()
+
+        if movie_id is None or actor is None or not document_count(Movie):
+            print("needs movies with a cast in the db")
+            return
+
+        actor_name = actor.name
+        db.session.remove()
+        print(
+            f"{'request':>10} {'uncached ms':>12} {'cached ms':>10} "
+            f"{'saved':>6}"
+        )
+
+        for name, cached, uncached in statement_requests(movie_id, actor_name):
+            seconds = []
+
+            for read in (uncached, cached):
+                read()
+                db.session.remove()
+                started = time.process_time()
+
+                for _ in range(REQUESTS):
+                    read()
+                    db.session.remove()
+
+                seconds.append((time.process_time() - started) / REQUESTS)
+
+            print(
+                f"{name:>10} {seconds[0] * 1000:>12.3f} "
+                f"{seconds[1] * 1000:>10.3f} "
+                f"{1 - seconds[1] / seconds[0]:>6.0%}"
+            )
+
+
+def benchmark_tracing():
+    """Reports the CPU time tracing adds to a request.
+
+    A movie is read through the app REQUESTS times per round with an access
+    token signed by a local key, with tracing off, sampling at
+    TRACE_SAMPLE_RATE and sampling every request, exporting to memory. The
+    modes take turns for ROUNDS rounds to even out noise. Uses the movies in
+    the configured db.
+    """
+    with app.app_context():
+        movie_id = db.session.query(Movie.id).limit(1).scalar()
+        db.session.remove()
+
+    if movie_id is None:
+        print("needs movies in the db")
+        return
+
+    private_key, jwks = generate_key("benchmark")
+    token = mint_token(private_key, "benchmark", ROLES["casting-assistant"])
+    headers = {"Authorization": f"Bearer {token}"}
+    client = app.test_client()
+    modes = (
+        ("off", None, 0),
+        (f"{TRACE_SAMPLE_RATE:.0%}", MemoryExporter(), TRACE_SAMPLE_RATE),
+        ("100%", MemoryExporter(), 1),
+    )
+    seconds = {name: 0 for name, _, _ in modes}
+    key_set, exporter, sample_rate = (
+        auth.key_set,
+        tracer.exporter,
+        tracer.sample_rate,
+    )
+    auth.key_set = LocalKeySet(jwks)
+
+    try:
+        for _ in range(ROUNDS):
+            for name, tracer.exporter, tracer.sample_rate in modes:
+                client.get(f"/api/movies/{movie_id}", headers=headers)
+                started = time.process_time()
+
+                for _ in range(REQUESTS):
+                    client.get(f"/api/movies/{movie_id}", headers=headers)
+
+                seconds[name] += time.process_time() - started
+    finally:
+        auth.key_set = key_set
+        tracer.exporter, tracer.sample_rate = exporter, sample_rate
+
+    print(f"{'sampled':>8} {'ms/request':>11} {'overhead':>9}")
+
+    for name, _, _ in modes:
+        print(
+            f"{name:>8} {seconds[name] / ROUNDS / REQUESTS * 1000:>11.3f} "
+            f"{seconds[name] / seconds['off'] - 1:>9.1%}"
+        )
+
+
+def load(token):
+    """Sends list page requests from CLIENTS threads for LOAD_SECONDS.
+
+    Each client keeps its connection open and alternates between pages of
+    movies and of actors.
+
+    Args:
+        token: A str representing the access token sent with the requests
+
+    Returns:
+        latencies: A list of floats representing the seconds each successful
+            request took
+        errors: An int representing the number of failed requests
+    """
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + LOAD_SECONDS
+
+    def client(number):
+        connection = http.client.HTTPConnection("127.0.0.1", PORT)
+        headers = {"Authorization": f"Bearer {token}"}
+        request_number = number
+
+        while time.monotonic() < deadline:
+            resource = ("movies", "actors")[request_number % 2]
+            page = request_number % PAGES + 1
+            request_number += CLIENTS
+            started = time.monotonic()
+
+            try:
+                connection.request(
+                    "GET", f"/api/{resource}?page={page}", headers=headers
+                )
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                errors.append(1)
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", PORT)
+                continue
+
+            if response.status == 200:
+                latencies.append(time.monotonic() - started)
+            else:
+                errors.append(1)
+
+        connection.close()
+
+    clients = [
+        threading.Thread(target=client, args=(number,))
+        for number in range(CLIENTS)
+    ]
+
+    for thread in clients:
+        thread.start()
+
+    for thread in clients:
+        thread.join()
+
+    return latencies, len(errors)
+
+
+def wait_for_server(server, seconds=30):
+    """Waits for gunicorn to answer requests.
+
+    Args:
+        server: The subprocess.Popen object running gunicorn
+        seconds: An int representing how long to wait (default: 30)
+
+    Returns:
+        A bool representing whether gunicorn is answering requests
+    """
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", PORT)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            connection.close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+
+    return False
+
+
+def benchmark_workers():
+    """Reports the throughput of the list endpoints per gunicorn worker class.
+
+    gunicorn is started with gunicorn.conf.py for each worker class, its
+    worker counts derived from the CPU cores as in production, and tokens
+    are verified against a key pinned with AUTH0_JWKS. The clients run in
+    this process, so leave spare cores for them. gevent is skipped unless
+    gevent and psycogreen are installed. Uses the movies and actors in the
+    configured db.
+    """
+    with app.app_context():
+        if Movie.live().count() < ITEMS_PER_PAGE * PAGES:
+            print(f"needs at least {ITEMS_PER_PAGE * PAGES} movies in the db")
+            return
+
+        dispose_engines(app)
+
+    private_key, jwks = generate_key("benchmark")
+    token = mint_token(private_key, "benchmark", ROLES["casting-assistant"])
+    print(f"{'worker':>8} {'requests/s':>12} {'p99 ms':>10} {'errors':>8}")
+
+    for worker_class in WORKER_CLASSES:
+        if worker_class == "gevent" and not all(
+            importlib.util.find_spec(name) for name in ("gevent", "psycogreen")
+        ):
+            print(f"{worker_class:>8} {'skipped':>12}")
+            continue
+
+        env = dict(
+            os.environ,
+            AUTH0_JWKS=json.dumps(jwks),
+            GUNICORN_WORKER_CLASS=worker_class,
+        )
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "--config",
+                "gunicorn.conf.py",
+                "--bind",
+                f"127.0.0.1:{PORT}",
+                "--log-level",
+                "warning",
+                "app:app",
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+        )
+
+        try:
+            if not wait_for_server(server):
+                print(f"{worker_class:>8} {'failed':>12}")
+                continue
+
+            latencies, errors = load(token)
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+        print(
+            f"{worker_class:>8} {len(latencies) / LOAD_SECONDS:>12.0f} "
+            f"{p99 * 1000:>10.1f} {errors:>8}"
+        )
+
+
+BENCHMARKS = {
+    "payloads": benchmark_payloads,
+    "list_pages": benchmark_list_pages,
+    "statements": benchmark_statements,
+    "tokens": benchmark_tokens,
+    "tracing": benchmark_tracing,
+    "workers": benchmark_workers,
+}
+
+
+def main():
+    """Runs the benchmarks named on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark")
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(
+                f"unknown benchmark {name!r} (choose from "
+                f"{', '.join(BENCHMARKS)})"
+            )
+
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
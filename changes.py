@@ -0,0 +1,593 @@
+"""A feed of create, update and delete events for movies and actors.
+
+Writes record their event in the change_events table, in the transaction of
+the write, and the event is numbered by its id. Every worker therefore sees
+the same events under the same ids, and a client can resume a server-sent
+events stream from the last event it saw on any worker. A stream is opened
+with a single-use ticket issued to an authenticated client, since an
+EventSource cannot send the access token in a header. While a worker has
+streams open, one thread reads the new events into a bounded in-memory ring
+buffer the streams wait on, polling the table every POLL_SECONDS or, on
+PostgreSQL, as soon as a write notifies it. A client resuming from an event
+that is no longer kept is told to reset and refetch instead.
+
+Attributes:
+    BUFFER_SIZE: An int representing the number of events buffered, and
+        read from the db at once
+    HEARTBEAT_SECONDS: An int representing how often an idle stream sends a
+        comment to keep the connection open
+    MAX_STREAMS: An int representing the number of streams a worker keeps
+        open at once
+    POLL_SECONDS: A float representing how often the db is read for new
+        events while streams are open
+    PRUNE_SECONDS: An int representing how often the expired events are
+        deleted
+    RETENTION_SECONDS: An int representing how long events are kept for
+        resuming
+    RETRY_MILLISECONDS: An int representing how long clients wait before
+        reconnecting a closed stream
+    STREAM_SECONDS: An int representing how long a stream stays open before
+        the client is asked to reconnect
+    TICKET_SECONDS: An int representing how long a stream ticket may be
+        redeemed after it is issued
+    change_feed: The ChangeFeed shared by the app
+
+Classes:
+    Change()
+    ChangeStore()
+    ChangeFeed()
+"""
+
+import collections
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import selectors
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from models import CHANGE_CHANNEL, ChangeEvent, StreamTicket, db
+
+BUFFER_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+POLL_SECONDS = float(os.environ.get("CHANGE_POLL_SECONDS", 1))
+MAX_STREAMS = int(os.environ.get("CHANGE_MAX_STREAMS", 2))
+PRUNE_SECONDS = 5 * 60
+RETENTION_SECONDS = int(
+    os.environ.get("CHANGE_RETENTION_SECONDS", 24 * 60 * 60)
+)
+RETRY_MILLISECONDS = 3000
+STREAM_SECONDS = 300
+TICKET_SECONDS = 30
+
+Change = collections.namedtuple(
+    "Change", ["sequence", "resource", "action", "id", "data"]
+)
+
+
+def ticket_key(ticket):
+    """Hashes a stream ticket into the key it is stored under.
+
+    Args:
+        ticket: A str representing the stream ticket
+
+    Returns:
+        A str representing the sha256 hex digest of the ticket
+    """
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+def issue_ticket(permissions, seconds=TICKET_SECONDS):
+    """Issues a single-use ticket opening one stream.
+
+    The expired tickets are deleted at the same time.
+
+    Args:
+        permissions: A list of strs representing the permissions of the
+            access token of the client
+        seconds: An int representing how long the ticket may be redeemed
+            (default: global TICKET_SECONDS)
+
+    Returns:
+        ticket: A str representing the stream ticket
+    """
+    now = datetime.datetime.utcnow()
+    ticket = secrets.token_urlsafe(32)
+    StreamTicket.query.filter(StreamTicket.expires_at < now).delete(
+        synchronize_session=False
+    )
+    db.session.add(
+        StreamTicket(
+            key=ticket_key(ticket),
+            permissions=json.dumps(permissions),
+            expires_at=now + datetime.timedelta(seconds=seconds),
+        )
+    )
+    db.session.commit()
+
+    return ticket
+
+
+def redeem_ticket(ticket):
+    """Redeems a stream ticket, so it cannot be used again.
+
+    Args:
+        ticket: A str representing the stream ticket
+
+    Returns:
+        permissions: A list of strs representing the permissions the ticket
+            was issued for, or None if it is unknown, expired or used
+    """
+    key = ticket_key(ticket)
+    permissions = (
+        db.session.query(StreamTicket.permissions)
+        .filter(StreamTicket.key == key)
+        .scalar()
+    )
+    redeemed = StreamTicket.query.filter(
+        StreamTicket.key == key,
+        StreamTicket.expires_at >= datetime.datetime.utcnow(),
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    if permissions is None or not redeemed:
+        return None
+
+    return json.loads(permissions)
+
+
+class ChangeStore:
+    """The change events recorded in the primary db."""
+
+    def __init__(self):
+        """Set-up for ChangeStore."""
+        self._listener = None
+
+    def head(self):
+        """Gets the sequence number of the last event.
+
+        Returns:
+            An int representing the sequence number, 0 if there is none
+        """
+        table = ChangeEvent.__table__
+
+        with db.engine.connect() as connection:
+            return connection.execute(
+                select([func.coalesce(func.max(table.c.id), 0)])
+            ).scalar()
+
+    def after(self, sequence, limit):
+        """Reads the events after a sequence number.
+
+        Args:
+            sequence: An int representing the last sequence number seen
+            limit: An int representing the number of events to read
+
+        Returns:
+            changes: A list of Change objects, or None if the event of the
+                sequence number is no longer kept
+        """
+        table = ChangeEvent.__table__
+
+        with db.engine.connect() as connection:
+            head = connection.execute(
+                select([func.coalesce(func.max(table.c.id), 0)])
+            ).scalar()
+            kept = sequence == head or (
+                sequence < head
+                and connection.execute(
+                    select([table.c.id]).where(table.c.id == sequence)
+                ).first()
+                is not None
+            )
+
+            if not kept:
+                return None
+
+            rows = connection.execute(
+                select([table])
+                .where(table.c.id > sequence)
+                .order_by(table.c.id)
+                .limit(limit)
+            ).fetchall()
+
+        return [
+            Change(
+                row.id,
+                row.resource,
+                row.action,
+                row.resource_id,
+                json.loads(row.data) if row.data is not None else None,
+            )
+            for row in rows
+        ]
+
+    def prune(self, seconds=RETENTION_SECONDS):
+        """Deletes the events older than the retention.
+
+        The last event is always kept, so its id is not reused and clients
+        up to date can still resume.
+
+        Args:
+            seconds: An int representing how long events are kept (default:
+                global RETENTION_SECONDS)
+        """
+        table = ChangeEvent.__table__
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=seconds
+        )
+
+        with db.engine.begin() as connection:
+            keep = connection.execute(
+                select([func.min(table.c.id)]).where(
+                    table.c.created_at >= cutoff
+                )
+            ).scalar()
+
+            if keep is None:
+                keep = connection.execute(
+                    select([func.max(table.c.id)])
+                ).scalar()
+
+            if keep is not None:
+                connection.execute(table.delete().where(table.c.id < keep))
+
+    def wait(self, timeout):
+        """Waits for new events to be recorded.
+
+        On PostgreSQL it listens for the notifications of the writes on a
+        connection of its own, elsewhere it sleeps for the timeout.
+
+        Args:
+            timeout: A float representing the number of seconds to wait
+        """
+        if db.engine.dialect.name != "postgresql":
+            time.sleep(timeout)
+            return
+
+        try:
+            listener = self.listen()
+
+            with selectors.DefaultSelector() as selector:
+                selector.register(listener, selectors.EVENT_READ)
+
+                if selector.select(timeout):
+                    listener.poll()
+                    listener.notifies.clear()
+        except Exception:  # pylint: disable=broad-except
+            self.close()
+            time.sleep(timeout)
+
+    def listen(self):
+        """Opens the connection listening for new events, if needed.
+
+        It is detached from the pool so it does not hold one of its slots.
+
+        Returns:
+            listener: A psycopg2 connection listening on CHANGE_CHANNEL
+        """
+        if self._listener is None:
+            connection = db.engine.raw_connection()
+            connection.detach()
+            listener = connection.connection
+            listener.autocommit = True
+
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+
+            self._listener = listener
+
+        return self._listener
+
+    def close(self):
+        """Closes the connection listening for new events, if any."""
+        listener, self._listener = self._listener, None
+
+        if listener is not None:
+            try:
+                listener.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+
+class ChangeFeed:
+    """A ring buffer of the recent change events that streams can wait on.
+
+    Attributes:
+        store: The ChangeStore events are read from, or None to only stream
+            the events appended to the buffer
+        sequence: An int representing the sequence number of the last event
+            buffered
+        max_streams: An int representing the number of streams the worker
+            keeps open at once
+    """
+
+    def __init__(self, store=None, size=BUFFER_SIZE, max_streams=MAX_STREAMS):
+        """Set-up for ChangeFeed.
+
+        Args:
+            store: The ChangeStore events are read from (default: None)
+            size: An int representing the number of events buffered
+                (default: global BUFFER_SIZE)
+            max_streams: An int representing the number of streams the
+                worker keeps open at once (default: global MAX_STREAMS)
+        """
+        self.store = store
+        self.max_streams = max_streams
+        self.sequence = 0
+        self._floor = 0
+        self._changes = collections.deque(maxlen=size)
+        self._condition = threading.Condition()
+        self._streams = 0
+        self._started = None
+
+    def reset(self):
+        """Empties the buffer, e.g. in a forked worker.
+
+        The buffer is filled again by a thread of the worker itself once one
+        of its streams opens.
+        """
+        self.sequence = 0
+        self._floor = 0
+        self._changes.clear()
+        self._condition = threading.Condition()
+        self._streams = 0
+        self._started = None
+
+    def prime(self, sequence):
+        """Empties the buffer to fill it from a sequence number on.
+
+        Args:
+            sequence: An int representing the sequence number of the last
+                event already recorded
+        """
+        with self._condition:
+            self.sequence = sequence
+            self._floor = sequence
+            self._changes.clear()
+            self._condition.notify_all()
+
+    def append(self, changes):
+        """Adds events to the buffer and wakes up the waiting streams.
+
+        Args:
+            changes: A list of Change objects following the last event
+                buffered, in order
+        """
+        if not changes:
+            return
+
+        with self._condition:
+            for change in changes:
+                if len(self._changes) == self._changes.maxlen:
+                    self._floor = self._changes[0].sequence
+
+                self._changes.append(change)
+                self.sequence = change.sequence
+
+            self._condition.notify_all()
+
+    def since(self, sequence):
+        """Gets the events after a sequence number.
+
+        They are read from the buffer when it holds them all, and from the
+        store otherwise.
+
+        Args:
+            sequence: An int representing the last sequence number seen
+
+        Returns:
+            changes: A list of Change objects, or None if the event of the
+                sequence number is no longer kept
+        """
+        with self._condition:
+            if self._floor <= sequence <= self.sequence:
+                return [
+                    change
+                    for change in self._changes
+                    if change.sequence > sequence
+                ]
+
+        if self.store is None:
+            return None
+
+        return self.store.after(sequence, self._changes.maxlen)
+
+    def wait(self, sequence, timeout):
+        """Waits for events to be buffered after a sequence number.
+
+        Args:
+            sequence: An int representing the last sequence number seen
+            timeout: A float representing the number of seconds to wait
+
+        Returns:
+            changes: A list of Change objects, possibly empty, or None if
+                the event of the sequence number is no longer kept
+        """
+        with self._condition:
+            if sequence >= self.sequence:
+                self._condition.wait(timeout)
+
+        return self.since(sequence)
+
+    def open_stream(self):
+        """Takes one of the stream slots of the worker, if any is free.
+
+        Each open stream holds a thread (or greenlet) of the worker for up
+        to STREAM_SECONDS, so their number is capped to keep the worker
+        answering other requests.
+
+        Returns:
+            A bool representing whether a slot was taken
+        """
+        with self._condition:
+            if self._streams >= self.max_streams:
+                return False
+
+            self._streams += 1
+            self._condition.notify_all()
+
+        return True
+
+    def close_stream(self):
+        """Frees a stream slot taken by open_stream."""
+        with self._condition:
+            self._streams -= 1
+
+    def start(self):
+        """Starts the thread reading events from the store once per process.
+
+        It is started by the first stream rather than when the app is
+        loaded, so a preloaded app starts it in each worker after it forks.
+        """
+        if self.store is None or self._started == os.getpid():
+            return
+
+        with self._condition:
+            if self._started == os.getpid():
+                return
+
+            self._started = os.getpid()
+
+        self.prime(self.store.head())
+        threading.Thread(target=self.poll, name="changes", daemon=True).start()
+
+    def poll(self):
+        """Reads new events from the store into the buffer, as a thread.
+
+        It only reads while streams are open, and starts over from the last
+        event recorded when streams open again.
+        """
+        pruned = time.monotonic()
+
+        while True:
+            with self._condition:
+                idle = not self._streams
+
+                while not self._streams:
+                    self._condition.wait()
+
+            try:
+                if idle:
+                    self.prime(self.store.head())
+
+                changes = self.store.after(self.sequence, self._changes.maxlen)
+
+                if changes is None:
+                    self.prime(self.store.head())
+                    continue
+
+                self.append(changes)
+
+                if time.monotonic() - pruned >= PRUNE_SECONDS:
+                    pruned = time.monotonic()
+                    self.store.prune()
+
+                if len(changes) < self._changes.maxlen:
+                    self.store.wait(POLL_SECONDS)
+            except Exception:  # pylint: disable=broad-except
+                time.sleep(POLL_SECONDS)
+
+    def resume_sequence(self, last_event_id):
+        """Finds where a stream resuming from an event id should start.
+
+        Args:
+            last_event_id: A str representing the id of the last event the
+                client saw, or None for a new client
+
+        Returns:
+            sequence: An int representing the last sequence number the client
+                saw, or None if the client must reset
+        """
+        if not last_event_id:
+            return self.sequence
+
+        if not last_event_id.isdigit():
+            return None
+
+        if self.since(int(last_event_id)) is None:
+            return None
+
+        return int(last_event_id)
+
+    @staticmethod
+    def format_event(change):
+        """Formats an event as a server-sent event.
+
+        Args:
+            change: A Change object to format
+
+        Returns:
+            A str representing the server-sent event
+        """
+        data = {
+            "resource": change.resource,
+            "action": change.action,
+            "id": change.id,
+            "data": change.data,
+        }
+
+        return (
+            f"id: {change.sequence}\n"
+            f"event: change\n"
+            f"data: {json.dumps(data)}\n\n"
+        )
+
+    def reset_event(self):
+        """Formats an event telling a client to refetch everything.
+
+        Returns:
+            A str representing the server-sent event
+        """
+        return f"id: {self.sequence}\nevent: reset\ndata: {{}}\n\n"
+
+    def stream(self, last_event_id=None, resources=("movie", "actor")):
+        """Streams the feed as server-sent events for STREAM_SECONDS.
+
+        The caller holds a stream slot from open_stream while it streams.
+
+        Args:
+            last_event_id: A str representing the id of the last event the
+                client saw, or None for a new client
+            resources: A collection of strs representing the resource types
+                to send events for (default: movies and actors)
+
+        Yields:
+            A str representing one or more server-sent events
+        """
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        self.start()
+        sequence = self.resume_sequence(last_event_id)
+        deadline = time.monotonic() + STREAM_SECONDS
+
+        while time.monotonic() < deadline:
+            if sequence is None:
+                sequence = self.sequence
+                yield self.reset_event()
+
+            changes = self.wait(sequence, HEARTBEAT_SECONDS)
+
+            if changes is None:
+                sequence = None
+                continue
+
+            if not changes:
+                yield ": keep-alive\n\n"
+                continue
+
+            sequence = changes[-1].sequence
+            events = [
+                self.format_event(change)
+                for change in changes
+                if change.resource in resources
+            ]
+
+            if events:
+                yield "".join(events)
+
+
+change_feed = ChangeFeed(ChangeStore())
@@ -0,0 +1,237 @@
+"""Negotiated gzip and brotli compression of responses.
+
+Buffered responses are compressed once they reach MIN_SIZE bytes. Streamed
+responses (server-sent events and other generators) are compressed chunk
+by chunk and flushed after every chunk so events are not held back. The
+ratio and CPU time spent compressing are recorded per route.
+
+Attributes:
+    BROTLI_QUALITY: An int representing the brotli quality (0-11)
+    COMPRESSIBLE_MIMETYPES: A set of strs representing the mimetypes that are
+        compressed
+    GZIP_LEVEL: An int representing the gzip compression level (1-9)
+    MIN_SIZE: An int representing the smallest buffered body, in bytes, that
+        is compressed
+    compression_stats: The CompressionStats shared by the app
+
+Classes:
+    CompressionStats()
+"""
+
+import gzip
+import os
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/event-stream",
+    "text/html",
+}
+GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+
+
+class CompressionStats:
+    """Totals of the bytes and CPU time spent compressing, per route."""
+
+    def __init__(self):
+        """Set-up for CompressionStats."""
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, bytes_in, bytes_out, cpu_seconds, responses=1):
+        """Adds a compressed response (or stream chunk) to the totals.
+
+        Args:
+            route: A str representing the route that was compressed
+            bytes_in: An int representing the uncompressed size
+            bytes_out: An int representing the compressed size
+            cpu_seconds: A float representing the CPU time spent compressing
+            responses: An int representing the number of responses to count,
+                0 for the chunks of a stream after its first (default: 1)
+        """
+        with self._lock:
+            totals = self._routes.setdefault(
+                route,
+                {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu": 0.0},
+            )
+            totals["responses"] += responses
+            totals["bytes_in"] += bytes_in
+            totals["bytes_out"] += bytes_out
+            totals["cpu"] += cpu_seconds
+
+    def snapshot(self):
+        """Summarizes the totals for reporting.
+
+        Returns:
+            summary: A dict mapping routes to dicts of the number of
+                responses, bytes in and out, compression ratio and CPU time
+        """
+        summary = {}
+
+        with self._lock:
+            for route, totals in self._routes.items():
+                responses = max(totals["responses"], 1)
+                summary[route] = {
+                    "responses": totals["responses"],
+                    "bytes_in": totals["bytes_in"],
+                    "bytes_out": totals["bytes_out"],
+                    "ratio": round(
+                        totals["bytes_in"] / max(totals["bytes_out"], 1), 2
+                    ),
+                    "cpu_ms": round(totals["cpu"] * 1000, 3),
+                    "cpu_ms_per_response": round(
+                        totals["cpu"] * 1000 / responses, 3
+                    ),
+                }
+
+        return summary
+
+
+compression_stats = CompressionStats()
+
+
+def choose_encoding():
+    """Chooses the best content encoding the client accepts.
+
+    Returns:
+        A str representing the encoding, "br" or "gzip", or None
+    """
+    accept_encodings = request.accept_encodings
+
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+
+    if accept_encodings["gzip"]:
+        return "gzip"
+
+    return None
+
+
+def make_compressor(encoding):
+    """Creates a streaming compressor for an encoding.
+
+    Args:
+        encoding: A str representing the encoding, "br" or "gzip"
+
+    Returns:
+        compress: A function compressing and flushing one chunk
+        finish: A function returning the end of the compressed stream
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+        def compress(chunk):
+            return compressor.process(chunk) + compressor.flush()
+
+        return compress, compressor.finish
+
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(chunk):
+        return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    return compress, compressor.flush
+
+
+def compress_stream(chunks, encoding, route):
+    """Compresses a streamed body chunk by chunk.
+
+    Args:
+        chunks: An iterable of bytes objects representing the body
+        encoding: A str representing the encoding, "br" or "gzip"
+        route: A str representing the route being streamed
+
+    Yields:
+        A bytes object representing a compressed, flushed chunk
+    """
+    compress, finish = make_compressor(encoding)
+    responses = 1
+
+    for chunk in chunks:
+        started = time.thread_time()
+        compressed = compress(chunk)
+        compression_stats.record(
+            route,
+            len(chunk),
+            len(compressed),
+            time.thread_time() - started,
+            responses,
+        )
+        responses = 0
+        yield compressed
+
+    yield finish()
+
+
+def compress_response(response):
+    """Compresses a response when the client and the response allow it.
+
+    Args:
+        response: The response object to compress
+
+    Returns:
+        response: The response object, compressed if possible
+    """
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+
+    if encoding is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+    if response.is_streamed:
+        response.response = compress_stream(
+            response.iter_encoded(), encoding, route
+        )
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+
+        if len(data) < MIN_SIZE:
+            return response
+
+        started = time.thread_time()
+
+        if encoding == "br":
+            compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(data, GZIP_LEVEL)
+
+        cpu_seconds = time.thread_time() - started
+        response.set_data(compressed)
+        compression_stats.record(
+            route, len(data), len(compressed), cpu_seconds
+        )
+        response.headers.add(
+            "Server-Timing", f"compress;dur={cpu_seconds * 1000:.3f}"
+        )
+
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
@@ -0,0 +1,71 @@
+"""Cross-origin resource sharing headers for the API.
+
+The headers never change while the app runs, so they are built once at
+import. Preflight requests are answered before authentication and routing
+with an Access-Control-Max-Age that lets browsers cache the answer instead
+of sending a preflight ahead of every authenticated call.
+
+Attributes:
+    ALLOWED_HEADERS: A tuple of strs representing the request headers
+        clients may send
+    ALLOWED_METHODS: A tuple of strs representing the methods clients may
+        use
+    ALLOWED_ORIGIN: A str representing the origins allowed to call the API
+    MAX_AGE: An int representing how many seconds browsers may cache a
+        preflight response
+    PREFLIGHT_HEADERS: A tuple of (str, str) tuples representing the headers
+        of a preflight response
+    RESPONSE_HEADERS: A tuple of (str, str) tuples representing the headers
+        added to every other response
+"""
+
+import os
+
+from flask import Response, request
+
+ALLOWED_ORIGIN = os.environ.get("CORS_ALLOWED_ORIGIN", "*")
+ALLOWED_HEADERS = (
+    "Authorization",
+    "Content-Type",
+    "Idempotency-Key",
+    "Last-Event-ID",
+    "traceparent",
+)
+ALLOWED_METHODS = ("GET", "POST", "PATCH", "DELETE", "OPTIONS")
+MAX_AGE = int(os.environ.get("CORS_MAX_AGE", 86400))
+
+RESPONSE_HEADERS = (("Access-Control-Allow-Origin", ALLOWED_ORIGIN),)
+PREFLIGHT_HEADERS = RESPONSE_HEADERS + (
+    ("Access-Control-Allow-Headers", ", ".join(ALLOWED_HEADERS)),
+    ("Access-Control-Allow-Methods", ", ".join(ALLOWED_METHODS)),
+    ("Access-Control-Max-Age", str(MAX_AGE)),
+)
+
+
+def handle_preflight():
+    """Answers a preflight request without routing it.
+
+    Returns:
+        response: An empty response object holding PREFLIGHT_HEADERS, or
+            None if the current request is not a preflight
+    """
+    if (
+        request.method != "OPTIONS"
+        or "Access-Control-Request-Method" not in request.headers
+    ):
+        return None
+
+    return Response(status=204, headers=PREFLIGHT_HEADERS)
+
+
+def add_cors_headers(response):
+    """Adds RESPONSE_HEADERS to a response.
+
+    Args:
+        response: The response object to add the headers to
+    """
+    for key, value in RESPONSE_HEADERS:
+        response.headers[key] = value
+
+    if ALLOWED_ORIGIN != "*":
+        response.vary.add("Origin")
@@ -0,0 +1,114 @@
+"""Delta syncs of the movies or actors changed since a point in time.
+
+Rows are read in (updated_at, id) order from a cursor, so a sync can be
+continued page by page without skipping rows that share a timestamp.
+Deleted rows are returned as markers for as long as their tombstones are
+kept. Rows updated within the last SETTLE_SECONDS are left for the next
+sync, as transactions that started earlier may still commit rows with
+older timestamps. Delta syncs are read from the primary (see
+PRIMARY_QUERY_ARGS in replicas.py), as the settling time does not cover
+replica lag.
+
+Attributes:
+    DELTA_LIMIT: An int representing the number of rows returned per page
+    SETTLE_SECONDS: An int representing how long after a change it is
+        included in a delta sync
+"""
+
+import datetime
+import os
+
+from sqlalchemy import and_, or_
+
+from models import TOMBSTONE_SECONDS
+
+DELTA_LIMIT = 1000
+SETTLE_SECONDS = int(os.environ.get("DELTA_SETTLE_SECONDS", 2))
+
+
+def parse_timestamp(value):
+    """Parses an ISO 8601 timestamp as a naive UTC datetime.
+
+    Args:
+        value: A str representing the timestamp, in UTC unless it has an
+            offset
+
+    Returns:
+        timestamp: A naive datetime in UTC
+
+    Raises:
+        ValueError: If the timestamp cannot be parsed
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+
+    timestamp = datetime.datetime.fromisoformat(value)
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(
+            tzinfo=None
+        )
+
+    return timestamp
+
+
+def is_expired(since):
+    """Checks whether deletions since a time may already have been purged.
+
+    Args:
+        since: A naive datetime in UTC representing the start of the sync
+
+    Returns:
+        A bool representing whether the client must do a full sync
+    """
+    horizon = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=TOMBSTONE_SECONDS
+    )
+
+    return since < horizon
+
+
+def changed_since(record_class, since, after_id=0, limit=DELTA_LIMIT):
+    """Gets a page of the rows changed after a cursor.
+
+    Args:
+        record_class: The MovieRecord or ActorRecord class of the rows being
+            synced, deleted rows included
+        since: A naive datetime in UTC representing the updated_at of the
+            cursor
+        after_id: An int representing the id of the cursor, rows updated at
+            exactly since are only returned after it (default: 0)
+        limit: An int representing the number of rows to return (default:
+            global DELTA_LIMIT)
+
+    Returns:
+        rows: A list of the changed records, in cursor order
+        cursor: A tuple of the datetime and int to continue the sync from
+        has_more: A bool representing whether more rows changed
+    """
+    model = record_class.model
+    settled = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=SETTLE_SECONDS
+    )
+    rows = record_class.fetch(
+        record_class.select(
+            or_(
+                model.updated_at > since,
+                and_(model.updated_at == since, model.id > after_id),
+            ),
+            model.updated_at <= settled,
+        )
+        .order_by(model.updated_at, model.id)
+        .limit(limit + 1)
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if has_more:
+        cursor = (rows[-1].updated_at, rows[-1].id)
+    elif settled > since:
+        cursor = (settled + datetime.timedelta(microseconds=1), 0)
+    else:
+        cursor = (since, after_id)
+
+    return rows, cursor, has_more
@@ -0,0 +1,105 @@
+"""Gunicorn settings for serving the casting agency API.
+
+Usage: gunicorn --config gunicorn.conf.py app:app
+
+The app is loaded once in the arbiter and forked into the workers, so they
+share its memory and start quickly. The connections opened while loading
+it are closed before the workers are forked, and each worker resets the
+state it must not share once forked (see after_fork in app.py).
+
+Requests are handled by threads (gthread, the default) or greenlets
+(gevent, which needs the gevent and psycogreen packages) so that a worker
+is not tied up by a slow client or an open change feed stream. Each open
+stream holds one of them for minutes, so a worker keeps at most half of them
+streaming (CHANGE_MAX_STREAMS) and gevent suits many open streams best.
+
+Attributes:
+    CORES: An int representing the number of CPU cores
+    WORKER_CLASSES: A tuple of strs representing the supported worker
+        classes
+    preload_app: A bool representing whether the app is loaded before
+        forking the workers
+    worker_class: A str representing how workers handle requests, set with
+        GUNICORN_WORKER_CLASS
+    workers: An int representing the number of worker processes, set with
+        WEB_CONCURRENCY (default: one more than the CPU cores)
+    threads: An int representing the requests a gthread worker handles at
+        once, set with GUNICORN_THREADS (default: 4)
+    worker_connections: An int representing the requests a gevent worker
+        handles at once, set with GUNICORN_WORKER_CONNECTIONS (default: 100)
+"""
+
+import multiprocessing
+import os
+
+CORES = multiprocessing.cpu_count()
+WORKER_CLASSES = ("gthread", "gevent", "sync")
+
+preload_app = True
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", CORES + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(
+        f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}"
+    )
+
+if worker_class == "gevent":
+    # Patch before the app is preloaded, so the locks it creates and its db
+    # driver yield to other greenlets instead of blocking the worker
+    from gevent import monkey
+    from psycogreen.gevent import patch_psycopg
+
+    monkey.patch_all()
+    patch_psycopg()
+
+# An open change feed stream holds a thread or greenlet of its worker, so at
+# most half of them stream and a sync worker, with a single one, never does
+os.environ.setdefault(
+    "CHANGE_MAX_STREAMS",
+    str(
+        {
+            "gthread": threads // 2,
+            "gevent": worker_connections // 2,
+            "sync": 0,
+        }[worker_class]
+    ),
+)
+
+
+def when_ready(server):
+    """Closes the connections opened while loading the app, before forking.
+
+    Args:
+        server: The gunicorn Arbiter
+    """
+    from app import app
+    from models import dispose_engines
+
+    dispose_engines(app)
+
+
+def post_fork(server, worker):
+    """Resets the state a worker must not share with the arbiter.
+
+    Args:
+        server: The gunicorn Arbiter
+        worker: The gunicorn Worker that was forked
+    """
+    from app import after_fork
+
+    after_fork()
+
+
+def worker_exit(server, worker):
+    """Stops the worker's job thread pool as it shuts down.
+
+    Args:
+        server: The gunicorn Arbiter
+        worker: The gunicorn Worker that is exiting
+    """
+    from jobs import job_runner
+
+    job_runner.shutdown()
@@ -0,0 +1,163 @@
+"""Replaying of writes retried with the same Idempotency-Key header.
+
+The first request with a key claims it by inserting an IdempotencyKey row
+and stores its response there once handled. The row, the write and the
+response commit in one transaction, the write running in a savepoint
+nested in it, so a request failing or a process dying at any point leaves
+either all of them or none. A retry with the same key is answered with
+the stored response instead of writing again, a retry that arrives while
+the first request is still being handled waits for it on PostgreSQL or is
+told to try again later elsewhere, and reusing a key for a different
+request is refused. Keys expire after TTL_SECONDS.
+
+Attributes:
+    HEADER: A str representing the request header holding the key
+    TTL_SECONDS: An int representing how long a key and its response are
+        kept
+"""
+
+import datetime
+import hashlib
+from functools import wraps
+
+from flask import Response, abort, g, make_response, request
+from sqlalchemy import exc
+
+from models import IdempotencyKey, db
+from replicas import get_client
+
+HEADER = "Idempotency-Key"
+TTL_SECONDS = 24 * 60 * 60
+
+
+def hash_key(value):
+    """Hashes the client making the current request with a key.
+
+    Args:
+        value: A str representing the Idempotency-Key header
+
+    Returns:
+        A str representing the hash
+    """
+    client = g.jwt_payload.get("sub") or get_client()
+
+    return hashlib.sha256(f"{client}:{value}".encode()).hexdigest()
+
+
+def fingerprint_request():
+    """Hashes the method, path, query string and body of the current request.
+
+    Returns:
+        A str representing the hash
+    """
+    fingerprint = hashlib.sha256(
+        f"{request.method} {request.full_path}".encode()
+    )
+    fingerprint.update(request.get_data())
+
+    return fingerprint.hexdigest()
+
+
+def claim(key, fingerprint):
+    """Claims a key for the current request, in its transaction.
+
+    Expired keys are deleted first, and committed, so they can be claimed
+    again. The claim itself is not committed: it commits with the write.
+
+    Args:
+        key: A str representing the hashed key
+        fingerprint: A str representing the hash of the current request
+
+    Returns:
+        record: None if the key was claimed, otherwise the IdempotencyKey
+            object of the request that claimed it first
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=TTL_SECONDS
+    )
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete()
+    db.session.commit()
+    db.session.add(IdempotencyKey(key=key, fingerprint=fingerprint))
+
+    try:
+        db.session.flush()
+    except exc.IntegrityError:
+        db.session.rollback()
+        record = IdempotencyKey.query.get(key)
+
+        # The first request may have failed since, which is treated as in
+        # progress
+        return record or IdempotencyKey(key=key, fingerprint=fingerprint)
+
+    return None
+
+
+def replay(record, fingerprint):
+    """Answers a retry with the response stored for its key.
+
+    Args:
+        record: The IdempotencyKey object holding the stored response
+        fingerprint: A str representing the hash of the current request
+
+    Returns:
+        response: A response object holding the stored response
+    """
+    if record.fingerprint != fingerprint:
+        abort(422)
+
+    if record.status_code is None:
+        abort(409)
+
+    response = Response(
+        record.body, status=record.status_code, mimetype="application/json"
+    )
+    response.headers["Idempotent-Replayed"] = "true"
+
+    return response
+
+
+def idempotent(f):
+    """A decorator to replay writes retried with the same Idempotency-Key.
+
+    It must be applied below requires_auth, which provides g.jwt_payload.
+    Requests without the header are handled as usual.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        value = request.headers.get(HEADER)
+
+        if not value:
+            return f(*args, **kwargs)
+
+        key = hash_key(value)
+        fingerprint = fingerprint_request()
+        record = claim(key, fingerprint)
+
+        if record is not None:
+            return replay(record, fingerprint)
+
+        # The route's commit only releases the savepoint
+        savepoint = db.session.begin_nested()
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            # Rolls the claim back along with the savepoint
+            db.session.close()
+            raise
+
+        if savepoint.is_active:
+            savepoint.commit()
+
+        IdempotencyKey.query.filter_by(key=key).update(
+            {
+                "status_code": response.status_code,
+                "body": response.get_data(as_text=True),
+            }
+        )
+        db.session.commit()
+
+        return response
+
+    return wrapper
@@ -0,0 +1,422 @@
+"""Bulk loading of movies, actors and cast links from CSV or NDJSON files.
+
+Files are read row by row, so memory use does not grow with their size.
+On PostgreSQL the rows are streamed with COPY into a temporary staging
+table and merged with a single set-based upsert; elsewhere (SQLite) they
+are upserted in batches of BATCH_SIZE with executemany. Rows are matched
+on their ids, so loading the same file twice updates rather than
+duplicates. Only the columns a file holds are written, so a file with
+some of the columns updates those and leaves the rest as they are, and
+deleted movies and actors are left deleted and unchanged. Cast links to
+movies or actors that do not exist or were deleted are skipped. Imported
+movies and actors, and those cast with them or whose cast was imported,
+are marked as updated for delta syncs and have their read model rebuilt.
+They are marked with the time the import commits rather than the time it
+started, in the same transaction as the rows, so a delta sync running
+during a long import does not move its cursor past rows committed later.
+
+Attributes:
+    BATCH_SIZE: An int representing the number of rows written per
+        executemany, or per read from the staging stream
+    CAST_TABLES: A tuple of (str, str) tuples representing the tables cast
+        links point to and the movie_actors columns pointing to them
+    MANAGED_COLUMNS: A tuple of strs representing the columns set by the
+        app rather than read from files
+    RESOURCES: A dict mapping the names of importable resources to their
+        table and key columns
+
+Classes:
+    CSVStream()
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import time
+
+from sqlalchemy import text
+
+from models import Actor, Movie, db, rebuild_documents
+
+BATCH_SIZE = 10000
+CAST_TABLES = (("movies", "movie_id"), ("actors", "actor_id"))
+MANAGED_COLUMNS = ("updated_at", "deleted_at")
+RESOURCES = {
+    "movies": ("movies", ("id",)),
+    "actors": ("actors", ("id",)),
+    "cast": ("movie_actors", ("movie_id", "actor_id")),
+}
+
+
+def read_header(path):
+    """Reads the columns a CSV or NDJSON file holds.
+
+    The columns of a CSV file are those of its header row, and those of an
+    NDJSON file are the keys of its first object.
+
+    Args:
+        path: A str representing the path of the file
+
+    Returns:
+        A list of strs representing the columns
+    """
+    with open(path, newline="") as source:
+        if path.endswith(".csv"):
+            return csv.DictReader(source).fieldnames or []
+
+        for line in source:
+            if line.strip():
+                return list(json.loads(line))
+
+    return []
+
+
+def read_rows(path, columns, keys):
+    """Reads the rows of a CSV or NDJSON file one at a time.
+
+    Files ending in .csv must have a header row, anything else is read as
+    one json object per line. Empty values are read as None.
+
+    Args:
+        path: A str representing the path of the file
+        columns: A list of strs representing the columns to read
+        keys: A tuple of strs representing the columns every row must have
+
+    Yields:
+        A list representing the values of the columns of a row
+    """
+    with open(path, newline="") as source:
+        if path.endswith(".csv"):
+            records = csv.DictReader(source)
+        else:
+            records = (json.loads(line) for line in source if line.strip())
+
+        for line_number, record in enumerate(records, 1):
+            row = [record.get(column) or None for column in columns]
+
+            if any(record.get(key) in (None, "") for key in keys):
+                raise ValueError(
+                    f"{path}: row {line_number} is missing {', '.join(keys)}"
+                )
+
+            yield row
+
+
+class CSVStream:
+    """A file-like object reading rows as CSV, for COPY ... FROM STDIN.
+
+    Attributes:
+        count: An int representing the number of rows read so far
+    """
+
+    def __init__(self, rows):
+        """Set-up for CSVStream.
+
+        Args:
+            rows: An iterator of lists representing the rows to read
+        """
+        self.count = 0
+        self._rows = rows
+        self._pending = ""
+        self._position = 0
+
+    def read(self, size=-1):
+        """Reads CSV text, converting BATCH_SIZE rows at a time as needed.
+
+        Args:
+            size: An int representing the number of characters to read, or
+                -1 to read every remaining row
+
+        Returns:
+            A str of CSV text, empty once every row has been read
+        """
+        while size < 0 or len(self._pending) - self._position < size:
+            batch = list(itertools.islice(self._rows, BATCH_SIZE))
+
+            if not batch:
+                break
+
+            buffer = io.StringIO()
+            buffer.write(self._pending[self._position :])
+            csv.writer(buffer).writerows(batch)
+            self._pending = buffer.getvalue()
+            self._position = 0
+            self.count += len(batch)
+
+        if size < 0:
+            size = len(self._pending) - self._position
+
+        data = self._pending[self._position : self._position + size]
+        self._position += len(data)
+
+        return data
+
+
+def upsert_sql(table, columns, keys, source, stamp=None):
+    """Builds the statement merging rows into a table.
+
+    The columns of existing rows are updated, except for deleted rows and
+    for cast links, which only have keys and are skipped when they exist.
+    Cast links are only inserted when the movie and actor exist and are not
+    deleted.
+
+    Args:
+        table: A str representing the name of the table to merge into
+        columns: A list of strs representing the columns of the rows
+        keys: A tuple of strs representing the columns identifying a row
+        source: A str representing the table or subquery holding the rows
+        stamp: A str representing the placeholder of the time the rows are
+            marked as updated with, or None for tables without updated_at
+            (default: None)
+
+    Returns:
+        A str representing the INSERT statement
+    """
+    values = ", ".join(columns)
+    condition = "true"
+
+    if stamp:
+        columns = columns + ["updated_at"]
+        values = f"{values}, {stamp}"
+
+    if table == "movie_actors":
+        condition = " AND ".join(
+            f"EXISTS (SELECT 1 FROM {cast_table} WHERE id = "
+            f"source.{column} AND deleted_at IS NULL)"
+            for cast_table, column in CAST_TABLES
+        )
+
+    updates = ", ".join(
+        f"{column} = excluded.{column}"
+        for column in columns
+        if column not in keys
+    )
+    action = "DO NOTHING"
+
+    if updates:
+        action = f"DO UPDATE SET {updates} WHERE {table}.deleted_at IS NULL"
+
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"SELECT {values} FROM {source} AS source WHERE {condition} "
+        f"ON CONFLICT ({', '.join(keys)}) {action}"
+    )
+
+
+def linked_sql(table, stamp):
+    """Builds the statements marking the rows cast with imported ones.
+
+    Args:
+        table: A str representing the name of the imported table, "movies"
+            or "actors"
+        stamp: A str representing the placeholder of the time the imported
+            rows were marked as updated with
+
+    Returns:
+        A list of strs representing the UPDATE statements
+    """
+    column = dict(CAST_TABLES)[table]
+
+    return [
+        f"UPDATE {cast_table} SET updated_at = {stamp} "
+        f"WHERE id IN (SELECT {cast_column} FROM movie_actors "
+        f"WHERE {column} IN "
+        f"(SELECT id FROM {table} WHERE updated_at >= {stamp}))"
+        for cast_table, cast_column in CAST_TABLES
+        if cast_table != table
+    ]
+
+
+def copy_rows(table, columns, keys, rows):
+    """Loads rows into PostgreSQL with COPY and a set-based upsert.
+
+    The rows are marked as updated with the db clock once they are staged,
+    so the time they get is that of the merge committing them rather than
+    that of the start of the import.
+
+    Args:
+        table: A str representing the name of the table to load
+        columns: A list of strs representing the columns of the rows
+        keys: A tuple of strs representing the columns identifying a row
+        rows: An iterator of lists representing the rows to load
+
+    Returns:
+        count: An int representing the number of rows read
+        stamp: A naive datetime in UTC representing when the rows were
+            marked as updated
+    """
+    staging = f"staging_{table}"
+    stream = CSVStream(rows)
+    connection = db.engine.raw_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) "
+            "ON COMMIT DROP"
+        )
+        cursor.copy_expert(
+            f"COPY {staging} ({', '.join(columns)}) FROM STDIN "
+            "WITH (FORMAT csv)",
+            stream,
+        )
+        cursor.execute("SELECT clock_timestamp() AT TIME ZONE 'UTC'")
+        stamp = cursor.fetchone()[0]
+        key_list = ", ".join(keys)
+        cursor.execute(
+            upsert_sql(
+                table,
+                columns,
+                keys,
+                f"(SELECT DISTINCT ON ({key_list}) * FROM {staging})",
+                None if table == "movie_actors" else "%(stamp)s",
+            ),
+            {"stamp": stamp},
+        )
+
+        if table == "movie_actors":
+            for cast_table, column in CAST_TABLES:
+                cursor.execute(
+                    f"UPDATE {cast_table} SET updated_at = %(stamp)s "
+                    f"WHERE id IN (SELECT {column} FROM {staging})",
+                    {"stamp": stamp},
+                )
+        else:
+            for statement in linked_sql(table, "%(stamp)s"):
+                cursor.execute(statement, {"stamp": stamp})
+
+        if "id" in columns:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE(MAX(id), 1)) FROM {table}"
+            )
+
+        connection.commit()
+    finally:
+        connection.close()
+
+    return stream.count, stamp
+
+
+def touch_cast(batch, started):
+    """Marks the movies and actors of a batch of cast links as updated.
+
+    Args:
+        batch: A list of dicts representing the cast links
+        started: A datetime representing when the import started
+    """
+    for cast_table, column in CAST_TABLES:
+        ids = {int(row[column]) for row in batch}
+        db.session.execute(
+            text(
+                f"UPDATE {cast_table} SET updated_at = :started "
+                "WHERE id = :id"
+            ),
+            [{"started": started, "id": row_id} for row_id in ids],
+        )
+
+
+def execute_rows(table, columns, keys, rows):
+    """Loads rows in batches with executemany, for dbs without COPY.
+
+    The rows are marked as updated with the time the import started while
+    they are loaded, then with the time it commits once they all are.
+
+    Args:
+        table: A str representing the name of the table to load
+        columns: A list of strs representing the columns of the rows
+        keys: A tuple of strs representing the columns identifying a row
+        rows: An iterator of lists representing the rows to load
+
+    Returns:
+        count: An int representing the number of rows read
+        stamp: A naive datetime in UTC representing when the rows were
+            marked as updated
+    """
+    started = datetime.datetime.utcnow()
+    statement = text(
+        upsert_sql(
+            table,
+            columns,
+            keys,
+            "(SELECT "
+            + ", ".join(f":{column} AS {column}" for column in columns)
+            + ")",
+            None if table == "movie_actors" else ":started",
+        )
+    )
+    count = 0
+
+    while True:
+        batch = [
+            dict(zip(columns, row), started=started)
+            for row in itertools.islice(rows, BATCH_SIZE)
+        ]
+
+        if not batch:
+            break
+
+        db.session.execute(statement, batch)
+        count += len(batch)
+
+        if table == "movie_actors":
+            touch_cast(batch, started)
+
+    if table != "movie_actors":
+        for linked in linked_sql(table, ":started"):
+            db.session.execute(text(linked), {"started": started})
+
+    stamp = datetime.datetime.utcnow()
+
+    for cast_table, _ in CAST_TABLES:
+        db.session.execute(
+            text(
+                f"UPDATE {cast_table} SET updated_at = :stamp "
+                "WHERE updated_at = :started"
+            ),
+            {"stamp": stamp, "started": started},
+        )
+
+    db.session.commit()
+
+    return count, stamp
+
+
+def import_file(resource, path):
+    """Imports a CSV or NDJSON file of movies, actors or cast links.
+
+    Args:
+        resource: A str representing the resource type, a key of RESOURCES
+        path: A str representing the path of the file
+
+    Returns:
+        count: An int representing the number of rows read
+        seconds: A float representing the time the import took
+    """
+    table, keys = RESOURCES[resource]
+    table_columns = db.metadata.tables[table].columns.keys()
+    header = read_header(path)
+    missing = [key for key in keys if key not in header]
+
+    if missing:
+        raise ValueError(f"{path}: no {', '.join(missing)} column")
+
+    columns = [
+        column
+        for column in table_columns
+        if column in header and column not in MANAGED_COLUMNS
+    ]
+    rows = read_rows(path, columns, keys)
+    started = time.monotonic()
+
+    if db.engine.dialect.name == "postgresql":
+        count, stamp = copy_rows(table, columns, keys, rows)
+    else:
+        count, stamp = execute_rows(table, columns, keys, rows)
+
+    for model in (Movie, Actor):
+        rebuild_documents(model, model.updated_at >= stamp)
+
+    return count, time.monotonic() - started
@@ -0,0 +1,374 @@
+"""Background jobs for operations too large to run within a request.
+
+Jobs are rows of the jobs table run by a thread pool in the worker
+process. A job handler does one chunk of work per call, and the chunk is
+committed together with the job's progress, so transactions stay short and
+a job interrupted by a restart continues where it stopped. A running job
+that has not made progress for LEASE_SECONDS is considered abandoned and
+may be claimed again by any worker.
+
+Attributes:
+    CHUNK_SIZE: An int representing the number of rows a job handler
+        processes per transaction
+    JOB_WORKERS: An int representing the number of jobs a worker runs at
+        once
+    LEASE_SECONDS: An int representing how long a running job may go without
+        progress before it is considered abandoned
+    PURGE_INTERVAL_SECONDS: An int representing how often deletes queue a
+        job purging the expired tombstones
+    handlers: A dict mapping job kinds to their job handlers
+    job_runner: The JobRunner shared by the app
+
+Classes:
+    JobRunner()
+"""
+
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import and_, or_, tuple_
+
+from models import (
+    READ_MODELS,
+    TOMBSTONE_SECONDS,
+    Actor,
+    Job,
+    Movie,
+    db,
+    movie_actors,
+    refresh_documents,
+)
+
+CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", 500))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+LEASE_SECONDS = 60
+PURGE_INTERVAL_SECONDS = 60 * 60
+
+handlers = {}
+
+
+def job_handler(kind):
+    """A decorator to register the handler of a kind of job.
+
+    The handler is called with the Job object once per chunk, and returns
+    None while there is work left or a json-serializable result once the
+    job is finished. It must not commit a chunk itself.
+
+    Args:
+        kind: A str representing the kind of job handled
+    """
+
+    def job_handler_decorator(f):
+        handlers[kind] = f
+        return f
+
+    return job_handler_decorator
+
+
+def tombstones(model, limit):
+    """Queries the ids of deleted rows whose tombstone has expired.
+
+    Args:
+        model: The Movie or Actor model to query
+        limit: An int representing the number of ids to return
+
+    Returns:
+        A SQLAlchemy Query of the ids
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=TOMBSTONE_SECONDS
+    )
+
+    return (
+        db.session.query(model.id)
+        .filter(model.deleted_at < cutoff)
+        .limit(limit)
+    )
+
+
+@job_handler("purge")
+def purge_tombstones(job):
+    """Removes a chunk of expired movie and actor tombstones.
+
+    The cast links of the tombstones are removed first, then the rows
+    along with any read model rows left for them.
+
+    Args:
+        job: The Job object being run
+
+    Returns:
+        result: A dict holding the number of rows removed once finished,
+            else None
+    """
+    links = (
+        db.session.query(movie_actors.c.movie_id, movie_actors.c.actor_id)
+        .filter(
+            or_(
+                movie_actors.c.movie_id.in_(
+                    tombstones(Movie, None).subquery()
+                ),
+                movie_actors.c.actor_id.in_(
+                    tombstones(Actor, None).subquery()
+                ),
+            )
+        )
+        .limit(CHUNK_SIZE)
+        .all()
+    )
+
+    if links:
+        db.session.execute(
+            movie_actors.delete().where(
+                tuple_(movie_actors.c.movie_id, movie_actors.c.actor_id).in_(
+                    links
+                )
+            )
+        )
+        job.done += len(links)
+        return None
+
+    for model in (Movie, Actor):
+        ids = [row_id for (row_id,) in tombstones(model, CHUNK_SIZE)]
+
+        if ids:
+            documents = READ_MODELS[model][0]
+            db.session.execute(
+                documents.delete().where(documents.c.id.in_(ids))
+            )
+            model.query.filter(model.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            job.done += len(ids)
+            return None
+
+    return {"purged": job.done}
+
+
+@job_handler("rebuild")
+def rebuild_read_model(job):
+    """Rebuilds the read model rows of a chunk of movies, then of actors.
+
+    The job's cursor holds the index of the model being rebuilt and the
+    last id rebuilt, so an interrupted rebuild continues after it.
+
+    Args:
+        job: The Job object being run
+
+    Returns:
+        result: A dict holding the number of rows rebuilt once finished,
+            else None
+    """
+    models = list(READ_MODELS)
+    index, last_id = json.loads(job.cursor) if job.cursor else (0, 0)
+
+    while index < len(models):
+        model = models[index]
+        ids = [
+            row_id
+            for (row_id,) in db.session.query(model.id)
+            .filter(model.id > last_id)
+            .order_by(model.id)
+            .limit(CHUNK_SIZE)
+        ]
+
+        if ids:
+            refresh_documents(model, model.id.between(ids[0], ids[-1]))
+            job.done += len(ids)
+            job.cursor = json.dumps([index, ids[-1]])
+            return None
+
+        index, last_id = index + 1, 0
+
+    return {"rebuilt": job.done}
+
+
+def claimable():
+    """Builds a filter for the jobs that are queued or abandoned.
+
+    Returns:
+        A SQLAlchemy clause filtering the jobs table
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=LEASE_SECONDS
+    )
+
+    return or_(
+        Job.status == "queued",
+        and_(Job.status == "running", Job.updated_at < cutoff),
+    )
+
+
+class JobRunner:
+    """Runs jobs on a thread pool within an app context.
+
+    Attributes:
+        app: The flask app the jobs run for
+        workers: An int representing the number of jobs run at once
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        """Set-up for JobRunner.
+
+        Args:
+            workers: An int representing the number of jobs run at once
+                (default: global JOB_WORKERS)
+        """
+        self.app = None
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._started = None
+
+    def init_app(self, app):
+        """Sets the flask app the jobs run for.
+
+        Args:
+            app: A flask app
+        """
+        self.app = app
+
+    def enqueue(self, kind, target_id, total=None, owner=None):
+        """Queues a new job and starts running it.
+
+        Args:
+            kind: A str representing the kind of job, a key of handlers
+            target_id: An int representing the identifier of the resource
+            total: An int representing the estimated number of rows
+            owner: A str representing the sub claim of the user starting it
+
+        Returns:
+            job: The queued Job object
+        """
+        job = Job(kind=kind, target_id=target_id, total=total, owner=owner)
+        job.insert()
+        self.submit(job.id)
+
+        return job
+
+    def enqueue_once(self, kind, interval=PURGE_INTERVAL_SECONDS):
+        """Queues a job unless one of its kind was queued recently.
+
+        Args:
+            kind: A str representing the kind of job, a key of handlers
+            interval: An int representing the seconds within which a job of
+                the same kind is not queued again (default: global
+                PURGE_INTERVAL_SECONDS)
+
+        Returns:
+            job: The queued Job object, or None if one was queued recently
+        """
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=interval
+        )
+        recent = Job.query.filter(
+            Job.kind == kind, Job.created_at >= cutoff
+        ).first()
+
+        if recent is not None:
+            return None
+
+        return self.enqueue(kind, None)
+
+    def submit(self, job_id):
+        """Runs a job on the thread pool, starting the pool if needed.
+
+        The pool is started lazily so that it is created after a worker
+        process forks.
+
+        Args:
+            job_id: An int representing the identifier of the job
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="job"
+                )
+
+            self._executor.submit(self.run, job_id)
+
+    def claim(self, job_id):
+        """Marks a queued or abandoned job as running in this worker.
+
+        Args:
+            job_id: An int representing the identifier of the job
+
+        Returns:
+            A bool representing whether the job was claimed
+        """
+        claimed = Job.query.filter(Job.id == job_id, claimable()).update(
+            {"status": "running", "updated_at": datetime.datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+        return claimed == 1
+
+    def run(self, job_id):
+        """Runs a job chunk by chunk until it is finished or fails.
+
+        Args:
+            job_id: An int representing the identifier of the job
+        """
+        with self.app.app_context():
+            if not self.claim(job_id):
+                return
+
+            job = Job.query.get(job_id)
+            handler = handlers[job.kind]
+
+            try:
+                result = None
+
+                while result is None:
+                    result = handler(job)
+                    job.updated_at = datetime.datetime.utcnow()
+                    db.session.commit()
+
+                job.status = "succeeded"
+                job.result = json.dumps(result)
+            except Exception as error:  # pylint: disable=broad-except
+                db.session.rollback()
+                job.status = "failed"
+                job.error = repr(error)
+
+            job.updated_at = datetime.datetime.utcnow()
+            db.session.commit()
+
+    def resume(self):
+        """Submits the queued and abandoned jobs, e.g. after a restart."""
+        for (job_id,) in db.session.query(Job.id).filter(claimable()):
+            self.submit(job_id)
+
+    def start(self):
+        """Resumes the unfinished jobs once per process.
+
+        It is called on every request rather than when the app is loaded, so
+        a preloaded app resumes jobs in each worker after it forks instead of
+        in the process forking them.
+        """
+        if self._started == os.getpid():
+            return
+
+        with self._lock:
+            if self._started == os.getpid():
+                return
+
+            self._started = os.getpid()
+
+        self.resume()
+
+    def shutdown(self):
+        """Stops the thread pool from starting more jobs.
+
+        Jobs left unfinished are claimed again once they are abandoned.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+job_runner = JobRunner()
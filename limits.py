@@ -0,0 +1,288 @@
+"""Rate limiting and load shedding for the write endpoints.
+
+Every write is charged to a token bucket keyed by the sub claim of the
+access token and the permission the endpoint requires, so one client
+bulk importing movies cannot starve the others. Independently, writes
+are shed while too many are in flight or while checking out a db
+connection has recently been slow, which keeps the pool free for reads.
+
+Bucket state is kept by a LimitStore; MemoryStore keeps it in the worker
+process.
+
+Attributes:
+    DEFAULT_QUOTA: The Quota for write permissions missing from QUOTAS
+    MAX_CONCURRENT_WRITES: An int representing the number of writes a
+        worker handles at once before shedding
+    POOL_WAIT_THRESHOLD: A float representing the average seconds spent
+        waiting for a db connection above which writes are shed
+    QUOTAS: A dict mapping permissions to their Quota
+    SHED_SECONDS: An int representing how long writes are shed after a slow
+        db connection checkout
+    rate_limiter: The RateLimiter shared by the app
+    write_limiter: The ConcurrencyLimiter shared by the app
+
+Classes:
+    ConcurrencyLimiter()
+    LimitError()
+    LimitStore()
+    MemoryStore()
+    Quota()
+    RateLimiter()
+"""
+
+import abc
+import collections
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g
+
+from models import db
+from replicas import get_client
+
+Quota = collections.namedtuple("Quota", ["rate", "burst"])
+
+WRITES_PER_MINUTE = int(os.environ.get("RATE_LIMIT_WRITES_PER_MINUTE", 120))
+WRITE_BURST = int(os.environ.get("RATE_LIMIT_WRITE_BURST", 20))
+DEFAULT_QUOTA = Quota(WRITES_PER_MINUTE / 60, WRITE_BURST)
+QUOTAS = {
+    "create:movies": DEFAULT_QUOTA,
+    "create:actors": DEFAULT_QUOTA,
+    "update:movies": DEFAULT_QUOTA,
+    "update:actors": DEFAULT_QUOTA,
+    "delete:movies": Quota(DEFAULT_QUOTA.rate / 4, WRITE_BURST // 4 or 1),
+    "delete:actors": Quota(DEFAULT_QUOTA.rate / 4, WRITE_BURST // 4 or 1),
+}
+MAX_CONCURRENT_WRITES = int(os.environ.get("MAX_CONCURRENT_WRITES", 8))
+POOL_WAIT_THRESHOLD = (
+    int(os.environ.get("POOL_WAIT_THRESHOLD_MILLISECONDS", 250)) / 1000
+)
+SHED_SECONDS = 1
+
+
+class LimitError(Exception):
+    """Creates an exception to handle requests that were turned away.
+
+    Attributes:
+        error: A dict containing information about the error
+        status_code: An int representing the http status code
+        retry_after: An int representing the seconds to wait before retrying
+    """
+
+    def __init__(self, error, status_code, retry_after):
+        """Set-up for LimitError Exception."""
+        super().__init__()
+        self.error = error
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LimitStore(abc.ABC):
+    """The base class of the stores holding token buckets."""
+
+    @abc.abstractmethod
+    def take(self, key, quota):
+        """Takes a token from a bucket, refilling it first.
+
+        Args:
+            key: A str identifying the bucket
+            quota: A Quota representing the refill rate and size of the
+                bucket
+
+        Returns:
+            A float representing the seconds until a token is available, 0
+            if one was taken
+        """
+
+
+class MemoryStore(LimitStore):
+    """A LimitStore keeping the buckets in the worker process."""
+
+    def __init__(self):
+        """Set-up for MemoryStore."""
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, quota):
+        """Takes a token from a bucket, refilling it first.
+
+        Args:
+            key: A str identifying the bucket
+            quota: A Quota representing the refill rate and size of the
+                bucket
+
+        Returns:
+            A float representing the seconds until a token is available, 0
+            if one was taken
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (quota.burst, now))
+            tokens = min(quota.burst, tokens + (now - updated) * quota.rate)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / quota.rate
+
+            self._buckets[key] = (tokens - 1, now)
+
+            if len(self._buckets) > 10000:
+                self._buckets = {
+                    key: (tokens, updated)
+                    for key, (tokens, updated) in self._buckets.items()
+                    if now - updated < quota.burst / quota.rate
+                }
+
+        return 0
+
+
+class RateLimiter:
+    """Charges requests to per-client, per-permission token buckets.
+
+    Attributes:
+        store: The LimitStore holding the buckets
+    """
+
+    def __init__(self, store):
+        """Set-up for RateLimiter.
+
+        Args:
+            store: The LimitStore holding the buckets
+        """
+        self.store = store
+
+    def check(self, client, permission):
+        """Charges a request, turning it away once the quota is used up.
+
+        Args:
+            client: A str identifying the client making the request
+            permission: A str representing the permission of the endpoint
+        """
+        quota = QUOTAS.get(permission, DEFAULT_QUOTA)
+        wait = self.store.take(f"{client}:{permission}", quota)
+
+        if wait:
+            raise LimitError(
+                {
+                    "error_code": "too_many_requests",
+                    "description": "Rate limit exceeded for this permission",
+                },
+                429,
+                math.ceil(wait),
+            )
+
+
+class ConcurrencyLimiter:
+    """Sheds writes while too many are in flight or the db pool is slow.
+
+    Attributes:
+        max_concurrent: An int representing the writes handled at once
+        wait_threshold: A float representing the average seconds spent
+            waiting for a db connection above which writes are shed
+        in_flight: An int representing the writes being handled
+        pool_wait: A float representing the moving average of the seconds
+            spent waiting for a db connection
+    """
+
+    def __init__(
+        self,
+        max_concurrent=MAX_CONCURRENT_WRITES,
+        wait_threshold=POOL_WAIT_THRESHOLD,
+    ):
+        """Set-up for ConcurrencyLimiter.
+
+        Args:
+            max_concurrent: An int representing the writes handled at once
+                (default: global MAX_CONCURRENT_WRITES)
+            wait_threshold: A float representing the average seconds spent
+                waiting for a db connection above which writes are shed
+                (default: global POOL_WAIT_THRESHOLD)
+        """
+        self.max_concurrent = max_concurrent
+        self.wait_threshold = wait_threshold
+        self.in_flight = 0
+        self.pool_wait = 0.0
+        self._sampled = 0.0
+        self._lock = threading.Lock()
+
+    def is_overloaded(self):
+        """Checks whether a new write would overload the worker or the db.
+
+        A slow pool only sheds writes for SHED_SECONDS after it was measured
+        so that a later write can find out whether it recovered.
+
+        Returns:
+            A bool representing whether the write must be shed
+        """
+        return self.in_flight >= self.max_concurrent or (
+            self.pool_wait > self.wait_threshold
+            and time.monotonic() - self._sampled < SHED_SECONDS
+        )
+
+    def enter(self):
+        """Starts handling a write, shedding it if overloaded."""
+        with self._lock:
+            if self.is_overloaded():
+                raise LimitError(
+                    {
+                        "error_code": "service_unavailable",
+                        "description": "The server is busy, try again later",
+                    },
+                    503,
+                    SHED_SECONDS,
+                )
+
+            self.in_flight += 1
+
+    def exit(self):
+        """Finishes handling a write."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_wait(self, seconds):
+        """Adds a db connection checkout time to the moving average.
+
+        Args:
+            seconds: A float representing the time spent waiting for a
+                connection
+        """
+        with self._lock:
+            self.pool_wait = 0.8 * self.pool_wait + 0.2 * seconds
+            self._sampled = time.monotonic()
+
+
+rate_limiter = RateLimiter(MemoryStore())
+write_limiter = ConcurrencyLimiter()
+
+
+def rate_limited(permission):
+    """A decorator to rate limit and shed writes by the authenticated client.
+
+    It must be applied below requires_auth, which provides g.jwt_payload.
+
+    Args:
+        permission: A str representing the permission the endpoint requires
+    """
+
+    def rate_limited_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            client = g.jwt_payload.get("sub") or get_client()
+            rate_limiter.check(client, permission)
+            write_limiter.enter()
+
+            try:
+                started = time.monotonic()
+                db.session.connection()
+                write_limiter.record_wait(time.monotonic() - started)
+                return f(*args, **kwargs)
+            finally:
+                write_limiter.exit()
+
+        return wrapper
+
+    return rate_limited_decorator
@@ -1,45 +1,599 @@
 """Model objects used to model data for the db.
 
 Attributes:
+    CAST_LIMIT: An int representing the number of actors of a movie, or
+        movies of an actor, embedded in its json
+    CHANGE_CHANNEL: A str representing the PostgreSQL channel notified of
+        new change events
+    CHANGE_LOCK_KEY: An int representing the PostgreSQL advisory lock that
+        orders the commits of change events
     DATABASE_URL: A str representing the location of the db
+    DOCUMENT_CHUNK_SIZE: An int representing the number of read model rows
+        rebuilt per transaction
+    TOMBSTONE_SECONDS: An int representing how long deleted movies and
+        actors are kept before they may be purged
+    REPLICA_STRATEGY: A str representing how a read replica is chosen for a
+        read-only request, "round_robin" or "least_loaded"
+    REPLICA_URLS: A list of strs representing the locations of read replicas
+        of the db
     db: A SQLAlchemy service
+    bakery: A SQLAlchemy bakery caching the baked queries of find_live
     movie_actors: A SQLAlchemy association table to map the many-to-many
         relationship between movies and actors
+    movie_documents: A SQLAlchemy table holding the read model of the live
+        movies, each as pre-encoded json with its cast
+    actor_documents: A SQLAlchemy table holding the read model of the live
+        actors, each as pre-encoded json with its movies
+    READ_MODELS: A dict mapping the Movie and Actor models to their read
+        model table and the column pages are sorted by
+    CASTS: A dict mapping the Movie and Actor models to the movie_actors
+        columns pointing to them and to their cast, the model of their cast
+        and the columns of its entries
 
 Classes:
     Movie()
     Artist()
+    IdempotencyKey()
+    Job()
+    ChangeEvent()
+    StreamTicket()
 """
 
+import datetime
+import json
 import os
 
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Date, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    and_,
+    bindparam,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext import baked
 from sqlalchemy.orm import relationship
 
+from replicas import REPLICA_BIND_PREFIX, RoutingSQLAlchemy, replica_set
+from statements import cached_statement
+
 DATABASE_URL = os.environ["DATABASE_URL"]
-db = SQLAlchemy()
+REPLICA_STRATEGY = os.environ.get("DATABASE_REPLICA_STRATEGY", "round_robin")
+REPLICA_URLS = os.environ.get("DATABASE_REPLICA_URLS", "").split()
+TOMBSTONE_SECONDS = int(os.environ.get("TOMBSTONE_SECONDS", 7 * 24 * 60 * 60))
+DOCUMENT_CHUNK_SIZE = 1000
+CAST_LIMIT = int(os.environ.get("CAST_LIMIT", 20))
+CHANGE_CHANNEL = "change_events"
+CHANGE_LOCK_KEY = 5_301_001
+db = RoutingSQLAlchemy()
+bakery = baked.bakery()
 
 movie_actors = db.Table(
     "movie_actors",
     Column("movie_id", Integer, ForeignKey("movies.id"), primary_key=True),
     Column("actor_id", Integer, ForeignKey("actors.id"), primary_key=True),
+    Index("ix_movie_actors_actor_id", "actor_id", "movie_id"),
 )
 
+movie_documents = db.Table(
+    "movie_documents",
+    Column("id", Integer, ForeignKey("movies.id"), primary_key=True),
+    Column("sort_key", String),
+    Column("body", Text, nullable=False),
+    Index("ix_movie_documents_sort_key", "sort_key", "id"),
+)
+
+actor_documents = db.Table(
+    "actor_documents",
+    Column("id", Integer, ForeignKey("actors.id"), primary_key=True),
+    Column("sort_key", String),
+    Column("body", Text, nullable=False),
+    Index("ix_actor_documents_sort_key", "sort_key", "id"),
+)
 
-def setup_db(app, database_url=DATABASE_URL):
+
+def setup_db(app, database_url=DATABASE_URL, replica_urls=REPLICA_URLS):
     """Binds a flask application and a SQLAlchemy service.
 
     Args:
         app: A flask app
         database_url: A str representing the location of the db (default:
             global DATABASE_URL)
+        replica_urls: A list of strs representing the locations of read
+            replicas of the db (default: global REPLICA_URLS)
     """
+    binds = {
+        f"{REPLICA_BIND_PREFIX}{index}": replica_url
+        for index, replica_url in enumerate(replica_urls)
+    }
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_BINDS"] = binds
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    replica_set.configure(binds, REPLICA_STRATEGY)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    db.create_all(bind=None)
+
+
+def dispose_engines(app):
+    """Drops the pooled connections of the primary and replica dbs.
+
+    Args:
+        app: A flask app bound by setup_db
+    """
+    for bind in (None, *app.config["SQLALCHEMY_BINDS"]):
+        db.get_engine(app, bind=bind).dispose()
+
+
+def insert_ignore(table):
+    """Builds an insert statement that skips rows which already exist.
+
+    Uses INSERT ... ON CONFLICT DO NOTHING on PostgreSQL and INSERT OR IGNORE
+    elsewhere (SQLite).
+
+    Args:
+        table: A SQLAlchemy Table to insert into
+
+    Returns:
+        statement: A SQLAlchemy Insert object
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+
+    return table.insert().prefix_with("OR IGNORE")
+
+
+def upsert(table):
+    """Builds an insert statement that overwrites rows which already exist.
+
+    Uses INSERT ... ON CONFLICT (id) DO UPDATE on PostgreSQL and INSERT OR
+    REPLACE elsewhere (SQLite), so concurrent writers of a row do not race
+    on its primary key.
+
+    Args:
+        table: A SQLAlchemy Table, keyed by an id column, to insert into
+
+    Returns:
+        statement: A SQLAlchemy Insert object
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        statement = postgresql.insert(table)
+
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={
+                column.name: statement.excluded[column.name]
+                for column in table.columns
+                if column.name != "id"
+            },
+        )
+
+    return table.insert().prefix_with("OR REPLACE")
+
+
+def format_cast_entry(columns, row):
+    """Formats a cast entry as a dict.
+
+    Args:
+        columns: A tuple of strs representing the fields of the entry
+        row: A tuple representing the values of the fields
+
+    Returns:
+        A dict representing the entry
+    """
+    return {
+        column: str(value) if isinstance(value, datetime.date) else value
+        for column, value in zip(columns, row)
+    }
+
+
+@cached_statement
+def cast_summaries_statement(model):
+    """Builds the statement of cast_summaries.
+
+    Args:
+        model: The Movie or Actor model of the rows
+
+    Returns:
+        A SQLAlchemy Select object taking the ids and limit parameters
+    """
+    column, cast_column, cast_model, fields = CASTS[model]
+    entries = (
+        select(
+            [
+                column.label("owner_id"),
+                *(getattr(cast_model, field) for field in fields),
+                func.row_number()
+                .over(partition_by=column, order_by=cast_column)
+                .label("position"),
+                func.count().over(partition_by=column).label("total"),
+            ]
+        )
+        .select_from(
+            movie_actors.join(
+                cast_model,
+                and_(
+                    cast_model.id == cast_column,
+                    cast_model.deleted_at.is_(None),
+                ),
+            )
+        )
+        .where(column.in_(bindparam("ids", expanding=True)))
+        .alias("entries")
+    )
+
+    return select([entries]).where(entries.c.position <= bindparam("limit"))
+
+
+def cast_summaries(model, ids, limit=CAST_LIMIT):
+    """Gets the first live cast entries and the cast size of many rows.
+
+    Both are read in one query, so formatting a page of movies or actors
+    never loads a whole cast however large it is.
+
+    Args:
+        model: The Movie or Actor model of the rows
+        ids: A list of ints representing the identifiers of the rows
+        limit: An int representing the number of entries to get per row
+            (default: global CAST_LIMIT)
+
+    Returns:
+        summaries: A dict mapping the ids to a list of dicts representing the
+            first cast entries, in id order, and an int representing the
+            cast size. Rows without a cast are left out
+    """
+    fields = CASTS[model][3]
+    summaries = {}
+
+    if not ids:
+        return summaries
+
+    for row in cast_summaries_statement(model).execute(
+        db.session, ids=list(ids), limit=limit
+    ):
+        entry_list, _ = summaries.setdefault(row.owner_id, ([], row.total))
+        entry_list.append(format_cast_entry(fields, row[1 : len(fields) + 1]))
+
+    return summaries
+
+
+@cached_statement
+def cast_page_statement(model):
+    """Builds the statement of cast_page.
+
+    Args:
+        model: The Movie or Actor model of the row
+
+    Returns:
+        A SQLAlchemy Select object taking the resource_id, after_id and
+        limit parameters
+    """
+    column, cast_column, cast_model, fields = CASTS[model]
+
+    return (
+        select([getattr(cast_model, field) for field in fields])
+        .select_from(
+            movie_actors.join(cast_model, cast_model.id == cast_column)
+        )
+        .where(
+            and_(
+                column == bindparam("resource_id"),
+                cast_column > bindparam("after_id"),
+                cast_model.deleted_at.is_(None),
+            )
+        )
+        .order_by(cast_column)
+        .limit(bindparam("limit"))
+    )
+
+
+def cast_page(model, resource_id, after_id=0, limit=CAST_LIMIT):
+    """Gets the live cast entries of a row after an id, in id order.
+
+    The entries are found by seeking on the movie_actors index of the row's
+    side of the cast, so deep pages cost the same as the first one.
+
+    Args:
+        model: The Movie or Actor model of the row
+        resource_id: An int representing the identifier of the row
+        after_id: An int representing the identifier of the last entry
+            already seen (default: 0)
+        limit: An int representing the number of entries to get (default:
+            global CAST_LIMIT)
+
+    Returns:
+        A list of dicts representing the cast entries
+    """
+    fields = CASTS[model][3]
+    rows = cast_page_statement(model).execute(
+        db.session, resource_id=resource_id, after_id=after_id, limit=limit
+    )
+
+    return [format_cast_entry(fields, row) for row in rows]
+
+
+@cached_statement
+def cast_size_statement(model):
+    """Builds the statement of cast_size.
+
+    Args:
+        model: The Movie or Actor model of the row
+
+    Returns:
+        A SQLAlchemy Select object taking the resource_id parameter
+    """
+    column, cast_column, cast_model, _ = CASTS[model]
+
+    return (
+        select([func.count()])
+        .select_from(
+            movie_actors.join(cast_model, cast_model.id == cast_column)
+        )
+        .where(
+            and_(
+                column == bindparam("resource_id"),
+                cast_model.deleted_at.is_(None),
+            )
+        )
+    )
+
+
+def cast_size(model, resource_id):
+    """Counts the live cast entries of a row.
+
+    Args:
+        model: The Movie or Actor model of the row
+        resource_id: An int representing the identifier of the row
+
+    Returns:
+        An int representing the number of cast entries
+    """
+    return (
+        cast_size_statement(model)
+        .execute(db.session, resource_id=resource_id)
+        .scalar()
+    )
+
+
+def find_live(model, **values):
+    """Gets a live row by the values of some of its columns.
+
+    The query is baked, so it is built and compiled once per model and set
+    of columns rather than on every call.
+
+    Args:
+        model: The Movie or Actor model to query
+        **values: The values of the columns to match
+
+    Returns:
+        The first Movie or Actor object matching, or None
+    """
+    query = bakery(lambda session: session.query(model), model)
+    query += lambda query: query.filter(model.deleted_at.is_(None))
+
+    for key in sorted(values):
+        query.add_criteria(
+            lambda query, key=key: query.filter(
+                getattr(model, key) == bindparam(key)
+            ),
+            key,
+        )
+
+    return query(db.session()).params(**values).first()
+
+
+def encode_document(resource, cast):
+    """Encodes a movie or actor as it is stored in the read model.
+
+    The json is encoded the way jsonify encodes it, so pages of documents
+    can be joined into a response as they are.
+
+    Args:
+        resource: The Movie or Actor object to encode
+        cast: A tuple of the first cast entries and the cast size of the
+            object, as returned by cast_summaries
+
+    Returns:
+        A str representing the json of the formatted object
+    """
+    return json.dumps(
+        resource.format(cast=cast), separators=(",", ":"), sort_keys=True
+    )
+
+
+def refresh_documents(model, criterion):
+    """Rebuilds the read model rows of the movies or actors matching a filter.
+
+    The rows of live movies or actors are upserted and those of deleted ones
+    are removed, so concurrent writes to the same resource do not collide.
+    Pending changes are flushed first, and the casts are read from
+    movie_actors so that links written without the ORM are seen.
+
+    Args:
+        model: The Movie or Actor model of the rows
+        criterion: A SQLAlchemy clause selecting the rows
+    """
+    table, sort_column = READ_MODELS[model]
+    deleted_ids = db.session.query(model.id).filter(
+        criterion, model.deleted_at.isnot(None)
+    )
+    db.session.execute(
+        table.delete().where(table.c.id.in_(deleted_ids.subquery()))
+    )
+    resources = model.live().filter(criterion).all()
+    summaries = cast_summaries(model, [resource.id for resource in resources])
+    rows = [
+        {
+            "id": resource.id,
+            "sort_key": getattr(resource, sort_column.key),
+            "body": encode_document(
+                resource, summaries.get(resource.id, ([], 0))
+            ),
+        }
+        for resource in resources
+    ]
+
+    if rows:
+        db.session.execute(upsert(table), rows)
+
+
+def rebuild_documents(model, criterion=True):
+    """Rebuilds the read model rows of many movies or actors.
+
+    The rows are rebuilt DOCUMENT_CHUNK_SIZE at a time, each chunk in its own
+    transaction, e.g. after a bulk import or to fill the read model of an
+    existing db.
+
+    Args:
+        model: The Movie or Actor model of the rows
+        criterion: A SQLAlchemy clause selecting the rows (default: True,
+            meaning every row)
+
+    Returns:
+        count: An int representing the number of rows rebuilt
+    """
+    count = 0
+    last_id = 0
+
+    while True:
+        ids = [
+            row_id
+            for (row_id,) in db.session.query(model.id)
+            .filter(criterion, model.id > last_id)
+            .order_by(model.id)
+            .limit(DOCUMENT_CHUNK_SIZE)
+        ]
+
+        if not ids:
+            return count
+
+        refresh_documents(
+            model, and_(criterion, model.id.between(ids[0], ids[-1]))
+        )
+        db.session.commit()
+        db.session.expunge_all()
+        count += len(ids)
+        last_id = ids[-1]
+
+
+def touch(model, criterion):
+    """Marks rows as updated now so that delta syncs pick them up.
+
+    Their read model rows are rebuilt as well.
+
+    Args:
+        model: The Movie or Actor model of the rows
+        criterion: A SQLAlchemy clause selecting the rows
+    """
+    model.query.filter(criterion).update(
+        {"updated_at": datetime.datetime.utcnow()}, synchronize_session=False
+    )
+    refresh_documents(model, criterion)
+
+
+def touch_cast(model, history):
+    """Marks the movies or actors added to or removed from a cast as updated.
+
+    Args:
+        model: The Movie or Actor model of the other side of the cast
+        history: A SQLAlchemy History of the cast relationship, empty if it
+            was not loaded; new rows are skipped as they get updated_at on
+            insert
+    """
+    ids = [
+        resource.id
+        for resource in [*(history.added or ()), *(history.deleted or ())]
+        if resource.id is not None
+    ]
+
+    if ids:
+        touch(model, model.id.in_(ids))
+
+
+def link(movie_ids, actor_ids):
+    """Inserts the missing movie_actors rows for every movie/actor pair.
+
+    Only the given rows are written, the existing collections are not loaded.
+    The movies and actors are marked as updated.
+
+    Args:
+        movie_ids: A list of ints representing the identifiers of movies
+        actor_ids: A list of ints representing the identifiers of actors
+    """
+    rows = [
+        {"movie_id": movie_id, "actor_id": actor_id}
+        for movie_id in movie_ids
+        for actor_id in actor_ids
+    ]
+
+    if rows:
+        db.session.execute(insert_ignore(movie_actors), rows)
+        touch(Movie, Movie.id.in_(movie_ids))
+        touch(Actor, Actor.id.in_(actor_ids))
+
+
+def unlink(movie_ids, actor_ids):
+    """Deletes the movie_actors rows for every movie/actor pair.
+
+    Only the given rows are deleted, the existing collections are not loaded.
+    The movies and actors are marked as updated.
+
+    Args:
+        movie_ids: A list of ints representing the identifiers of movies
+        actor_ids: A list of ints representing the identifiers of actors
+    """
+    if movie_ids and actor_ids:
+        db.session.execute(
+            movie_actors.delete().where(
+                and_(
+                    movie_actors.c.movie_id.in_(movie_ids),
+                    movie_actors.c.actor_id.in_(actor_ids),
+                )
+            )
+        )
+        touch(Movie, Movie.id.in_(movie_ids))
+        touch(Actor, Actor.id.in_(actor_ids))
+
+
+def record_change(resource, action, resource_id, data=None):
+    """Adds an event for a write to the change feed, in its transaction.
+
+    The event is numbered by its id and published once the write commits.
+    On PostgreSQL the writers take a transaction-level advisory lock first,
+    so events commit in the order of their ids and a reader never skips an
+    id still in flight, and the listening workers are notified.
+
+    Args:
+        resource: A str representing the resource type, "movie" or "actor"
+        action: A str representing the write, "created", "updated" or
+            "deleted"
+        resource_id: An int representing the identifier of the resource
+        data: A dict representing the resource after the write, or None
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"),
+            {"key": CHANGE_LOCK_KEY},
+        )
+        db.session.execute(text(f"NOTIFY {CHANGE_CHANNEL}"))
+
+    db.session.add(
+        ChangeEvent(
+            resource=resource,
+            action=action,
+            resource_id=resource_id,
+            data=json.dumps(data) if data is not None else None,
+        )
+    )
 
 
 class Movie(db.Model):
@@ -50,8 +604,12 @@ class Movie(db.Model):
         title: A str representing the title of the movie
         release_date: A date representing the release date of the movie
         poster: A str representing a url to an image of the movie's poster
+        updated_at: A datetime representing when the movie, or its cast, last
+            changed
+        deleted_at: A datetime representing when the movie was deleted, None
+            unless it is a tombstone waiting to be purged
         actors: A list of Actor objects representing the actors that play in
-            the movie
+            the movie, excluding deleted actors
     """
 
     __tablename__ = "movies"
@@ -60,26 +618,178 @@ class Movie(db.Model):
     title = Column(String)
     release_date = Column(Date)
     poster = Column(String)
-    actors = relationship("Actor", secondary=movie_actors, backref="movies")
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
+    deleted_at = Column(DateTime)
+    actors = relationship(
+        "Actor",
+        secondary=movie_actors,
+        secondaryjoin=lambda: and_(
+            Actor.id == movie_actors.c.actor_id, Actor.deleted_at.is_(None)
+        ),
+        back_populates="movies",
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_movies_live_title",
+            title,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        Index("ix_movies_updated_at", updated_at, id),
+        Index(
+            "ix_movies_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None),
+            sqlite_where=deleted_at.isnot(None),
+        ),
+    )
+
+    @classmethod
+    def live(cls):
+        """Queries the movies that are not deleted.
+
+        Returns:
+            A SQLAlchemy Query of movie objects
+        """
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    def cast_ids(self):
+        """Queries the ids of the actors cast in the movie.
+
+        Returns:
+            A SQLAlchemy Query of actor ids
+        """
+        return db.session.query(movie_actors.c.actor_id).filter(
+            movie_actors.c.movie_id == self.id
+        )
 
     def insert(self):
-        """Inserts a new movie object into the db."""
+        """Inserts a new movie object into the db.
+
+        The actors it is cast with are marked as updated.
+        """
         db.session.add(self)
+        touch_cast(Actor, inspect(self).attrs.actors.history)
+        db.session.flush()
+        refresh_documents(Movie, Movie.id == self.id)
+        self.publish("created")
         db.session.commit()
 
-    @staticmethod
-    def update():
-        """Updates an existing movie object in the db."""
+    def update(self):
+        """Updates an existing movie object in the db.
+
+        The actors added to or removed from its cast are marked as updated,
+        as are all of its actors if the fields they show changed.
+        """
+        state = inspect(self)
+        renamed = any(
+            state.attrs[field].history.has_changes()
+            for field in ("title", "release_date")
+        )
+        touch_cast(Actor, state.attrs.actors.history)
+
+        if renamed:
+            touch(Actor, Actor.id.in_(self.cast_ids()))
+
+        self.updated_at = datetime.datetime.utcnow()
+        refresh_documents(Movie, Movie.id == self.id)
+        self.publish("updated")
         db.session.commit()
 
     def delete(self):
-        """Deletes an existing movie object from the db."""
-        db.session.delete(self)
+        """Marks an existing movie object as deleted.
+
+        The row and its cast links are left for the purge job to remove, and
+        the actors it was cast with are marked as updated.
+        """
+        self.deleted_at = datetime.datetime.utcnow()
+        self.updated_at = self.deleted_at
+        touch(Actor, Actor.id.in_(self.cast_ids()))
+        refresh_documents(Movie, Movie.id == self.id)
+        self.publish("deleted")
         db.session.commit()
 
-    def format(self):
+    def publish(self, action):
+        """Records a write to the movie object on the change feed.
+
+        It is recorded in the transaction of the write, so it is published
+        once the write commits. Only the column fields are sent, so the
+        relationship is not loaded.
+
+        Args:
+            action: A str representing the write, "created", "updated" or
+                "deleted"
+        """
+        data = None
+
+        if action != "deleted":
+            data = self.format(self.__table__.columns.keys())
+
+        record_change("movie", action, self.id, data)
+
+    def add_actors(self, actor_ids):
+        """Adds actors to the movie without loading its current actors.
+
+        Args:
+            actor_ids: A list of ints representing the identifiers of the
+                actors to add
+        """
+        link([self.id], actor_ids)
+        db.session.expire(self, ["actors"])
+
+    def remove_actors(self, actor_ids):
+        """Removes actors from the movie without loading its current actors.
+
+        Args:
+            actor_ids: A list of ints representing the identifiers of the
+                actors to remove
+        """
+        unlink([self.id], actor_ids)
+        db.session.expire(self, ["actors"])
+
+    def cast_summary(self):
+        """Gets the first CAST_LIMIT actors of the movie and their number.
+
+        The actors relationship is used when it is already loaded, e.g. on
+        a new movie, otherwise only the first actors are read.
+
+        Returns:
+            A tuple of a list of dicts representing the actors, in id order,
+            and an int representing the number of actors
+        """
+        if "actors" in inspect(self).dict:
+            actors = sorted(self.actors, key=lambda actor: actor.id or 0)
+
+            return (
+                [
+                    {"id": actor.id, "name": actor.name}
+                    for actor in actors[:CAST_LIMIT]
+                ],
+                len(actors),
+            )
+
+        return cast_summaries(Movie, [self.id]).get(self.id, ([], 0))
+
+    def format(self, fields=None, cast=None):
         """Formats the movie object as a dict.
 
+        Only the first CAST_LIMIT actors are included, along with the number
+        of actors.
+
+        Args:
+            fields: A collection of strs representing the keys to include
+                (default: None, meaning all keys). The actors are only read
+                when they are requested
+            cast: A tuple of the first actors and the number of actors, as
+                returned by cast_summaries (default: None, meaning they are
+                read when requested)
+
         Returns:
             movie: A dict representing the movie object
         """
@@ -92,11 +802,20 @@ class Movie(db.Model):
                 else None
             ),
             "poster": self.poster,
-            "actors": [
-                {"id": actor.id, "name": actor.name} for actor in self.actors
-            ],
         }
 
+        if fields is None or "actors" in fields:
+            movie["actors"], movie["total_actors"] = (
+                cast if cast is not None else self.cast_summary()
+            )
+
+        if fields is not None:
+            movie = {
+                key: value
+                for key, value in movie.items()
+                if key in fields or key == "total_actors"
+            }
+
         return movie
 
 
@@ -109,6 +828,12 @@ class Actor(db.Model):
         birthdate: An date representing the birthdate of the actor
         gender: A str representing the gender of the actor
         image: A str representing a url to an image of the actor
+        updated_at: A datetime representing when the actor, or its cast, last
+            changed
+        deleted_at: A datetime representing when the actor was deleted, None
+            unless it is a tombstone waiting to be purged
+        movies: A list of Movie objects representing the movies the actor
+            plays in, excluding deleted movies
     """
 
     __tablename__ = "actors"
@@ -118,25 +843,183 @@ class Actor(db.Model):
     birthdate = Column(Date)
     gender = Column(String)
     image = Column(String)
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
+    deleted_at = Column(DateTime)
+    movies = relationship(
+        "Movie",
+        secondary=movie_actors,
+        secondaryjoin=lambda: and_(
+            Movie.id == movie_actors.c.movie_id, Movie.deleted_at.is_(None)
+        ),
+        back_populates="actors",
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_actors_live_name",
+            name,
+            postgresql_where=deleted_at.is_(None),
+            sqlite_where=deleted_at.is_(None),
+        ),
+        Index("ix_actors_updated_at", updated_at, id),
+        Index(
+            "ix_actors_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None),
+            sqlite_where=deleted_at.isnot(None),
+        ),
+    )
+
+    @classmethod
+    def live(cls):
+        """Queries the actors that are not deleted.
+
+        Returns:
+            A SQLAlchemy Query of actor objects
+        """
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    def cast_ids(self):
+        """Queries the ids of the movies the actor is cast in.
+
+        Returns:
+            A SQLAlchemy Query of movie ids
+        """
+        return db.session.query(movie_actors.c.movie_id).filter(
+            movie_actors.c.actor_id == self.id
+        )
 
     def insert(self):
-        """Inserts a new actor object into the db."""
+        """Inserts a new actor object into the db.
+
+        The movies it is cast with are marked as updated.
+        """
         db.session.add(self)
+        touch_cast(Movie, inspect(self).attrs.movies.history)
+        db.session.flush()
+        refresh_documents(Actor, Actor.id == self.id)
+        self.publish("created")
         db.session.commit()
 
-    @staticmethod
-    def update():
-        """Updates an existing actor object in the db."""
+    def update(self):
+        """Updates an existing actor object in the db.
+
+        The movies added to or removed from its cast are marked as updated,
+        as are all of its movies if its name changed.
+        """
+        state = inspect(self)
+        renamed = state.attrs.name.history.has_changes()
+        touch_cast(Movie, state.attrs.movies.history)
+
+        if renamed:
+            touch(Movie, Movie.id.in_(self.cast_ids()))
+
+        self.updated_at = datetime.datetime.utcnow()
+        refresh_documents(Actor, Actor.id == self.id)
+        self.publish("updated")
         db.session.commit()
 
     def delete(self):
-        """Deletes an existing actor object from the db."""
-        db.session.delete(self)
+        """Marks an existing actor object as deleted.
+
+        The row and its cast links are left for the purge job to remove, and
+        the movies it was cast with are marked as updated.
+        """
+        self.deleted_at = datetime.datetime.utcnow()
+        self.updated_at = self.deleted_at
+        touch(Movie, Movie.id.in_(self.cast_ids()))
+        refresh_documents(Actor, Actor.id == self.id)
+        self.publish("deleted")
         db.session.commit()
 
-    def format(self):
+    def publish(self, action):
+        """Records a write to the actor object on the change feed.
+
+        It is recorded in the transaction of the write, so it is published
+        once the write commits. Only the column fields are sent, so the
+        relationship is not loaded.
+
+        Args:
+            action: A str representing the write, "created", "updated" or
+                "deleted"
+        """
+        data = None
+
+        if action != "deleted":
+            data = self.format(self.__table__.columns.keys())
+
+        record_change("actor", action, self.id, data)
+
+    def add_movies(self, movie_ids):
+        """Adds movies to the actor without loading its current movies.
+
+        Args:
+            movie_ids: A list of ints representing the identifiers of the
+                movies to add
+        """
+        link(movie_ids, [self.id])
+        db.session.expire(self, ["movies"])
+
+    def remove_movies(self, movie_ids):
+        """Removes movies from the actor without loading its current movies.
+
+        Args:
+            movie_ids: A list of ints representing the identifiers of the
+                movies to remove
+        """
+        unlink(movie_ids, [self.id])
+        db.session.expire(self, ["movies"])
+
+    def cast_summary(self):
+        """Gets the first CAST_LIMIT movies of the actor and their number.
+
+        The movies relationship is used when it is already loaded, e.g. on
+        a new actor, otherwise only the first movies are read.
+
+        Returns:
+            A tuple of a list of dicts representing the movies, in id order,
+            and an int representing the number of movies
+        """
+        if "movies" in inspect(self).dict:
+            movies = sorted(self.movies, key=lambda movie: movie.id or 0)
+
+            return (
+                [
+                    {
+                        "id": movie.id,
+                        "title": movie.title,
+                        "release_date": (
+                            str(movie.release_date)
+                            if movie.release_date is not None
+                            else None
+                        ),
+                    }
+                    for movie in movies[:CAST_LIMIT]
+                ],
+                len(movies),
+            )
+
+        return cast_summaries(Actor, [self.id]).get(self.id, ([], 0))
+
+    def format(self, fields=None, cast=None):
         """Formats the actor object as a dict.
 
+        Only the first CAST_LIMIT movies are included, along with the number
+        of movies.
+
+        Args:
+            fields: A collection of strs representing the keys to include
+                (default: None, meaning all keys). The movies are only read
+                when they are requested
+            cast: A tuple of the first movies and the number of movies, as
+                returned by cast_summaries (default: None, meaning they are
+                read when requested)
+
         Returns:
             actor: A dict representing the actor object
         """
@@ -148,18 +1031,172 @@ class Actor(db.Model):
             ),
             "gender": self.gender,
             "image": self.image,
-            "movies": [
-                {
-                    "id": movie.id,
-                    "title": movie.title,
-                    "release_date": (
-                        str(movie.release_date)
-                        if movie.release_date is not None
-                        else None
-                    ),
-                }
-                for movie in self.movies
-            ],
         }
 
+        if fields is None or "movies" in fields:
+            actor["movies"], actor["total_movies"] = (
+                cast if cast is not None else self.cast_summary()
+            )
+
+        if fields is not None:
+            actor = {
+                key: value
+                for key, value in actor.items()
+                if key in fields or key == "total_movies"
+            }
+
         return actor
+
+
+READ_MODELS = {
+    Movie: (movie_documents, Movie.title),
+    Actor: (actor_documents, Actor.name),
+}
+CASTS = {
+    Movie: (
+        movie_actors.c.movie_id,
+        movie_actors.c.actor_id,
+        Actor,
+        ("id", "name"),
+    ),
+    Actor: (
+        movie_actors.c.actor_id,
+        movie_actors.c.movie_id,
+        Movie,
+        ("id", "title", "release_date"),
+    ),
+}
+
+
+class IdempotencyKey(db.Model):
+    """A model representing a write made with an Idempotency-Key header.
+
+    Attributes:
+        key: A str representing a hash of the client and the header value
+        fingerprint: A str representing a hash of the request the key was
+            first used with
+        status_code: An int representing the status of the stored response,
+            None while the request is still being handled
+        body: A str representing the body of the stored response
+        created_at: A datetime representing when the key was first used
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    body = Column(Text)
+    created_at = Column(
+        DateTime, nullable=False, index=True, default=datetime.datetime.utcnow
+    )
+
+
+class Job(db.Model):
+    """A model representing an operation run in the background.
+
+    Attributes:
+        id: An int that serves as the unique identifier for a job
+        kind: A str representing the operation, naming its job handler
+        target_id: An int representing the identifier of the resource the
+            operation acts on
+        owner: A str representing the sub claim of the user who started it
+        status: A str representing the progress of the job, "queued",
+            "running", "succeeded" or "failed"
+        done: An int representing the number of rows processed so far
+        total: An int representing the estimated number of rows to process
+        cursor: A str representing the json position the job continues
+            from
+        result: A str representing the json result of a finished job
+        error: A str representing why a failed job failed
+        created_at: A datetime representing when the job was queued
+        updated_at: A datetime representing when the job last made progress
+    """
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    target_id = Column(Integer)
+    owner = Column(String)
+    status = Column(String, nullable=False, index=True, default="queued")
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    cursor = Column(Text)
+    result = Column(Text)
+    error = Column(Text)
+    created_at = Column(
+        DateTime, nullable=False, default=datetime.datetime.utcnow
+    )
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.datetime.utcnow
+    )
+
+    def insert(self):
+        """Inserts a new job object into the db."""
+        db.session.add(self)
+        db.session.commit()
+
+    def format(self):
+        """Formats the job object as a dict.
+
+        Returns:
+            job: A dict representing the job object
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target_id": self.target_id,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+class ChangeEvent(db.Model):
+    """A model representing an event of the change feed.
+
+    Attributes:
+        id: An int that serves as the sequence number of the event
+        resource: A str representing the resource type, "movie" or "actor"
+        action: A str representing the write, "created", "updated" or
+            "deleted"
+        resource_id: An int representing the identifier of the resource
+        data: A str representing the json of the resource after the write,
+            None for a delete
+        created_at: A datetime representing when the event was recorded
+    """
+
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True)
+    resource = Column(String, nullable=False)
+    action = Column(String, nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    data = Column(Text)
+    created_at = Column(
+        DateTime, nullable=False, index=True, default=datetime.datetime.utcnow
+    )
+
+
+class StreamTicket(db.Model):
+    """A model representing a ticket opening one change feed stream.
+
+    Attributes:
+        key: A str representing the sha256 hex digest of the ticket, which
+            is not stored itself
+        permissions: A str representing the json list of the permissions of
+            the access token the ticket was issued for
+        expires_at: A datetime representing when the ticket stops being
+            accepted
+    """
+
+    __tablename__ = "stream_tickets"
+
+    key = Column(String(64), primary_key=True)
+    permissions = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
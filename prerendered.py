@@ -0,0 +1,49 @@
+"""Responses rendered once per deployment and served from memory.
+
+Classes:
+    PrerenderedResponse()
+"""
+
+import hashlib
+
+from flask import Response, request
+
+
+class PrerenderedResponse:
+    """A response body rendered once and revalidated with its ETag.
+
+    Attributes:
+        body: A bytes object representing the rendered body
+        mimetype: A str representing the mimetype of the body
+        cache_control: A str representing the Cache-Control header
+        etag: A str representing the ETag of the body
+    """
+
+    def __init__(self, body, mimetype, cache_control):
+        """Set-up for PrerenderedResponse.
+
+        Args:
+            body: A str or bytes object representing the rendered body
+            mimetype: A str representing the mimetype of the body
+            cache_control: A str representing the Cache-Control header
+        """
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.body = body
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+    def serve(self):
+        """Serves the rendered body for the current request.
+
+        Returns:
+            response: A response object holding the body, or an empty 304
+                response if the client already holds it
+        """
+        response = Response(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        response.headers["Cache-Control"] = self.cache_control
+
+        return response.make_conditional(request)
@@ -0,0 +1,104 @@
+"""A sampling profiler of the threads of the worker process.
+
+The stacks of every other thread are sampled at a fixed interval for a
+number of seconds, and counted in the folded format read by flamegraph.pl,
+inferno and speedscope: one line per distinct stack, its frames from the
+thread down to the innermost call separated by semicolons, followed by
+the number of samples it was seen in. Only the process handling the
+request is profiled, and one profile is taken at a time.
+
+Attributes:
+    PROFILE_ENABLED: A bool representing whether profiles may be taken
+    PROFILE_INTERVAL: A float representing the seconds between samples
+    PROFILE_MAX_SECONDS: An int representing the longest profile allowed
+    profile_lock: A Lock held while a profile is being taken
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+PROFILE_ENABLED = os.environ.get("DEBUG_PROFILE", "0") == "1"
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+
+profile_lock = threading.Lock()
+
+
+def format_frame(frame):
+    """Names a stack frame by its function, file and first line.
+
+    Args:
+        frame: A Python frame object
+
+    Returns:
+        A str representing the frame, without semicolons
+    """
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(
+        ";", ":"
+    )
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """Samples the stacks of the other threads of the process.
+
+    Args:
+        seconds: A float representing how long to sample for
+        interval: A float representing the seconds between samples
+            (default: global PROFILE_INTERVAL)
+
+    Returns:
+        stacks: A Counter mapping folded stacks to the number of samples
+            they were seen in
+    """
+    stacks = collections.Counter()
+    own_id = threading.get_ident()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+
+            frames = []
+
+            while frame is not None:
+                frames.append(format_frame(frame))
+                frame = frame.f_back
+
+            frames.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(frames))] += 1
+
+        time.sleep(interval)
+
+    return stacks
+
+
+def profile(seconds):
+    """Takes a profile unless one is already being taken.
+
+    Args:
+        seconds: A float representing how long to sample for
+
+    Returns:
+        A str holding the folded stacks, or None if a profile is already
+        being taken
+    """
+    if not profile_lock.acquire(blocking=False):
+        return None
+
+    try:
+        stacks = sample_stacks(seconds)
+    finally:
+        profile_lock.release()
+
+    return "".join(
+        f"{stack} {count}\n" for stack, count in sorted(stacks.items())
+    )
@@ -0,0 +1,258 @@
+"""Read-only movie and actor rows selected without the ORM.
+
+Reads that only format rows and throw them away select plain column
+tuples with SQLAlchemy Core and wrap them in Record objects using
+__slots__, so no model objects are created, added to the session's
+identity map or tracked for changes. Records are formatted with the same
+format methods as the models, so both paths return the same json. The
+pages of the read model are read here too. The statements run on every
+request are cached statements (see statements.py).
+
+Attributes:
+    EXPORT_CHUNK_SIZE: An int representing the number of rows read per
+        query while exporting
+
+Classes:
+    Record()
+    MovieRecord()
+    ActorRecord()
+"""
+
+import json
+
+from sqlalchemy import bindparam, func, select
+
+from models import READ_MODELS, Actor, Movie, cast_summaries, db
+from statements import cached_statement
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+class Record:
+    """A read-only row of a model, holding its columns in slots.
+
+    Attributes:
+        model: The Movie or Actor model the row belongs to
+    """
+
+    __slots__ = ()
+    model = None
+
+    def __init__(self, row):
+        """Set-up for Record.
+
+        Args:
+            row: A tuple representing the values of the columns, in slot
+                order
+        """
+        for field, value in zip(self.__slots__, row):
+            setattr(self, field, value)
+
+    @classmethod
+    def select(cls, *criteria):
+        """Builds a select of the row's columns.
+
+        Args:
+            *criteria: SQLAlchemy clauses filtering the rows
+
+        Returns:
+            A SQLAlchemy Select object
+        """
+        statement = select(
+            [getattr(cls.model, field) for field in cls.__slots__]
+        )
+
+        for criterion in criteria:
+            statement = statement.where(criterion)
+
+        return statement
+
+    @classmethod
+    def fetch(cls, statement):
+        """Runs a select built by select and wraps its rows.
+
+        Args:
+            statement: A SQLAlchemy Select object
+
+        Returns:
+            A list of records
+        """
+        return [cls(row) for row in db.session.execute(statement)]
+
+    @classmethod
+    def first_live(cls, resource_id):
+        """Gets a row that is not deleted.
+
+        Args:
+            resource_id: An int representing the identifier of the row
+
+        Returns:
+            record: The record, or None if there is no such live row
+        """
+        row = (
+            first_live_statement(cls)
+            .execute(db.session, resource_id=resource_id)
+            .first()
+        )
+
+        return cls(row) if row is not None else None
+
+    def cast_summary(self):
+        """Gets the first entries of the row's cast and its size.
+
+        Returns:
+            A tuple of a list of dicts representing the entries, in id
+            order, and an int representing the cast size
+        """
+        return cast_summaries(self.model, [self.id]).get(self.id, ([], 0))
+
+
+class MovieRecord(Record):
+    """A read-only movie row, formatted like a Movie object."""
+
+    __slots__ = (
+        "id",
+        "title",
+        "release_date",
+        "poster",
+        "updated_at",
+        "deleted_at",
+    )
+    model = Movie
+    format = Movie.format
+
+
+class ActorRecord(Record):
+    """A read-only actor row, formatted like an Actor object."""
+
+    __slots__ = (
+        "id",
+        "name",
+        "birthdate",
+        "gender",
+        "image",
+        "updated_at",
+        "deleted_at",
+    )
+    model = Actor
+    format = Actor.format
+
+
+@cached_statement
+def first_live_statement(record_class):
+    """Builds the statement of Record.first_live.
+
+    Args:
+        record_class: The MovieRecord or ActorRecord class of the row
+
+    Returns:
+        A SQLAlchemy Select object taking the resource_id parameter
+    """
+    model = record_class.model
+
+    return record_class.select(
+        model.id == bindparam("resource_id"), model.deleted_at.is_(None)
+    )
+
+
+@cached_statement
+def document_page_statement(model):
+    """Builds the statement of document_page.
+
+    Args:
+        model: The Movie or Actor model being paged
+
+    Returns:
+        A SQLAlchemy Select object taking the limit and offset parameters
+    """
+    table = READ_MODELS[model][0]
+
+    return (
+        select([table.c.body])
+        .order_by(table.c.sort_key, table.c.id)
+        .limit(bindparam("limit"))
+        .offset(bindparam("offset"))
+    )
+
+
+@cached_statement
+def document_count_statement(model):
+    """Builds the statement of document_count.
+
+    Args:
+        model: The Movie or Actor model being paged
+
+    Returns:
+        A SQLAlchemy Select object
+    """
+    table = READ_MODELS[model][0]
+
+    return select([func.count(table.c.id)])
+
+
+def document_page(model, page, per_page):
+    """Gets the pre-encoded json of a page of live movies or actors.
+
+    Args:
+        model: The Movie or Actor model being paged
+        page: An int representing the page, from 1
+        per_page: An int representing the number of rows per page
+
+    Returns:
+        A list of strs representing the json of the rows, in page order
+    """
+    rows = document_page_statement(model).execute(
+        db.session, limit=per_page, offset=(page - 1) * per_page
+    )
+
+    return [body for (body,) in rows]
+
+
+def document_count(model):
+    """Counts the live movies or actors in the read model.
+
+    Args:
+        model: The Movie or Actor model being paged
+
+    Returns:
+        An int representing the number of rows
+    """
+    return document_count_statement(model).execute(db.session).scalar()
+
+
+def export_ndjson(record_class):
+    """Exports the live rows of a model as json lines, in id order.
+
+    The rows are read EXPORT_CHUNK_SIZE at a time by seeking on the id, so
+    memory use does not grow with the size of the catalog.
+
+    Args:
+        record_class: The MovieRecord or ActorRecord class to export
+
+    Yields:
+        A str holding the json lines of a chunk of rows
+    """
+    model = record_class.model
+    last_id = 0
+
+    while True:
+        records = record_class.fetch(
+            record_class.select(model.deleted_at.is_(None), model.id > last_id)
+            .order_by(model.id)
+            .limit(EXPORT_CHUNK_SIZE)
+        )
+
+        if not records:
+            return
+
+        summaries = cast_summaries(model, [record.id for record in records])
+        yield "".join(
+            json.dumps(
+                record.format(cast=summaries.get(record.id, ([], 0))),
+                separators=(",", ":"),
+                sort_keys=True,
+            )
+            + "\n"
+            for record in records
+        )
+        last_id = records[-1].id
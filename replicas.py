@@ -0,0 +1,318 @@
+"""Routing of read-only requests to read replicas of the db.
+
+GET and HEAD requests read from one of the replicas configured as
+SQLALCHEMY_BINDS named with REPLICA_BIND_PREFIX. Everything else, and any
+read made within STICKY_SECONDS of the same client writing, goes to the
+primary so that clients always read their own writes. Delta syncs also
+read from the primary: a replica lagging behind would hide rows older
+than the cursor the client moves on to, and they would never be synced.
+
+Attributes:
+    PRIMARY_QUERY_ARGS: A tuple of strs representing the query parameters
+        of reads that must see every committed row
+    REPLICA_BIND_PREFIX: A str representing the prefix of the bind keys that
+        name read replicas
+    RETRY_SECONDS: An int representing how long a failed replica is skipped
+        before it is tried again
+    STICKY_COOKIE: A str representing the name of the cookie that marks a
+        client which recently wrote
+    STICKY_SECONDS: An int representing how long after a write a client keeps
+        reading from the primary
+    STRATEGIES: A tuple of strs representing the supported replica selection
+        strategies
+    replica_set: A ReplicaSet shared by every RoutingSession
+
+Classes:
+    ReplicaSet()
+    RoutingSession()
+    RoutingSQLAlchemy()
+"""
+
+import hashlib
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine.url import make_url
+
+PRIMARY_QUERY_ARGS = ("updated_since",)
+REPLICA_BIND_PREFIX = "replica_"
+RETRY_SECONDS = 30
+STICKY_COOKIE = "read_primary"
+STICKY_SECONDS = 5
+STRATEGIES = ("round_robin", "least_loaded")
+
+
+class ReplicaSet:
+    """Chooses a healthy read replica and tracks which clients recently wrote.
+
+    Attributes:
+        names: A list of strs representing the bind keys of the replicas
+        strategy: A str representing how a replica is chosen, one of
+            STRATEGIES
+    """
+
+    def __init__(self):
+        """Set-up for ReplicaSet."""
+        self.names = []
+        self.strategy = "round_robin"
+        self._counter = itertools.count()
+        self._down_until = {}
+        self._last_write = {}
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def configure(self, names, strategy="round_robin"):
+        """Sets the replicas to route reads to.
+
+        Args:
+            names: A list of strs representing the bind keys of the replicas
+            strategy: A str representing how a replica is chosen, one of
+                STRATEGIES (default: "round_robin")
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy: {strategy}")
+
+        with self._lock:
+            self.names = list(names)
+            self.strategy = strategy
+            self._down_until.clear()
+
+    def mark_down(self, name):
+        """Skips a replica for RETRY_SECONDS after it failed.
+
+        Args:
+            name: A str representing the bind key of the replica
+        """
+        with self._lock:
+            self._down_until[name] = time.monotonic() + RETRY_SECONDS
+
+    def candidates(self, get_engine):
+        """Orders the replicas that are not marked down by preference.
+
+        Args:
+            get_engine: A function returning the engine for a bind key
+
+        Returns:
+            names: A list of strs representing the bind keys of the replicas
+        """
+        now = time.monotonic()
+        names = [
+            name for name in self.names if self._down_until.get(name, 0) <= now
+        ]
+
+        if not names:
+            return names
+
+        start = next(self._counter) % len(names)
+        names = names[start:] + names[:start]
+
+        if self.strategy == "least_loaded":
+            names.sort(key=lambda name: checked_out(get_engine(name)))
+
+        return names
+
+    def choose(self, get_engine):
+        """Chooses the engine of a replica that is not marked down.
+
+        No connection is opened here: the replica engines ping their
+        connections as they are checked out, a replica failing to connect
+        is marked down by watch, and RoutingSession then reads from the
+        primary instead.
+
+        Args:
+            get_engine: A function returning the engine for a bind key
+
+        Returns:
+            engine: A SQLAlchemy Engine for a replica, or None if every
+                replica is down
+        """
+        names = self.candidates(get_engine)
+
+        if not names:
+            return None
+
+        engine = get_engine(names[0])
+        self.watch(names[0], engine)
+
+        return engine
+
+    def watch(self, name, engine):
+        """Marks a replica down whenever it fails to connect or disconnects.
+
+        Other errors, such as statement timeouts or cancelled queries, leave
+        the replica in rotation.
+
+        Args:
+            name: A str representing the bind key of the replica
+            engine: A SQLAlchemy Engine for the replica
+        """
+        if engine in self._watched:
+            return
+
+        @event.listens_for(engine, "handle_error")
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(name)
+
+        self._watched.add(engine)
+
+    def is_sticky(self, client):
+        """Checks whether a client wrote within the last STICKY_SECONDS.
+
+        Args:
+            client: A str representing the client making the request
+
+        Returns:
+            A bool representing whether the client must read the primary
+        """
+        last_write = self._last_write.get(client)
+
+        return (
+            last_write is not None
+            and time.monotonic() - last_write < STICKY_SECONDS
+        )
+
+    def record_write(self, client):
+        """Makes a client read from the primary for STICKY_SECONDS.
+
+        Args:
+            client: A str representing the client that wrote
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            self._last_write[client] = now
+
+            if len(self._last_write) > 10000:
+                self._last_write = {
+                    key: last_write
+                    for key, last_write in self._last_write.items()
+                    if now - last_write < STICKY_SECONDS
+                }
+
+
+replica_set = ReplicaSet()
+
+
+def checked_out(engine):
+    """Counts the connections an engine's pool currently has checked out.
+
+    Args:
+        engine: A SQLAlchemy Engine
+
+    Returns:
+        An int representing the number of connections in use
+    """
+    checkedout = getattr(engine.pool, "checkedout", None)
+
+    return checkedout() if checkedout is not None else 0
+
+
+def get_client():
+    """Identifies the client making the current request.
+
+    Returns:
+        A str representing a hash of the Authorization header, or the remote
+        address for anonymous requests
+    """
+    auth = request.headers.get("Authorization") or request.remote_addr or ""
+
+    return hashlib.sha256(auth.encode()).hexdigest()
+
+
+def route_request():
+    """Decides whether the current request may read from a replica."""
+    g.use_replica = (
+        request.method in ("GET", "HEAD")
+        and bool(replica_set.names)
+        and STICKY_COOKIE not in request.cookies
+        and not any(arg in request.args for arg in PRIMARY_QUERY_ARGS)
+        and not replica_set.is_sticky(get_client())
+    )
+
+
+def record_write(response):
+    """Keeps a client that just wrote on the primary for STICKY_SECONDS.
+
+    Args:
+        response: The response object of the current request
+    """
+    if (
+        request.method in ("GET", "HEAD", "OPTIONS")
+        or response.status_code >= 400
+        or not replica_set.names
+    ):
+        return
+
+    replica_set.record_write(get_client())
+    response.set_cookie(
+        STICKY_COOKIE, "1", max_age=STICKY_SECONDS, httponly=True
+    )
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from a replica during read-only requests."""
+
+    def get_bind(self, mapper=None, clause=None):
+        """Returns the replica engine for reads in a read-only request.
+
+        The replica is chosen once per session so every statement of a
+        request sees the same snapshot, and the primary is used when no
+        replica is available. The connection to the chosen replica is opened
+        here, so a replica that fails to connect is marked down and the
+        request reads from the primary rather than failing.
+        """
+        if (
+            self._flushing
+            or not has_request_context()
+            or not g.get("use_replica")
+        ):
+            return super().get_bind(mapper, clause)
+
+        if "replica" not in self.info:
+            db = self.app.extensions["sqlalchemy"].db
+            replica = replica_set.choose(
+                lambda name: db.get_engine(self.app, bind=name)
+            )
+
+            if replica is not None:
+                try:
+                    self.connection(bind=replica)
+                except exc.DBAPIError:
+                    replica = None
+
+            self.info["replica"] = replica
+
+        if self.info["replica"] is None:
+            return super().get_bind(mapper, clause)
+
+        return self.info["replica"]
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """A SQLAlchemy service whose sessions route reads to replicas."""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """Makes the replica engines ping connections as they are checked out.
+
+        A pooled connection to a replica that went away is then replaced, or
+        the replica is marked down, before a statement runs on it.
+        """
+        replica_urls = {
+            str(make_url(url))
+            for name, url in app.config["SQLALCHEMY_BINDS"].items()
+            if name.startswith(REPLICA_BIND_PREFIX)
+        }
+
+        if str(sa_url) in replica_urls:
+            options["pool_pre_ping"] = True
+
+        super().apply_driver_hacks(app, sa_url, options)
+
+    def create_session(self, options):
+        """Creates the session factory for RoutingSession objects."""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
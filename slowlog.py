@@ -0,0 +1,257 @@
+"""A log of the slow db statements, with sampled query plans.
+
+Every statement run by an engine is timed, and those taking at least
+SLOW_QUERY_MILLISECONDS are kept in a bounded in-memory ring buffer along
+with the route that ran them and their parameters, redacted to their
+types. On PostgreSQL a sample of the slow reads is run again under
+EXPLAIN (ANALYZE, BUFFERS), within a savepoint, to capture the plan the
+db chose. The log lives in the worker process.
+
+Attributes:
+    BUFFER_SIZE: An int representing the number of slow statements kept
+    EXPLAIN_RATE: A float representing the share of slow reads whose plan
+        is captured, from 0 (never, the default) to 1 (always)
+    SLOW_QUERY_MILLISECONDS: An int representing how long a statement runs
+        before it is logged
+    STATEMENT_LENGTH: An int representing the number of characters of a
+        statement kept
+    slow_query_log: The SlowQueryLog shared by the app
+
+Classes:
+    SlowQuery()
+    SlowQueryLog()
+"""
+
+import collections
+import datetime
+import os
+import random
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUFFER_SIZE = 200
+EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0))
+SLOW_QUERY_MILLISECONDS = int(os.environ.get("SLOW_QUERY_MILLISECONDS", 200))
+STATEMENT_LENGTH = 2000
+
+SlowQuery = collections.namedtuple(
+    "SlowQuery",
+    ["logged_at", "milliseconds", "route", "statement", "parameters", "plan"],
+)
+
+
+def redact(parameters):
+    """Replaces the values of statement parameters with their types.
+
+    Args:
+        parameters: A dict, or a list or tuple, of the parameters of a
+            statement, or a list of them for an executemany
+
+    Returns:
+        A dict or list of strs naming the types of the values, or a dict
+        holding the number of rows and the first of them for an executemany
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+
+    if parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return {"rows": len(parameters), "first": redact(parameters[0])}
+
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def current_route():
+    """Names the route of the request being handled, if any.
+
+    Returns:
+        A str representing the method and url rule, or None outside of a
+        request
+    """
+    if not has_request_context():
+        return None
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+
+    return f"{request.method} {rule}"
+
+
+class SlowQueryLog:
+    """A ring buffer of the slow statements run by the engines.
+
+    Attributes:
+        threshold: A float representing the seconds a statement runs
+            before it is logged
+        explain_rate: A float representing the share of slow reads whose
+            plan is captured
+        total: An int representing the number of slow statements logged,
+            including those no longer buffered
+    """
+
+    def __init__(
+        self,
+        size=BUFFER_SIZE,
+        threshold=SLOW_QUERY_MILLISECONDS / 1000,
+        explain_rate=EXPLAIN_RATE,
+    ):
+        """Set-up for SlowQueryLog.
+
+        Args:
+            size: An int representing the number of slow statements kept
+                (default: global BUFFER_SIZE)
+            threshold: A float representing the seconds a statement runs
+                before it is logged (default: global SLOW_QUERY_MILLISECONDS)
+            explain_rate: A float representing the share of slow reads whose
+                plan is captured (default: global EXPLAIN_RATE)
+        """
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+        self.total = 0
+        self._queries = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._watching = set()
+
+    def watch(self, target=Engine):
+        """Starts timing the statements of the engines.
+
+        Args:
+            target: A SQLAlchemy Engine to time, or the Engine class to time
+                every engine (default: Engine)
+        """
+        if target in self._watching:
+            return
+
+        event.listen(target, "before_cursor_execute", self.before_execute)
+        event.listen(target, "after_cursor_execute", self.after_execute)
+        self._watching.add(target)
+
+    def before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=too-many-arguments,unused-argument
+        """Notes when a statement starts, as a before_cursor_execute event.
+
+        Args:
+            conn: The SQLAlchemy Connection running the statement
+            cursor: unused
+            statement: unused
+            parameters: unused
+            context: unused
+            executemany: unused
+        """
+        conn.info.setdefault("slow_query_started", []).append(
+            time.perf_counter()
+        )
+
+    def after_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=too-many-arguments,unused-argument
+        """Logs a statement that was slow, as an after_cursor_execute event.
+
+        Args:
+            conn: The SQLAlchemy Connection running the statement
+            cursor: The DBAPI cursor that ran the statement
+            statement: A str representing the SQL of the statement
+            parameters: The DBAPI parameters of the statement
+            context: unused
+            executemany: A bool representing whether the statement ran once
+                per row of parameters
+        """
+        started = conn.info.get("slow_query_started")
+
+        if not started:
+            return
+
+        seconds = time.perf_counter() - started.pop()
+
+        if seconds < self.threshold:
+            return
+
+        plan = None
+
+        if (
+            not executemany
+            and conn.dialect.name == "postgresql"
+            and random.random() < self.explain_rate
+            and statement.lstrip()[:7].upper() in ("SELECT ", "EXECUTE")
+        ):
+            plan = explain(cursor.connection, statement, parameters)
+
+        self.record(
+            SlowQuery(
+                datetime.datetime.utcnow().isoformat() + "Z",
+                round(seconds * 1000, 1),
+                current_route(),
+                statement[:STATEMENT_LENGTH],
+                redact(parameters),
+                plan,
+            )
+        )
+
+    def record(self, query):
+        """Adds a slow statement to the buffer.
+
+        Args:
+            query: A SlowQuery to add
+        """
+        with self._lock:
+            self._queries.append(query)
+            self.total += 1
+
+    def snapshot(self):
+        """Gets the buffered slow statements, most recent first.
+
+        Returns:
+            A dict holding the threshold, the number of slow statements
+            logged and a list of dicts representing the buffered ones
+        """
+        with self._lock:
+            queries = [query._asdict() for query in reversed(self._queries)]
+            total = self.total
+
+        return {
+            "threshold_milliseconds": self.threshold * 1000,
+            "total": total,
+            "queries": queries,
+        }
+
+
+def explain(dbapi_connection, statement, parameters):
+    """Captures the plan of a read by running it again under EXPLAIN.
+
+    The statement is run within a savepoint, so a failure does not abort the
+    transaction of the request.
+
+    Args:
+        dbapi_connection: The DBAPI connection that ran the statement
+        statement: A str representing the SQL of the statement
+        parameters: The DBAPI parameters of the statement
+
+    Returns:
+        A str representing the plan, or None if it could not be captured
+    """
+    cursor = dbapi_connection.cursor()
+
+    try:
+        cursor.execute("SAVEPOINT slow_query_explain")
+
+        try:
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters
+            )
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception:  # pylint: disable=broad-except
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            plan = None
+    except Exception:  # pylint: disable=broad-except
+        plan = None
+    finally:
+        cursor.close()
+
+    return plan
+
+
+slow_query_log = SlowQueryLog()
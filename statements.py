@@ -0,0 +1,177 @@
+"""Statements compiled once and prepared per connection, for hot queries.
+
+SQLAlchemy compiles a statement to SQL every time it is executed, and the
+db parses and plans the SQL every time it receives it. A CachedStatement
+is built once with bound parameters for the values that change between
+requests, and executed with a compiled cache so it is compiled once per
+dialect. On PostgreSQL it is also prepared on each connection the first
+time the connection runs it (PREPARE), and then only executed by name
+(EXECUTE), so the server parses and plans it once per connection.
+Statements with IN lists, whose SQL depends on the length of the list, are
+only compiled once.
+
+Prepared statements outlive transactions but not connections, so they do
+not work behind a pooler that shares server connections between
+transactions (e.g. pgbouncer in transaction mode); set
+DATABASE_PREPARED_STATEMENTS to 0 there.
+
+Attributes:
+    COMPILED_CACHE_SIZE: An int representing the number of compiled
+        statements kept
+    PREPARED_STATEMENTS: A bool representing whether statements are
+        prepared on PostgreSQL connections
+    compiled_cache: An LRUCache holding the compiled statements
+
+Classes:
+    CachedStatement()
+"""
+
+import os
+import re
+from functools import wraps
+
+from sqlalchemy import text
+from sqlalchemy.util import LRUCache
+
+COMPILED_CACHE_SIZE = 500
+PREPARED_STATEMENTS = (
+    os.environ.get("DATABASE_PREPARED_STATEMENTS", "1") == "1"
+)
+
+compiled_cache = LRUCache(COMPILED_CACHE_SIZE)
+
+
+class CachedStatement:
+    """A statement executed with a compiled cache and prepared if possible.
+
+    Attributes:
+        name: A str identifying the statement on the connections it is
+            prepared on
+        statement: A SQLAlchemy statement using bound parameters
+    """
+
+    def __init__(self, name, statement):
+        """Set-up for CachedStatement.
+
+        Args:
+            name: A str identifying the statement on the connections it is
+                prepared on
+            statement: A SQLAlchemy statement using bound parameters
+        """
+        self.name = name
+        self.statement = statement
+        self._prepared = None
+
+    def execute(self, session, **params):
+        """Executes the statement in a session.
+
+        Args:
+            session: A SQLAlchemy Session, routing the statement to its
+                bind as session.execute would
+            **params: The values of the statement's bound parameters
+
+        Returns:
+            A SQLAlchemy ResultProxy holding the rows
+        """
+        connection = session.connection(clause=self.statement)
+
+        if PREPARED_STATEMENTS and connection.dialect.name == "postgresql":
+            prepared = self.prepare(connection, params)
+
+            if prepared is not None:
+                execute, arguments = prepared
+
+                return connection.execution_options(
+                    compiled_cache=compiled_cache
+                ).execute(execute, arguments)
+
+        return connection.execution_options(
+            compiled_cache=compiled_cache
+        ).execute(self.statement, params)
+
+    def prepare(self, connection, params):
+        """Prepares the statement on a PostgreSQL connection once.
+
+        Args:
+            connection: A SQLAlchemy Connection to a PostgreSQL db
+            params: A dict of the values of the statement's bound parameters
+
+        Returns:
+            execute: A SQLAlchemy TextClause executing the prepared statement
+            arguments: A dict of the values of its parameters. None is
+                returned instead if the statement cannot be prepared
+        """
+        if self._prepared is None:
+            compiled = self.statement.compile(dialect=connection.dialect)
+
+            if compiled.contains_expanding_parameters:
+                self._prepared = False
+            else:
+                names = []
+
+                def number(match):
+                    if match.group(1) not in names:
+                        names.append(match.group(1))
+
+                    return f"${names.index(match.group(1)) + 1}"
+
+                sql = re.sub(r"%\((\w+)\)s", number, compiled.string)
+                arguments = ", ".join(
+                    f":p{index}" for index in range(1, len(names) + 1)
+                )
+                self._prepared = (
+                    compiled,
+                    sql.replace("%%", "%"),
+                    text(
+                        f"EXECUTE {self.name}({arguments})"
+                        if names
+                        else f"EXECUTE {self.name}"
+                    ),
+                    names,
+                )
+
+        if not self._prepared:
+            return None
+
+        compiled, sql, execute, names = self._prepared
+        prepared = connection.info.setdefault("prepared_statements", set())
+
+        if self.name not in prepared:
+            cursor = connection.connection.cursor()
+            cursor.execute(f"PREPARE {self.name} AS {sql}")
+            cursor.close()
+            prepared.add(self.name)
+
+        values = compiled.construct_params(params)
+
+        return execute, {
+            f"p{index}": values[name] for index, name in enumerate(names, 1)
+        }
+
+
+def cached_statement(build):
+    """A decorator keeping the CachedStatement a function builds.
+
+    The function is called once per set of arguments, which must be
+    hashable, and its statement is named after it and the names of its
+    arguments.
+
+    Args:
+        build: A function returning a SQLAlchemy statement
+    """
+    statements = {}
+
+    @wraps(build)
+    def wrapper(*args):
+        if args not in statements:
+            name = "_".join(
+                [
+                    build.__name__,
+                    *(getattr(arg, "__name__", str(arg)) for arg in args),
+                ]
+            ).lower()
+            statements[args] = CachedStatement(name, build(*args))
+
+        return statements[args]
+
+    return wrapper
@@ -1,6 +1,11 @@
-/* globals Handlebars */
+import {
+  addPagination,
+  auth,
+  compileTemplate,
+  flashMessage,
+} from './utils.js';
 
-import { addPagination, auth, flashMessage } from './utils.js';
+const shownActors = new Map();
 
 /**
  * @description Class representing an actor.
@@ -23,10 +28,38 @@ class Actor {
     this.birthdate = actor.birthdate;
     this.gender = actor.gender;
     this.movies = actor.movies;
+    this.totalMovies = actor.total_movies;
     this.image = actor.image;
     this.callback = callback;
   }
 
+  /**
+   * @description Load the rest of the movies of the actor, as only the first
+   * ones are sent with it
+   * @param {number} afterId - id of the last movie loaded
+   * @param {Object[]} loaded - movies loaded so far
+   * @return {Promise} promise resolved once every movie is loaded
+   */
+  loadMovies(afterId = 0, loaded = []) {
+    if (this.movies.length >= this.totalMovies) return Promise.resolve();
+    return fetch(`/api/actors/${this.id}/movies?after_id=${afterId}`, {
+      headers: { Authorization: `Bearer ${auth.token}` },
+    })
+      .then((response) => {
+        return response.json();
+      })
+      .then((data) => {
+        if (!data.success) throw new Error();
+        const movies = loaded.concat(data.movies);
+        if (data.next_after_id !== null) {
+          return this.loadMovies(data.next_after_id, movies);
+        }
+        this.movies = movies;
+        this.totalMovies = movies.length;
+        return undefined;
+      });
+  }
+
   /**
    * @description Create a new actor in the db
    * @param {Object} form - form containing data for the actor to create
@@ -149,9 +182,7 @@ class Actor {
    * @return {Object} html object containing the created form
    */
   creationForm() {
-    const formTemplate = Handlebars.compile(
-      document.querySelector('#actor-form').innerHTML
-    );
+    const formTemplate = compileTemplate('#actor-form');
     const header = 'Create New Actor';
     let creationForm = formTemplate({ header });
 
@@ -181,9 +212,7 @@ class Actor {
    * @return {Object} html object containing the created form
    */
   updateForm() {
-    const formTemplate = Handlebars.compile(
-      document.querySelector('#actor-form').innerHTML
-    );
+    const formTemplate = compileTemplate('#actor-form');
     const header = `Editing: ${this.name}`;
     const gender = {
       male: this.gender === 'male' ? 'selected' : '',
@@ -224,9 +253,7 @@ class Actor {
    * @return {Object} html object containing the created modal
    */
   modal() {
-    const modalTemplate = Handlebars.compile(
-      document.querySelector('#actor-modal').innerHTML
-    );
+    const modalTemplate = compileTemplate('#actor-modal');
     let { gender } = this;
     if (gender) {
       gender = this.gender.charAt(0).toUpperCase() + this.gender.slice(1);
@@ -237,6 +264,7 @@ class Actor {
       gender,
       image: this.image,
       movies: this.movies,
+      moreMovies: this.totalMovies - this.movies.length,
     });
 
     const div = document.createElement('div');
@@ -247,10 +275,12 @@ class Actor {
       const editBtn = modal.querySelector('#edit-btn');
       editBtn.classList.remove('hidden');
       editBtn.onclick = () => {
-        const actorForm = this.updateForm();
-        const modalContent = document.querySelector('.modal-content');
-        modalContent.innerHTML = '';
-        modalContent.appendChild(actorForm);
+        this.loadMovies().then(() => {
+          const actorForm = this.updateForm();
+          const modalContent = document.querySelector('.modal-content');
+          modalContent.innerHTML = '';
+          modalContent.appendChild(actorForm);
+        });
       };
     }
 
@@ -270,9 +300,7 @@ class Actor {
    * @return {Object} html object containing the created card
    */
   card() {
-    const cardTemplate = Handlebars.compile(
-      document.querySelector('#actor-card').innerHTML
-    );
+    const cardTemplate = compileTemplate('#actor-card');
     let { gender } = this;
     let age;
     if (this.birthdate) {
@@ -346,10 +374,12 @@ export default function showActors(page) {
 
       const content = document.querySelector('#content');
       content.innerHTML = '';
+      shownActors.clear();
       data.actors.forEach((actor) => {
         const newActor = new Actor(actor, showActors);
         const actorCard = newActor.card();
         content.appendChild(actorCard);
+        shownActors.set(newActor.id, { actor: newActor, card: actorCard });
       });
 
       const totalPages = Math.ceil(data.total_actors / 25);
@@ -361,3 +391,32 @@ export default function showActors(page) {
 
   window.scrollTo(0, 0);
 }
+
+/**
+ * @description Apply a change feed event to the actors shown on the page,
+ * without fetching them again. Only the shown actors are updated or
+ * removed, as new ones may belong on another page.
+ * @param {Object} change - change event holding the action, id and fields
+ * of the actor
+ */
+export function applyActorChange(change) {
+  const shown = shownActors.get(change.id);
+  if (!shown || !shown.card.isConnected) return;
+
+  if (change.action === 'deleted') {
+    shown.card.remove();
+    shownActors.delete(change.id);
+    return;
+  }
+
+  const actor = new Actor(
+    Object.assign({}, change.data, {
+      movies: shown.actor.movies,
+      total_movies: shown.actor.totalMovies,
+    }),
+    showActors
+  );
+  const card = actor.card();
+  shown.card.replaceWith(card);
+  shownActors.set(change.id, { actor, card });
+}
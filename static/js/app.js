@@ -1,6 +1,7 @@
 /* global createAuth0Client */
 
 import showActors from './actors.js';
+import subscribeChanges from './changes.js';
 import showMovies from './movies.js';
 import { auth, flashMessage } from './utils.js';
 
@@ -51,6 +52,7 @@ const updateUI = async () => {
       `${route}/${page}`
     );
     showMovies(page);
+    subscribeChanges();
   }
 
   if (auth.perms.includes('read:actors')) {
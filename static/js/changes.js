@@ -0,0 +1,89 @@
+import { applyActorChange } from './actors.js';
+import { applyMovieChange } from './movies.js';
+import { auth } from './utils.js';
+
+const MIN_RECONNECT_DELAY = 3000;
+const MAX_RECONNECT_DELAY = 60000;
+
+let source = null;
+let lastEventId = null;
+let reconnectDelay = MIN_RECONNECT_DELAY;
+
+/**
+ * @description Apply a change event to the page shown, if it shows that
+ * kind of resource
+ * @param {MessageEvent} event - change event of the stream
+ */
+function onChange(event) {
+  lastEventId = event.lastEventId;
+  const change = JSON.parse(event.data);
+  const { route } = window.history.state || {};
+  if (route === '/movies' && change.resource === 'movie') {
+    applyMovieChange(change);
+  } else if (route === '/actors' && change.resource === 'actor') {
+    applyActorChange(change);
+  }
+}
+
+/**
+ * @description Show the current page again, as the changes since the last
+ * event seen are no longer kept
+ * @param {MessageEvent} event - reset event of the stream
+ */
+function onReset(event) {
+  lastEventId = event.lastEventId;
+  window.dispatchEvent(
+    new PopStateEvent('popstate', { state: window.history.state })
+  );
+}
+
+/**
+ * @description Subscribe to the change feed again after a delay, doubling
+ * it while reconnecting fails
+ */
+function reconnect() {
+  // eslint-disable-next-line no-use-before-define
+  setTimeout(subscribeChanges, reconnectDelay);
+  reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY);
+}
+
+/**
+ * @description Subscribe to the change feed and apply the changes to the
+ * page shown. The stream is opened with a single-use ticket, as an
+ * EventSource cannot send the access token in a header, so every
+ * reconnection asks for a new one, backing off while it fails.
+ */
+export default function subscribeChanges() {
+  if (source) {
+    source.close();
+    source = null;
+  }
+
+  fetch('/api/changes/tickets', {
+    method: 'POST',
+    headers: { Authorization: `Bearer ${auth.token}` },
+  })
+    .then((response) => {
+      return response.json();
+    })
+    .then((data) => {
+      if (!data.success) throw new Error();
+
+      const params = new URLSearchParams({ ticket: data.ticket });
+      if (lastEventId) {
+        params.set('last_event_id', lastEventId);
+      }
+      source = new EventSource(`/api/changes?${params}`);
+      source.onopen = () => {
+        reconnectDelay = MIN_RECONNECT_DELAY;
+      };
+      source.addEventListener('change', onChange);
+      source.addEventListener('reset', onReset);
+      // The ticket is spent, so the browser cannot reconnect on its own
+      source.onerror = () => {
+        source.close();
+        reconnect();
+      };
+    })
+    .catch(reconnect);
+}
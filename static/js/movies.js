@@ -1,6 +1,11 @@
-/* globals Handlebars */
+import {
+  addPagination,
+  auth,
+  compileTemplate,
+  flashMessage,
+} from './utils.js';
 
-import { addPagination, auth, flashMessage } from './utils.js';
+const shownMovies = new Map();
 
 /**
  * @description Class representing a movie.
@@ -22,10 +27,38 @@ class Movie {
     this.title = movie.title;
     this.releaseDate = movie.release_date;
     this.actors = movie.actors;
+    this.totalActors = movie.total_actors;
     this.poster = movie.poster;
     this.callback = callback;
   }
 
+  /**
+   * @description Load the rest of the actors of the movie, as only the first
+   * ones are sent with it
+   * @param {number} afterId - id of the last actor loaded
+   * @param {Object[]} loaded - actors loaded so far
+   * @return {Promise} promise resolved once every actor is loaded
+   */
+  loadActors(afterId = 0, loaded = []) {
+    if (this.actors.length >= this.totalActors) return Promise.resolve();
+    return fetch(`/api/movies/${this.id}/actors?after_id=${afterId}`, {
+      headers: { Authorization: `Bearer ${auth.token}` },
+    })
+      .then((response) => {
+        return response.json();
+      })
+      .then((data) => {
+        if (!data.success) throw new Error();
+        const actors = loaded.concat(data.actors);
+        if (data.next_after_id !== null) {
+          return this.loadActors(data.next_after_id, actors);
+        }
+        this.actors = actors;
+        this.totalActors = actors.length;
+        return undefined;
+      });
+  }
+
   /**
    * @description Create a new movie in the db
    * @param {Object} form - form containing data for the movie to create
@@ -146,9 +179,7 @@ class Movie {
    * @return {Object} html object containing the created form
    */
   creationForm() {
-    const formTemplate = Handlebars.compile(
-      document.querySelector('#movie-form').innerHTML
-    );
+    const formTemplate = compileTemplate('#movie-form');
     const header = 'Create New Movie';
     let creationForm = formTemplate({ header });
 
@@ -177,9 +208,7 @@ class Movie {
    * @return {Object} html object containing the created form
    */
   updateForm() {
-    const formTemplate = Handlebars.compile(
-      document.querySelector('#movie-form').innerHTML
-    );
+    const formTemplate = compileTemplate('#movie-form');
     const header = `Editing: ${this.title}`;
     const actors = this.actors.map((actor) => actor.name).join(',\n');
     let updateForm = formTemplate({
@@ -215,14 +244,13 @@ class Movie {
    * @return {Object} html object containing the created modal
    */
   modal() {
-    const modalTemplate = Handlebars.compile(
-      document.querySelector('#movie-modal').innerHTML
-    );
+    const modalTemplate = compileTemplate('#movie-modal');
     let modal = modalTemplate({
       title: this.title,
       releaseDate: this.releaseDate,
       poster: this.poster,
       actors: this.actors,
+      moreActors: this.totalActors - this.actors.length,
     });
 
     const div = document.createElement('div');
@@ -233,10 +261,12 @@ class Movie {
       const editBtn = modal.querySelector('#edit-btn');
       editBtn.classList.remove('hidden');
       editBtn.onclick = () => {
-        const movieForm = this.updateForm();
-        const modalContent = document.querySelector('.modal-content');
-        modalContent.innerHTML = '';
-        modalContent.appendChild(movieForm);
+        this.loadActors().then(() => {
+          const movieForm = this.updateForm();
+          const modalContent = document.querySelector('.modal-content');
+          modalContent.innerHTML = '';
+          modalContent.appendChild(movieForm);
+        });
       };
     }
 
@@ -256,9 +286,7 @@ class Movie {
    * @return {Object} html object containing the created card
    */
   card() {
-    const cardTemplate = Handlebars.compile(
-      document.querySelector('#movie-card').innerHTML
-    );
+    const cardTemplate = compileTemplate('#movie-card');
     let year;
     if (this.releaseDate) [year] = this.releaseDate.split('-');
     let card = cardTemplate({
@@ -324,10 +352,12 @@ export default function showMovies(page) {
 
       const content = document.querySelector('#content');
       content.innerHTML = '';
+      shownMovies.clear();
       data.movies.forEach((movie) => {
         const newMovie = new Movie(movie, showMovies);
         const movieCard = newMovie.card();
         content.appendChild(movieCard);
+        shownMovies.set(newMovie.id, { movie: newMovie, card: movieCard });
       });
 
       const totalPages = Math.ceil(data.total_movies / 25);
@@ -339,3 +369,32 @@ export default function showMovies(page) {
 
   window.scrollTo(0, 0);
 }
+
+/**
+ * @description Apply a change feed event to the movies shown on the page,
+ * without fetching them again. Only the shown movies are updated or
+ * removed, as new ones may belong on another page.
+ * @param {Object} change - change event holding the action, id and fields
+ * of the movie
+ */
+export function applyMovieChange(change) {
+  const shown = shownMovies.get(change.id);
+  if (!shown || !shown.card.isConnected) return;
+
+  if (change.action === 'deleted') {
+    shown.card.remove();
+    shownMovies.delete(change.id);
+    return;
+  }
+
+  const movie = new Movie(
+    Object.assign({}, change.data, {
+      actors: shown.movie.actors,
+      total_actors: shown.movie.totalActors,
+    }),
+    showMovies
+  );
+  const card = movie.card();
+  shown.card.replaceWith(card);
+  shownMovies.set(change.id, { movie, card });
+}
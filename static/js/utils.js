@@ -5,6 +5,22 @@ export const auth = {
   perms: [],
 };
 
+const templates = {};
+
+/**
+ * @description Compile a Handlebars template once and reuse it afterwards
+ * @param {string} selector - selector of the script element holding the template
+ * @return {Function} compiled template
+ */
+export function compileTemplate(selector) {
+  if (!templates[selector]) {
+    templates[selector] = Handlebars.compile(
+      document.querySelector(selector).innerHTML
+    );
+  }
+  return templates[selector];
+}
+
 /**
  * @description Flash a message in the form of a toast
  * @param {string} category - category of Bootstrap alert to flash
@@ -42,9 +58,7 @@ export function addPagination(totalPages, page, route, callback) {
   const pages = [...Array(totalPages + 1).keys()];
   pages.shift();
 
-  const paginationTemplate = Handlebars.compile(
-    document.querySelector('#pagination').innerHTML
-  );
+  const paginationTemplate = compileTemplate('#pagination');
 
   const pagination = paginationTemplate({
     pages,
@@ -11,6 +11,7 @@ Attributes:
         token belonging to a user with the 'Executive Producer' role
 
 Classes:
+    PublicPageTestCase()
     PublicMovieTestCase()
     CastingAssistantMovieTestCase()
     CastingDirectorMovieTestCase()
@@ -18,13 +19,78 @@ Classes:
     PublicActorTestCase()
     CastingAssistantActorTestCase()
     CastingDirectorActorTestCase()
+    ReplicaSetTestCase()
+    ChangeFeedTestCase()
+    AssetsTestCase()
+    CompressionTestCase()
+    LimitsTestCase()
+    ImporterTestCase()
+    JobsTestCase()
+    DeltaTestCase()
+    TokensTestCase()
+    StatementsTestCase()
+    ProfilerTestCase()
+    SlowQueryLogTestCase()
+    TracingTestCase()
 """
 
+import datetime
+import gzip
+import json
 import os
+import tempfile
+import threading
 import unittest
+import uuid
+
+from flask import g, jsonify
+from sqlalchemy import bindparam, create_engine, event, exc, select
 
 from app import ITEMS_PER_PAGE, app
-from models import Actor, Movie, setup_db
+from assets import bundle_module, minify
+from auth import (
+    AuthError,
+    KeySet,
+    LocalKeySet,
+    get_token_rsa_key,
+    verify_decode_jwt,
+)
+from changes import (
+    Change,
+    ChangeFeed,
+    ChangeStore,
+    issue_ticket,
+    redeem_ticket,
+)
+from compression import MIN_SIZE, compress_response
+import delta
+from delta import changed_since, is_expired, parse_timestamp
+from idempotency import idempotent
+from importer import CSVStream, import_file, read_header, read_rows
+from jobs import job_runner
+from limits import (
+    ConcurrencyLimiter,
+    LimitError,
+    LimitStore,
+    MemoryStore,
+    Quota,
+)
+from models import (
+    Actor,
+    Job,
+    Movie,
+    db,
+    find_live,
+    movie_documents,
+    setup_db,
+)
+from profiler import profile, sample_stacks
+from records import MovieRecord
+from replicas import ReplicaSet, checked_out, replica_set, route_request
+from slowlog import SlowQueryLog, redact
+from statements import CachedStatement
+from tokens import ROLES, generate_key, mint_token
+from tracing import MemoryExporter, Tracer, parse_traceparent, tracer
 
 TEST_DATABASE_URL = os.environ["TEST_DATABASE_URL"]
 CASTING_ASSISTANT_TOKEN = os.environ["CASTING_ASSISTANT_TOKEN"]
@@ -32,6 +98,98 @@ CASTING_DIRECTOR_TOKEN = os.environ["CASTING_DIRECTOR_TOKEN"]
 EXECUTIVE_PRODUCER_TOKEN = os.environ["EXECUTIVE_PRODUCER_TOKEN"]
 
 
+class PublicPageTestCase(unittest.TestCase):
+    """Contains the test cases for the prerendered public pages.
+
+    Attributes:
+        app: A flask app from app.py
+        client: A test client for the flask app to use while testing
+    """
+
+    def setUp(self):
+        """Set-up for PublicPageTestCase."""
+        self.app = app
+        app.config["DEBUG"] = False
+        self.client = self.app.test_client
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def test_index_success(self):
+        """Test successful retrieval of the home page."""
+        response = self.client().get("/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/html")
+        self.assertIsNotNone(response.headers.get("ETag"))
+
+    def test_index_not_modified_success(self):
+        """Test that the home page is not resent when the ETag matches."""
+        etag = self.client().get("/").headers.get("ETag")
+
+        response = self.client().get("/", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_auth_config_success(self):
+        """Test successful retrieval of the authentication configuration."""
+        response = self.client().get("/auth_config")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.json), {"domain", "client_id", "audience"}
+        )
+        self.assertIn("max-age", response.headers.get("Cache-Control"))
+
+    def test_healthz_success(self):
+        """Test that the liveness check answers without authentication."""
+        response = self.client().get("/healthz")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json["success"])
+
+    def test_healthz_skips_setup_success(self):
+        """Test that the liveness check neither resumes jobs nor traces."""
+        started = job_runner._started
+        job_runner._started = None
+
+        try:
+            response = self.client().get(
+                "/healthz",
+                headers={
+                    "traceparent": (
+                        "00-4bf92f3577b34da6a3ce929d0e0e4736-"
+                        "00f067aa0ba902b7-01"
+                    )
+                },
+            )
+            resumed = job_runner._started
+        finally:
+            job_runner._started = started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(resumed)
+        self.assertNotIn("traceparent", response.headers)
+
+    def test_readyz_success(self):
+        """Test that the readiness check reports the db and the keys."""
+        response = self.client().get("/readyz")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json["database"])
+        self.assertTrue(response.json["keys"])
+
+    def test_debug_profile_auth_fail(self):
+        """Test that profiling the worker requires authentication."""
+        response = self.client().get("/debug/profile")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            response.json["error_code"], "authorization_header_missing"
+        )
+
+
 class PublicMovieTestCase(unittest.TestCase):
     """Contains the test cases for the public movie endpoints.
 
@@ -63,6 +221,122 @@ class PublicMovieTestCase(unittest.TestCase):
             response.json.get("error_code"), "authorization_header_missing"
         )
 
+    def test_get_changes_auth_fail(self):
+        """Test failed streaming of changes without a stream ticket."""
+        response = self.client().get("/api/changes?ticket=unknown")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "invalid_ticket")
+
+    def test_create_change_ticket_auth_fail(self):
+        """Test failed issuing of a stream ticket when not authenticated."""
+        response = self.client().post("/api/changes/tickets")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
+    def test_export_movies_auth_fail(self):
+        """Test failed export of movies when not authenticated."""
+        response = self.client().get("/api/movies/export")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
+    def test_get_movie_actors_auth_fail(self):
+        """Test failed retrieval of a movie's actors when not authenticated."""
+        response = self.client().get("/api/movies/1/actors")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
+    def test_preflight_success(self):
+        """Test that a preflight is answered without authentication."""
+        response = self.client().options(
+            "/api/movies/1",
+            headers={
+                "Origin": "https://example.com",
+                "Access-Control-Request-Method": "PATCH",
+                "Access-Control-Request-Headers": "Authorization",
+            },
+        )
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.data, b"")
+        self.assertIn(
+            "PATCH", response.headers.get("Access-Control-Allow-Methods")
+        )
+        self.assertIn(
+            "Authorization",
+            response.headers.get("Access-Control-Allow-Headers"),
+        )
+        self.assertIsNotNone(response.headers.get("Access-Control-Max-Age"))
+
+    def test_preflight_trace_headers_success(self):
+        """Test that preflights allow the tracing and change feed headers."""
+        response = self.client().options(
+            "/api/changes",
+            headers={
+                "Origin": "https://example.com",
+                "Access-Control-Request-Method": "GET",
+                "Access-Control-Request-Headers": "traceparent, Last-Event-ID",
+            },
+        )
+        allowed = response.headers.get("Access-Control-Allow-Headers")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertIn("traceparent", allowed)
+        self.assertIn("Last-Event-ID", allowed)
+
+    def test_cors_headers_success(self):
+        """Test that responses allow cross-origin requests."""
+        response = self.client().get(
+            "/api/movies/1", headers={"Origin": "https://example.com"}
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNotNone(
+            response.headers.get("Access-Control-Allow-Origin")
+        )
+
+    def test_get_job_auth_fail(self):
+        """Test failed retrieval of a job when not authenticated."""
+        response = self.client().get("/api/jobs/1")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
+    def test_rebuild_read_model_auth_fail(self):
+        """Test failed rebuild of the read model when not authenticated."""
+        response = self.client().post("/api/read-model/rebuild")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
+    def test_get_metrics_auth_fail(self):
+        """Test failed retrieval of metrics when not authenticated."""
+        response = self.client().get("/api/metrics")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
+
     def test_movies_patch_method_not_allowed_fail(self):
         """Test that patch method is not allowed at /movies endpoint."""
         response = self.client().patch("/api/movies")
@@ -79,13 +353,15 @@ class PublicMovieTestCase(unittest.TestCase):
         self.assertEqual(response.json.get("success"), False)
         self.assertEqual(response.json.get("error_code"), "method_not_allowed")
 
-    def test_movie_get_method_not_allowed_fail(self):
-        """Test that get method is not allowed at /movies/id endpoint."""
+    def test_get_movie_auth_fail(self):
+        """Test failed retrieval of a movie when not authenticated."""
         response = self.client().get("/api/movies/1")
 
-        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.status_code, 401)
         self.assertEqual(response.json.get("success"), False)
-        self.assertEqual(response.json.get("error_code"), "method_not_allowed")
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
 
     def test_movie_post_method_not_allowed_fail(self):
         """Test that post method is not allowed at /movies/id endpoint."""
@@ -128,9 +404,194 @@ class CastingAssistantMovieTestCase(unittest.TestCase):
         self.assertEqual(len(response.json.get("movies")), ITEMS_PER_PAGE)
         self.assertGreater(response.json.get("total_movies"), ITEMS_PER_PAGE)
 
+    def test_get_movies_replica_down_success(self):
+        """Test that reads fall back to the primary when a replica is down."""
+        setup_db(self.app, self.database_url, ["sqlite:////nonexistent/db"])
+
+        try:
+            response = self.client().get("/api/movies", headers=self.headers)
+            candidates = replica_set.candidates(None)
+        finally:
+            setup_db(self.app, self.database_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(candidates, [])
+
+    def test_get_changes_ticket_success(self):
+        """Test that a stream ticket opens one stream, once."""
+        ticket = (
+            self.client()
+            .post("/api/changes/tickets", headers=self.headers)
+            .json.get("ticket")
+        )
+
+        with self.client().get(
+            f"/api/changes?ticket={ticket}", buffered=False
+        ) as response:
+            status_code = response.status_code
+            mimetype = response.mimetype
+
+        reused = self.client().get(f"/api/changes?ticket={ticket}")
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(mimetype, "text/event-stream")
+        self.assertEqual(reused.status_code, 401)
+        self.assertEqual(reused.json.get("error_code"), "invalid_ticket")
+
+    def test_get_paginated_movies_read_model_success(self):
+        """Test that pages of movies match the movies they were built from."""
+        response = self.client().get("/api/movies", headers=self.headers)
+
+        for movie in response.json.get("movies"):
+            expected = Movie.query.get(movie["id"]).format()
+            self.assertEqual(
+                sorted(actor["id"] for actor in movie["actors"]),
+                sorted(actor["id"] for actor in expected.pop("actors")),
+            )
+            movie.pop("actors")
+            self.assertEqual(movie, expected)
+
+    def test_get_movies_updated_since_success(self):
+        """Test successful retrieval of the movies changed since a time."""
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+
+        response = self.client().get(
+            f"/api/movies?updated_since={since.isoformat()}",
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertIsInstance(response.json.get("deleted_movie_ids"), list)
+        self.assertIsNotNone(response.json.get("next_updated_since"))
+
+    def test_get_movies_updated_since_bad_request_fail(self):
+        """Test failed delta sync from a malformed timestamp."""
+        response = self.client().get(
+            "/api/movies?updated_since=yesterday", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "bad_request")
+
+    def test_get_movies_updated_since_gone_fail(self):
+        """Test failed delta sync from before tombstones are purged."""
+        response = self.client().get(
+            "/api/movies?updated_since=2000-01-01T00:00:00Z",
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "gone")
+
+    def test_get_movie_success(self):
+        """Test successful retrieval of a single movie."""
+        movie = Movie.live().order_by(Movie.id.desc()).first().format()
+
+        response = self.client().get(
+            f"/api/movies/{movie['id']}", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(response.json.get("movie"), movie)
+        self.assertIsNotNone(response.headers.get("ETag"))
+
+    def test_export_movies_success(self):
+        """Test successful export of every movie as json lines."""
+        response = self.client().get(
+            "/api/movies/export", headers=self.headers
+        )
+        lines = response.get_data(as_text=True).splitlines()
+        movie = json.loads(lines[0])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(lines), Movie.live().count())
+        self.assertEqual(movie, Movie.query.get(movie["id"]).format())
+
+    def test_get_movie_actors_success(self):
+        """Test successful retrieval of every page of a movie's actors."""
+        movie = Movie.live().order_by(Movie.id.desc()).first().format()
+        actor_ids = []
+        after_id = 0
+
+        while after_id is not None:
+            response = self.client().get(
+                f"/api/movies/{movie['id']}/actors?after_id={after_id}",
+                headers=self.headers,
+            )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json.get("success"), True)
+            actor_ids += [actor["id"] for actor in response.json["actors"]]
+            after_id = response.json.get("next_after_id")
+
+        self.assertEqual(actor_ids, sorted(actor_ids))
+        self.assertEqual(len(actor_ids), movie["total_actors"])
+        self.assertEqual(
+            actor_ids[: len(movie["actors"])],
+            [actor["id"] for actor in movie["actors"]],
+        )
+
+    def test_get_movie_actors_not_found_fail(self):
+        """Test failed retrieval of the actors of a nonexistent movie."""
+        response = self.client().get(
+            "/api/movies/100000/actors", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json.get("success"), False)
+
+    def test_get_movie_fields_success(self):
+        """Test successful retrieval of a subset of a movie's fields."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().get(
+            f"/api/movies/{movie_id}?fields=title",
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(set(response.json.get("movie")), {"id", "title"})
+
+    def test_get_movie_not_modified_success(self):
+        """Test that a movie is not resent when the ETag still matches."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+        response = self.client().get(
+            f"/api/movies/{movie_id}", headers=self.headers
+        )
+        headers = {
+            **self.headers,
+            "If-None-Match": response.headers.get("ETag"),
+        }
+
+        response = self.client().get(
+            f"/api/movies/{movie_id}", headers=headers
+        )
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_get_movie_out_of_range_fail(self):
+        """Test failed movie retrieval when movie does not exist."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().get(
+            f"/api/movies/{movie_id+1}", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "not_found")
+
     def test_get_paginated_movies_out_of_range_fail(self):
         """Test failed movie retrieval when page number is out of range."""
-        total_pages = -(-Movie.query.count() // ITEMS_PER_PAGE)
+        total_pages = -(-Movie.live().count() // ITEMS_PER_PAGE)
 
         response = self.client().get(
             f"/api/movies?page={total_pages+1}", headers=self.headers
@@ -142,7 +603,7 @@ class CastingAssistantMovieTestCase(unittest.TestCase):
 
     def test_update_movie_auth_fail(self):
         """Test failed updating of a movie when unauthorized."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
 
         response = self.client().patch(
             f"/api/movies/{movie_id}", headers=self.headers
@@ -186,7 +647,7 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
 
     def test_update_movie_success(self):
         """Test successful update of a movie."""
-        old_movie = Movie.query.order_by(Movie.id.desc()).first().format()
+        old_movie = Movie.live().order_by(Movie.id.desc()).first().format()
         movie_id = old_movie["id"]
         new_movie = {
             "title": "Iron Man",
@@ -202,7 +663,7 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
             f"/api/movies/{movie_id}", json=new_movie, headers=self.headers
         )
 
-        movie = Movie.query.get(movie_id)
+        movie = Movie.live().filter_by(id=movie_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -211,9 +672,138 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
         self.assertTrue(response.json.get("new_movie"))
         self.assertIsNotNone(movie)
 
+    def test_update_movie_minimal_success(self):
+        """Test successful update of a movie with a minimal response."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().patch(
+            f"/api/movies/{movie_id}?return=minimal",
+            json={"title": "Iron Man"},
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json, {"success": True, "updated_movie_id": movie_id}
+        )
+
+    def test_update_movie_concurrent_success(self):
+        """Test that concurrent updates of a movie do not collide."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+        statuses = []
+
+        def update(number):
+            client = self.client()
+
+            for attempt in range(5):
+                response = client.patch(
+                    f"/api/movies/{movie_id}?return=minimal",
+                    json={"title": f"Iron Man {number}-{attempt}"},
+                    headers=self.headers,
+                )
+                statuses.append(response.status_code)
+
+        threads = [
+            threading.Thread(target=update, args=(number,))
+            for number in range(2)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        with app.app_context():
+            document = db.session.execute(
+                select([movie_documents.c.body]).where(
+                    movie_documents.c.id == movie_id
+                )
+            ).scalar()
+
+        self.assertLessEqual(set(statuses), {200, 429})
+        self.assertIn(200, statuses)
+        self.assertIn("Iron Man", json.loads(document)["title"])
+
+    def test_update_movie_diff_success(self):
+        """Test successful update of a movie with a diff response."""
+        movie = Movie.live().order_by(Movie.id.desc()).first()
+        movie_id = movie.id
+        old_title = movie.title
+        new_title = f"{old_title} (Director's Cut)"
+
+        response = self.client().patch(
+            f"/api/movies/{movie_id}?return=diff",
+            json={"title": new_title},
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(response.json.get("updated_movie_id"), movie_id)
+        self.assertEqual(
+            response.json.get("changes"),
+            {"title": {"old": old_title, "new": new_title}},
+        )
+
+    def test_update_movie_return_mode_fail(self):
+        """Test failed movie update when the return mode is unrecognized."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().patch(
+            f"/api/movies/{movie_id}?return=everything",
+            json={"title": "Iron Man"},
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "bad_request")
+
+    def test_update_movie_add_remove_actors_success(self):
+        """Test successful incremental update of a movie's actors."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().patch(
+            f"/api/movies/{movie_id}",
+            json={"actors_add": ["Robert Downey Jr.", "Jeff Bridges"]},
+            headers=self.headers,
+        )
+        response = self.client().patch(
+            f"/api/movies/{movie_id}",
+            json={"actors_remove": ["Jeff Bridges"]},
+            headers=self.headers,
+        )
+
+        actor_names = [
+            actor["name"] for actor in response.json.get("new_movie")["actors"]
+        ]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertIn("Robert Downey Jr.", actor_names)
+        self.assertNotIn("Jeff Bridges", actor_names)
+
+    def test_update_movie_replace_and_add_actors_fail(self):
+        """Test failed movie update when replacing and adding actors."""
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
+
+        response = self.client().patch(
+            f"/api/movies/{movie_id}",
+            json={
+                "actors": ["Robert Downey Jr."],
+                "actors_add": ["Jeff Bridges"],
+            },
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "bad_request")
+
     def test_update_movie_unrecognized_actor_fail(self):
         """Test failed movie update when an actor doesn't exist in the db."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
         new_movie = {
             "title": "Iron Man",
             "release_date": "2008-05-02",
@@ -239,7 +829,7 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
 
     def test_update_movie_out_of_range_fail(self):
         """Test failed movie update when movie does not exist."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
         new_movie = {
             "title": "Iron Man",
             "release_date": "2008-05-02",
@@ -262,7 +852,7 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
 
     def test_update_movie_no_info_fail(self):
         """Test failed movie update when in info is given."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
 
         response = self.client().patch(
             f"/api/movies/{movie_id}", headers=self.headers
@@ -274,7 +864,7 @@ class CastingDirectorMovieTestCase(unittest.TestCase):
 
     def test_delete_movie_auth_fail(self):
         """Test failed movie deletion when unauthorized."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
 
         response = self.client().delete(
             f"/api/movies/{movie_id}", headers=self.headers
@@ -326,7 +916,7 @@ class ExecutiveProducerMovieTestCase(unittest.TestCase):
         )
 
         created_movie_id = response.json.get("created_movie_id")
-        movie = Movie.query.get(created_movie_id)
+        movie = Movie.live().filter_by(id=created_movie_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -334,6 +924,85 @@ class ExecutiveProducerMovieTestCase(unittest.TestCase):
         self.assertTrue(response.json.get("new_movie"))
         self.assertIsNotNone(movie)
 
+    def test_create_movie_idempotent_success(self):
+        """Test that a retried movie creation is replayed, not repeated."""
+        new_movie = {"title": "Black Widow"}
+        headers = {**self.headers, "Idempotency-Key": uuid.uuid4().hex}
+        total_movies = Movie.live().count()
+
+        response = self.client().post(
+            "/api/movies", json=new_movie, headers=headers
+        )
+        replayed = self.client().post(
+            "/api/movies", json=new_movie, headers=headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.json, response.json)
+        self.assertEqual(replayed.headers.get("Idempotent-Replayed"), "true")
+        self.assertEqual(Movie.live().count(), total_movies + 1)
+
+    def test_create_movie_idempotency_key_reused_fail(self):
+        """Test failed movie creation when a key is reused for new info."""
+        headers = {**self.headers, "Idempotency-Key": uuid.uuid4().hex}
+        self.client().post(
+            "/api/movies", json={"title": "Black Widow"}, headers=headers
+        )
+
+        response = self.client().post(
+            "/api/movies", json={"title": "Iron Man"}, headers=headers
+        )
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json.get("success"), False)
+
+    def test_create_movie_idempotency_key_new_query_fail(self):
+        """Test failed movie creation when a key is reused for a new mode."""
+        headers = {**self.headers, "Idempotency-Key": uuid.uuid4().hex}
+        self.client().post(
+            "/api/movies", json={"title": "Black Widow"}, headers=headers
+        )
+
+        response = self.client().post(
+            "/api/movies?return=minimal",
+            json={"title": "Black Widow"},
+            headers=headers,
+        )
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json.get("success"), False)
+
+    def test_create_movie_idempotent_crash_success(self):
+        """Test that a request failing after its write can be retried."""
+        key = uuid.uuid4().hex
+        title = f"Black Widow {key}"
+
+        @idempotent
+        def create_movie(fail):
+            Movie(title=title).insert()
+
+            if fail:
+                raise RuntimeError("worker died")
+
+            return jsonify({"success": True})
+
+        with app.test_request_context(
+            "/api/movies", method="POST", headers={"Idempotency-Key": key}
+        ):
+            g.jwt_payload = {"sub": "test|crash"}
+
+            with self.assertRaises(RuntimeError):
+                create_movie(True)
+
+            retried = create_movie(False)
+            replayed = create_movie(False)
+
+        self.assertEqual(retried.status_code, 200)
+        self.assertIsNone(retried.headers.get("Idempotent-Replayed"))
+        self.assertEqual(replayed.headers.get("Idempotent-Replayed"), "true")
+        self.assertEqual(Movie.query.filter_by(title=title).count(), 1)
+
     def test_create_movie_unrecognized_actor_fail(self):
         """Test failed movie creation when an actor doesn't exist in the db."""
         new_movie = {
@@ -370,14 +1039,14 @@ class ExecutiveProducerMovieTestCase(unittest.TestCase):
 
     def test_delete_movie_success(self):
         """Test successful deletion of movie."""
-        old_movie = Movie.query.order_by(Movie.id.desc()).first().format()
+        old_movie = Movie.live().order_by(Movie.id.desc()).first().format()
         movie_id = old_movie["id"]
 
         response = self.client().delete(
             f"/api/movies/{movie_id}", headers=self.headers
         )
 
-        movie = Movie.query.get(movie_id)
+        movie = Movie.live().filter_by(id=movie_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -385,10 +1054,11 @@ class ExecutiveProducerMovieTestCase(unittest.TestCase):
         self.assertEqual(response.json.get("old_movie"), old_movie)
         self.assertIsNone(response.json.get("new_movie"))
         self.assertIsNone(movie)
+        self.assertIsNotNone(Movie.query.get(movie_id).deleted_at)
 
     def test_delete_movie_out_of_range_fail(self):
         """Test failed movie deletion when movie does not exist."""
-        movie_id = Movie.query.order_by(Movie.id.desc()).first().id
+        movie_id = Movie.live().order_by(Movie.id.desc()).first().id
 
         response = self.client().delete(
             f"/api/movies/{movie_id+1}", headers=self.headers
@@ -400,6 +1070,16 @@ class ExecutiveProducerMovieTestCase(unittest.TestCase):
             response.json.get("error_code"), "unprocessable_entity"
         )
 
+    def test_rebuild_read_model_auth_fail(self):
+        """Test failed rebuild of the read model when unauthorized."""
+        response = self.client().post(
+            "/api/read-model/rebuild", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "forbidden")
+
 
 class PublicActorTestCase(unittest.TestCase):
     """Contains the test cases for the public actor endpoints.
@@ -448,13 +1128,15 @@ class PublicActorTestCase(unittest.TestCase):
         self.assertEqual(response.json.get("success"), False)
         self.assertEqual(response.json.get("error_code"), "method_not_allowed")
 
-    def test_actor_get_method_not_allowed_fail(self):
-        """Test that get method is not allowed at /actors/id endpoint."""
+    def test_get_actor_auth_fail(self):
+        """Test failed retrieval of a actor when not authenticated."""
         response = self.client().get("/api/actors/1")
 
-        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.status_code, 401)
         self.assertEqual(response.json.get("success"), False)
-        self.assertEqual(response.json.get("error_code"), "method_not_allowed")
+        self.assertEqual(
+            response.json.get("error_code"), "authorization_header_missing"
+        )
 
     def test_actors_post_method_not_allowed_fail(self):
         """Test that post method is not allowed at /actors/id endpoint."""
@@ -497,9 +1179,82 @@ class CastingAssistantActorTestCase(unittest.TestCase):
         self.assertEqual(len(response.json.get("actors")), ITEMS_PER_PAGE)
         self.assertGreater(response.json.get("total_actors"), ITEMS_PER_PAGE)
 
+    def test_get_actor_success(self):
+        """Test successful retrieval of a single actor."""
+        actor = Actor.live().order_by(Actor.id.desc()).first().format()
+
+        response = self.client().get(
+            f"/api/actors/{actor['id']}", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(response.json.get("actor"), actor)
+        self.assertIsNotNone(response.headers.get("ETag"))
+
+    def test_get_actor_movies_success(self):
+        """Test successful retrieval of a page of an actor's movies."""
+        actor = Actor.live().order_by(Actor.id.desc()).first().format()
+
+        response = self.client().get(
+            f"/api/actors/{actor['id']}/movies", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(
+            response.json.get("total_movies"), actor["total_movies"]
+        )
+        self.assertEqual(
+            response.json["movies"][: len(actor["movies"])], actor["movies"]
+        )
+
+    def test_get_actor_fields_success(self):
+        """Test successful retrieval of a subset of a actor's fields."""
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
+
+        response = self.client().get(
+            f"/api/actors/{actor_id}?fields=name",
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(set(response.json.get("actor")), {"id", "name"})
+
+    def test_get_actor_not_modified_success(self):
+        """Test that a actor is not resent when the ETag still matches."""
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
+        response = self.client().get(
+            f"/api/actors/{actor_id}", headers=self.headers
+        )
+        headers = {
+            **self.headers,
+            "If-None-Match": response.headers.get("ETag"),
+        }
+
+        response = self.client().get(
+            f"/api/actors/{actor_id}", headers=headers
+        )
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_get_actor_out_of_range_fail(self):
+        """Test failed actor retrieval when actor does not exist."""
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
+
+        response = self.client().get(
+            f"/api/actors/{actor_id+1}", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json.get("success"), False)
+        self.assertEqual(response.json.get("error_code"), "not_found")
+
     def test_get_paginated_actors_out_of_range_fail(self):
         """Test failed actor retrieval when page number is out of range."""
-        total_pages = -(-Actor.query.count() // ITEMS_PER_PAGE)
+        total_pages = -(-Actor.live().count() // ITEMS_PER_PAGE)
 
         response = self.client().get(
             f"/api/actors?page={total_pages+1}", headers=self.headers
@@ -519,7 +1274,7 @@ class CastingAssistantActorTestCase(unittest.TestCase):
 
     def test_update_actor_auth_fail(self):
         """Test failed updating of an actor when unauthorized."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
 
         response = self.client().patch(
             f"/api/actors/{actor_id}", headers=self.headers
@@ -531,7 +1286,7 @@ class CastingAssistantActorTestCase(unittest.TestCase):
 
     def test_delete_actor_auth_fail(self):
         """Test failed actor deletion when unauthorized."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
 
         response = self.client().delete(
             f"/api/actors/{actor_id}", headers=self.headers
@@ -583,7 +1338,7 @@ class CastingDirectorActorTestCase(unittest.TestCase):
         )
 
         created_actor_id = response.json.get("created_actor_id")
-        actor = Actor.query.get(created_actor_id)
+        actor = Actor.live().filter_by(id=created_actor_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -628,7 +1383,7 @@ class CastingDirectorActorTestCase(unittest.TestCase):
 
     def test_update_actor_success(self):
         """Test successful update of an actor."""
-        old_actor = Actor.query.order_by(Actor.id.desc()).first().format()
+        old_actor = Actor.live().order_by(Actor.id.desc()).first().format()
         actor_id = old_actor["id"]
         new_actor = {
             "name": "Tom Hiddleston",
@@ -649,7 +1404,7 @@ class CastingDirectorActorTestCase(unittest.TestCase):
             f"/api/actors/{actor_id}", json=new_actor, headers=self.headers
         )
 
-        actor = Actor.query.get(actor_id)
+        actor = Actor.live().filter_by(id=actor_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -658,9 +1413,49 @@ class CastingDirectorActorTestCase(unittest.TestCase):
         self.assertTrue(response.json.get("new_actor"))
         self.assertIsNotNone(actor)
 
+    def test_update_actor_diff_success(self):
+        """Test successful update of an actor with a diff response."""
+        actor = Actor.live().order_by(Actor.id.desc()).first()
+        actor_id = actor.id
+        old_name = actor.name
+        new_name = f"{old_name} Jr."
+
+        response = self.client().patch(
+            f"/api/actors/{actor_id}?return=diff",
+            json={"name": new_name},
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertEqual(response.json.get("updated_actor_id"), actor_id)
+        self.assertEqual(
+            response.json.get("changes"),
+            {"name": {"old": old_name, "new": new_name}},
+        )
+
+    def test_update_actor_add_movies_success(self):
+        """Test successful incremental update of an actor's movies."""
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
+
+        response = self.client().patch(
+            f"/api/actors/{actor_id}",
+            json={"movies_add": ["The Avengers"]},
+            headers=self.headers,
+        )
+
+        movie_titles = [
+            movie["title"]
+            for movie in response.json.get("new_actor")["movies"]
+        ]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("success"), True)
+        self.assertIn("The Avengers", movie_titles)
+
     def test_update_actor_unrecognized_movie_fail(self):
         """Test failed actor update when a movie doesn't exist in the db."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
         new_actor = {
             "name": "Tom Hiddleston	",
             "birthdate": "1981-02-09",
@@ -689,7 +1484,7 @@ class CastingDirectorActorTestCase(unittest.TestCase):
 
     def test_update_actor_out_of_range_fail(self):
         """Test failed actor update when actor does not exist."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
         new_actor = {
             "name": "Tom Hiddleston	",
             "birthdate": "1981-02-09",
@@ -717,7 +1512,7 @@ class CastingDirectorActorTestCase(unittest.TestCase):
 
     def test_update_actor_no_info_fail(self):
         """Test failed actor update when in info is given."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
 
         response = self.client().patch(
             f"/api/actors/{actor_id}", headers=self.headers
@@ -729,14 +1524,14 @@ class CastingDirectorActorTestCase(unittest.TestCase):
 
     def test_delete_actor_success(self):
         """Test successful deletion of actor."""
-        old_actor = Actor.query.order_by(Actor.id.desc()).first().format()
+        old_actor = Actor.live().order_by(Actor.id.desc()).first().format()
         actor_id = old_actor["id"]
 
         response = self.client().delete(
             f"/api/actors/{actor_id}", headers=self.headers
         )
 
-        actor = Actor.query.get(actor_id)
+        actor = Actor.live().filter_by(id=actor_id).first()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json.get("success"), True)
@@ -744,10 +1539,11 @@ class CastingDirectorActorTestCase(unittest.TestCase):
         self.assertEqual(response.json.get("old_actor"), old_actor)
         self.assertIsNone(response.json.get("new_actor"))
         self.assertIsNone(actor)
+        self.assertIsNotNone(Actor.query.get(actor_id).deleted_at)
 
     def test_delete_actor_out_of_range_fail(self):
         """Test failed actor deletion when actor does not exist."""
-        actor_id = Actor.query.order_by(Actor.id.desc()).first().id
+        actor_id = Actor.live().order_by(Actor.id.desc()).first().id
 
         response = self.client().delete(
             f"/api/actors/{actor_id+1}", headers=self.headers
@@ -760,5 +1556,1048 @@ class CastingDirectorActorTestCase(unittest.TestCase):
         )
 
 
+class ReplicaSetTestCase(unittest.TestCase):
+    """Contains the test cases for choosing read replicas.
+
+    Attributes:
+        engines: A dict mapping replica bind keys to in-memory db engines
+        replica_set: A ReplicaSet routing reads to the engines
+    """
+
+    def setUp(self):
+        """Set-up for ReplicaSetTestCase."""
+        self.engines = {
+            "replica_0": create_engine("sqlite://"),
+            "replica_1": create_engine("sqlite://"),
+        }
+        self.replica_set = ReplicaSet()
+        self.replica_set.configure(self.engines)
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def test_choose_round_robin_success(self):
+        """Test that reads are spread across every replica."""
+        chosen = {self.replica_set.choose(self.engines.get) for _ in range(4)}
+
+        self.assertEqual(chosen, set(self.engines.values()))
+
+    def test_choose_skips_down_replica_success(self):
+        """Test that a replica marked down is not chosen."""
+        self.replica_set.mark_down("replica_0")
+
+        chosen = {self.replica_set.choose(self.engines.get) for _ in range(4)}
+
+        self.assertEqual(chosen, {self.engines["replica_1"]})
+
+    def test_choose_all_down_fail(self):
+        """Test that no replica is chosen when every replica is down."""
+        for name in self.engines:
+            self.replica_set.mark_down(name)
+
+        self.assertIsNone(self.replica_set.choose(self.engines.get))
+
+    def test_choose_no_connection_success(self):
+        """Test that choosing a replica does not open a connection."""
+        engine = create_engine("sqlite:////nonexistent/replica.db")
+
+        chosen = self.replica_set.choose(lambda name: engine)
+
+        self.assertIs(chosen, engine)
+        self.assertEqual(checked_out(engine), 0)
+
+    def test_connect_error_marks_down_success(self):
+        """Test that a replica failing to connect is no longer chosen."""
+        self.engines["replica_0"] = create_engine(
+            "sqlite:////nonexistent/replica.db"
+        )
+        self.replica_set.watch("replica_0", self.engines["replica_0"])
+
+        with self.assertRaises(exc.OperationalError):
+            self.engines["replica_0"].connect()
+
+        chosen = {self.replica_set.choose(self.engines.get) for _ in range(4)}
+
+        self.assertEqual(chosen, {self.engines["replica_1"]})
+
+    def test_statement_error_keeps_replica_success(self):
+        """Test that a failing statement leaves its replica in rotation."""
+        self.replica_set.watch("replica_0", self.engines["replica_0"])
+
+        with self.assertRaises(exc.OperationalError):
+            self.engines["replica_0"].execute("SELECT * FROM missing")
+
+        chosen = {self.replica_set.choose(self.engines.get) for _ in range(4)}
+
+        self.assertEqual(chosen, set(self.engines.values()))
+
+    def test_replica_engine_pre_ping_success(self):
+        """Test that the replica engines ping connections on checkout."""
+        with tempfile.TemporaryDirectory() as folder:
+            replica_url = f"sqlite:///{folder}/replica.db"
+            setup_db(app, TEST_DATABASE_URL, [replica_url])
+
+            try:
+                with app.app_context():
+                    replica = db.get_engine(app, bind="replica_0")
+                    primary = db.get_engine(app)
+                    replica_pre_ping = replica.pool._pre_ping
+                    primary_pre_ping = primary.pool._pre_ping
+                    replica.dispose()
+            finally:
+                setup_db(app, TEST_DATABASE_URL)
+
+        self.assertTrue(replica_pre_ping)
+        self.assertFalse(primary_pre_ping)
+
+    def test_read_your_writes_success(self):
+        """Test that a client reads from the primary right after writing."""
+        self.assertFalse(self.replica_set.is_sticky("client"))
+
+        self.replica_set.record_write("client")
+
+        self.assertTrue(self.replica_set.is_sticky("client"))
+        self.assertFalse(self.replica_set.is_sticky("other client"))
+
+    def test_route_delta_sync_to_primary_success(self):
+        """Test that delta syncs read from the primary, not a replica."""
+        names = replica_set.names
+        replica_set.names = list(self.engines)
+
+        try:
+            with app.test_request_context("/api/movies"):
+                route_request()
+                list_use_replica = g.use_replica
+
+            with app.test_request_context(
+                "/api/movies?updated_since=2020-01-01T00:00:00Z"
+            ):
+                route_request()
+                delta_use_replica = g.use_replica
+        finally:
+            replica_set.names = names
+
+        self.assertTrue(list_use_replica)
+        self.assertFalse(delta_use_replica)
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+    """Contains the test cases for the change feed.
+
+    Attributes:
+        change_feed: A ChangeFeed buffering up to three events
+        store: A ChangeStore reading the events recorded in the test db
+    """
+
+    def setUp(self):
+        """Set-up for ChangeFeedTestCase."""
+        self.change_feed = ChangeFeed(size=3)
+        self.store = ChangeStore()
+        setup_db(app, TEST_DATABASE_URL)
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def publish(self, *changes):
+        """Appends events numbered from the last one to the feed.
+
+        Args:
+            changes: Tuples of the resource, action, id and data of events
+        """
+        self.change_feed.append(
+            [
+                Change(self.change_feed.sequence + number, *change)
+                for number, change in enumerate(changes, 1)
+            ]
+        )
+
+    def record(self):
+        """Records the creation of a movie on the change feed.
+
+        Returns:
+            movie: A dict representing the id and title of the created movie
+        """
+        with app.app_context():
+            movie = Movie(
+                title=f"Change {uuid.uuid4().hex}",
+                release_date=datetime.date(2020, 1, 1),
+            )
+            movie.insert()
+
+            return movie.format(["id", "title"])
+
+    def test_since_success(self):
+        """Test retrieval of the events after a sequence number."""
+        self.publish(
+            ("movie", "created", 1, {"id": 1}), ("actor", "deleted", 2, None)
+        )
+
+        changes = self.change_feed.since(1)
+
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].resource, "actor")
+        self.assertEqual(changes[0].action, "deleted")
+        self.assertEqual(changes[0].id, 2)
+
+    def test_since_evicted_fail(self):
+        """Test that events which fell out of the buffer are reported."""
+        for movie_id in range(5):
+            self.publish(("movie", "updated", movie_id, None))
+
+        self.assertIsNone(self.change_feed.since(0))
+        self.assertEqual(len(self.change_feed.since(2)), 3)
+
+    def test_resume_success(self):
+        """Test resuming a stream from the id of the last event seen."""
+        self.publish(("movie", "created", 1, None))
+
+        self.assertEqual(self.change_feed.resume_sequence("1"), 1)
+
+    def test_resume_unknown_event_fail(self):
+        """Test that a stream resuming from an unknown event must reset."""
+        self.publish(("movie", "created", 1, None))
+
+        self.assertIsNone(self.change_feed.resume_sequence("2"))
+        self.assertIsNone(self.change_feed.resume_sequence("feed-1"))
+
+    def test_resume_after_reset_fail(self):
+        """Test that a stream resuming from before a reset must reset."""
+        self.publish(("movie", "created", 1, None))
+
+        self.change_feed.reset()
+
+        self.assertIsNone(self.change_feed.resume_sequence("1"))
+        self.assertEqual(self.change_feed.since(0), [])
+
+    def test_stream_success(self):
+        """Test that a resumed stream sends the missed events."""
+        self.publish(
+            ("movie", "created", 1, None), ("actor", "created", 2, None)
+        )
+        stream = self.change_feed.stream("0", resources=["actor"])
+
+        self.assertTrue(next(stream).startswith("retry:"))
+        self.assertEqual(next(stream).split("\n")[0], "id: 2")
+
+    def test_open_stream_limit_fail(self):
+        """Test that a worker keeps at most max_streams streams open."""
+        change_feed = ChangeFeed(max_streams=1)
+
+        self.assertTrue(change_feed.open_stream())
+        self.assertFalse(change_feed.open_stream())
+        change_feed.close_stream()
+        self.assertTrue(change_feed.open_stream())
+
+    def test_redeem_ticket_success(self):
+        """Test that a stream ticket is redeemed only once."""
+        with app.app_context():
+            ticket = issue_ticket(["read:movies"])
+            permissions = redeem_ticket(ticket)
+            reused = redeem_ticket(ticket)
+
+        self.assertEqual(permissions, ["read:movies"])
+        self.assertIsNone(reused)
+
+    def test_redeem_ticket_expired_fail(self):
+        """Test that an expired stream ticket is refused."""
+        with app.app_context():
+            ticket = issue_ticket(["read:movies"], seconds=-1)
+            permissions = redeem_ticket(ticket)
+
+        self.assertIsNone(permissions)
+
+    def test_record_change_success(self):
+        """Test that a write records its event in the db."""
+        sequence = self.store.head()
+
+        movie = self.record()
+        changes = self.store.after(sequence, 10)
+
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].resource, "movie")
+        self.assertEqual(changes[0].action, "created")
+        self.assertEqual(changes[0].id, movie["id"])
+        self.assertEqual(changes[0].data["title"], movie["title"])
+
+    def test_resume_other_worker_success(self):
+        """Test resuming on one worker from an event seen on another."""
+        sequence = self.store.head()
+        movie = self.record()
+        last_event_id = str(self.store.after(sequence, 10)[0].sequence)
+        self.record()
+        worker = ChangeFeed(self.store, size=3)
+        worker.prime(self.store.head())
+
+        changes = worker.since(worker.resume_sequence(last_event_id))
+
+        self.assertEqual(len(changes), 1)
+        self.assertNotEqual(changes[0].id, movie["id"])
+
+    def test_resume_pruned_fail(self):
+        """Test that a stream resuming from a pruned event must reset."""
+        sequence = self.store.head()
+        self.record()
+        self.record()
+        last_event_id = str(self.store.after(sequence, 10)[0].sequence)
+        worker = ChangeFeed(self.store, size=3)
+        worker.prime(self.store.head())
+
+        self.store.prune(seconds=-60)
+
+        self.assertIsNone(worker.resume_sequence(last_event_id))
+        self.assertEqual(
+            worker.resume_sequence(str(self.store.head())), worker.sequence
+        )
+
+
+class AssetsTestCase(unittest.TestCase):
+    """Contains the test cases for building the static assets."""
+
+    def test_bundle_module_success(self):
+        """Test that imports and exports are rewritten for bundling."""
+        source = (
+            "import showMovies from './movies.js';\n"
+            "import { auth } from './utils.js';\n"
+            "export const page = 1;\n"
+            "export default function show() {}\n"
+        )
+
+        dependencies, code = bundle_module("app.js", source)
+
+        self.assertEqual(dependencies, ["movies.js", "utils.js"])
+        self.assertIn("const showMovies = __module_movies_js.default;", code)
+        self.assertIn("const { auth } = __module_utils_js;", code)
+        self.assertIn("return {page, default: show};", code)
+        self.assertNotIn("export", code)
+
+    def test_minify_success(self):
+        """Test that comments and indentation are removed from a script."""
+        source = (
+            "/**\n * @description A comment\n */\n"
+            "function f() {\n"
+            "  // another comment\n"
+            "  return `a\n  b`;\n"
+            "}\n"
+        )
+
+        self.assertEqual(
+            minify(source), "function f() {\nreturn `a\n  b`;\n}\n"
+        )
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Contains the test cases for compressing responses.
+
+    Attributes:
+        app: A flask app from app.py
+        payload: A dict large enough to be compressed
+    """
+
+    def setUp(self):
+        """Set-up for CompressionTestCase."""
+        self.app = app
+        self.payload = {"success": True, "padding": "x" * MIN_SIZE}
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def test_compress_response_success(self):
+        """Test that a large json response is gzipped when accepted."""
+        with self.app.test_request_context(
+            headers={"Accept-Encoding": "gzip"}
+        ):
+            data = jsonify(self.payload).get_data()
+            response = compress_response(jsonify(self.payload))
+
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertIn("Accept-Encoding", response.headers.get("Vary"))
+        self.assertLess(len(response.get_data()), MIN_SIZE)
+        self.assertEqual(gzip.decompress(response.get_data()), data)
+
+    def test_compress_small_response_skipped(self):
+        """Test that a response below the size threshold is left alone."""
+        with self.app.test_request_context(
+            headers={"Accept-Encoding": "gzip"}
+        ):
+            response = compress_response(jsonify({"success": True}))
+
+        self.assertIsNone(response.headers.get("Content-Encoding"))
+
+    def test_compress_not_accepted_skipped(self):
+        """Test that a response is left alone when gzip is not accepted."""
+        with self.app.test_request_context():
+            response = compress_response(jsonify(self.payload))
+
+        self.assertIsNone(response.headers.get("Content-Encoding"))
+
+
+class LimitsTestCase(unittest.TestCase):
+    """Contains the test cases for the rate and load limits.
+
+    Attributes:
+        store: A MemoryStore holding the token buckets
+        quota: A Quota allowing two requests and one more a second
+        limiter: A ConcurrencyLimiter handling one write at a time
+    """
+
+    def setUp(self):
+        """Set-up for LimitsTestCase."""
+        self.store = MemoryStore()
+        self.quota = Quota(1, 2)
+        self.limiter = ConcurrencyLimiter(max_concurrent=1, wait_threshold=1)
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def test_take_success(self):
+        """Test that a bucket allows its burst."""
+        self.assertEqual(self.store.take("client", self.quota), 0)
+        self.assertEqual(self.store.take("client", self.quota), 0)
+
+    def test_take_exhausted_fail(self):
+        """Test that an emptied bucket reports how long to wait."""
+        self.store.take("client", self.quota)
+        self.store.take("client", self.quota)
+
+        wait = self.store.take("client", self.quota)
+
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+        self.assertEqual(self.store.take("other", self.quota), 0)
+
+    def test_store_abstract_fail(self):
+        """Test that a limit store must say how it takes tokens."""
+        with self.assertRaises(TypeError):
+            LimitStore()
+
+    def test_enter_in_flight_fail(self):
+        """Test that writes beyond the concurrency limit are shed."""
+        self.limiter.enter()
+
+        with self.assertRaises(LimitError) as context:
+            self.limiter.enter()
+
+        self.assertEqual(context.exception.status_code, 503)
+        self.limiter.exit()
+        self.limiter.enter()
+
+    def test_enter_slow_pool_fail(self):
+        """Test that writes are shed while the db pool is slow."""
+        self.limiter.record_wait(10)
+
+        with self.assertRaises(LimitError) as context:
+            self.limiter.enter()
+
+        self.assertGreater(context.exception.retry_after, 0)
+
+
+class ImporterTestCase(unittest.TestCase):
+    """Contains the test cases for reading and importing bulk import files.
+
+    Attributes:
+        folder: A TemporaryDirectory holding the files to import
+    """
+
+    def setUp(self):
+        """Set-up for ImporterTestCase."""
+        self.folder = tempfile.TemporaryDirectory()
+        setup_db(app, TEST_DATABASE_URL)
+
+    def tearDown(self):
+        """Executed after each test."""
+        self.folder.cleanup()
+
+    def write_file(self, name, content):
+        """Writes a file to import.
+
+        Args:
+            name: A str representing the file name
+            content: A str representing the content of the file
+
+        Returns:
+            path: A str representing the path of the file
+        """
+        path = os.path.join(self.folder.name, name)
+
+        with open(path, "w") as import_file:
+            import_file.write(content)
+
+        return path
+
+    def test_read_rows_csv_success(self):
+        """Test that csv rows are read in column order."""
+        path = self.write_file(
+            "movies.csv", "title,id,poster\nIron Man,1,\nThor,2,x.jpg\n"
+        )
+
+        rows = list(read_rows(path, ["id", "title", "poster"], ("id",)))
+
+        self.assertEqual(
+            rows, [["1", "Iron Man", None], ["2", "Thor", "x.jpg"]]
+        )
+
+    def test_read_rows_ndjson_success(self):
+        """Test that ndjson rows are read in column order."""
+        path = self.write_file(
+            "actors.ndjson", '{"id": 1, "name": "Zendaya"}\n\n{"id": 2}\n'
+        )
+
+        rows = list(read_rows(path, ["id", "name"], ("id",)))
+
+        self.assertEqual(rows, [[1, "Zendaya"], [2, None]])
+
+    def test_read_rows_missing_key_fail(self):
+        """Test that rows without their key columns are refused."""
+        path = self.write_file("cast.csv", "movie_id,actor_id\n1,\n")
+
+        with self.assertRaises(ValueError):
+            list(
+                read_rows(
+                    path, ["movie_id", "actor_id"], ("movie_id", "actor_id")
+                )
+            )
+
+    def test_read_header_success(self):
+        """Test that the columns of csv and ndjson files are read."""
+        csv_path = self.write_file("movies.csv", "id,title\n1,Thor\n")
+        ndjson_path = self.write_file(
+            "actors.ndjson", '\n{"id": 1, "name": "Zendaya"}\n{"id": 2}\n'
+        )
+
+        self.assertEqual(read_header(csv_path), ["id", "title"])
+        self.assertEqual(read_header(ndjson_path), ["id", "name"])
+
+    def test_import_partial_file_success(self):
+        """Test that importing some columns leaves the others as they are."""
+        movie = Movie(
+            title="Heat",
+            release_date=datetime.date(1995, 12, 15),
+            poster="heat.jpg",
+        )
+        movie.insert()
+        movie_id = movie.id
+        path = self.write_file(
+            "movies.csv", f"id,title\n{movie_id},Heat (Remastered)\n"
+        )
+
+        import_file("movies", path)
+        db.session.remove()
+        movie = Movie.query.get(movie_id)
+
+        self.assertEqual(movie.title, "Heat (Remastered)")
+        self.assertEqual(movie.release_date, datetime.date(1995, 12, 15))
+        self.assertEqual(movie.poster, "heat.jpg")
+        self.assertIsNone(movie.deleted_at)
+
+    def test_import_deleted_row_success(self):
+        """Test that importing over a deleted row leaves it deleted."""
+        movie = Movie(title="Heat")
+        movie.insert()
+        movie.delete()
+        movie_id = movie.id
+        path = self.write_file(
+            "movies.ndjson",
+            json.dumps({"id": movie_id, "title": "Heat", "deleted_at": None}),
+        )
+
+        import_file("movies", path)
+        db.session.remove()
+        movie = Movie.query.get(movie_id)
+
+        self.assertIsNotNone(movie.deleted_at)
+        self.assertIsNone(find_live(Movie, id=movie_id))
+
+    def test_import_during_sync_success(self):
+        """Test that a delta sync during an import catches the rows later."""
+        movie = Movie(title="Heat")
+        movie.insert()
+        movie_id = movie.id
+        path = self.write_file(
+            "movies.csv", f"id,title\n{movie_id},Heat (Remastered)\n"
+        )
+        since = datetime.datetime.utcnow()
+        syncs = []
+
+        def sync():
+            with app.app_context():
+                syncs.append(changed_since(MovieRecord, since))
+                db.session.remove()
+
+        def sync_once(connection, cursor, statement, *args):
+            if statement.startswith("INSERT INTO movies") and not syncs:
+                thread = threading.Thread(target=sync)
+                thread.start()
+                thread.join()
+
+        engine = db.session.get_bind()
+        settle_seconds = delta.SETTLE_SECONDS
+        delta.SETTLE_SECONDS = 0
+        event.listen(engine, "after_cursor_execute", sync_once)
+
+        try:
+            import_file("movies", path)
+            rows, cursor, _ = syncs[0]
+            later_rows, _, _ = changed_since(MovieRecord, *cursor)
+        finally:
+            event.remove(engine, "after_cursor_execute", sync_once)
+            delta.SETTLE_SECONDS = settle_seconds
+
+        self.assertNotIn(movie_id, [row.id for row in rows])
+        self.assertIn(movie_id, [row.id for row in later_rows])
+
+    def test_import_missing_key_column_fail(self):
+        """Test that files without the key columns are refused."""
+        path = self.write_file("movies.csv", "title\nHeat\n")
+
+        with self.assertRaises(ValueError):
+            import_file("movies", path)
+
+    def test_csv_stream_success(self):
+        """Test that a CSVStream reads every row however it is read."""
+        stream = CSVStream(iter([[1, "Iron Man"], [2, None]] * 3))
+        chunks = []
+
+        while True:
+            chunk = stream.read(5)
+
+            if not chunk:
+                break
+
+            self.assertLessEqual(len(chunk), 5)
+            chunks.append(chunk)
+
+        self.assertEqual("".join(chunks), "1,Iron Man\r\n2,\r\n" * 3)
+        self.assertEqual(stream.count, 6)
+
+
+class JobsTestCase(unittest.TestCase):
+    """Contains the test cases for running background jobs."""
+
+    def setUp(self):
+        """Set-up for JobsTestCase."""
+        setup_db(app, TEST_DATABASE_URL)
+
+    def tearDown(self):
+        """Executed after each test."""
+
+    def run_job(self, kind, cursor=None):
+        """Runs a job to completion in the current thread.
+
+        Args:
+            kind: A str representing the kind of job
+            cursor: A str representing the json position the job continues
+                from (default: None, meaning from the start)
+
+        Returns:
+            A dict representing the finished job
+        """
+        job = Job(kind=kind, cursor=cursor)
+        job.insert()
+        job_id = job.id
+        job_runner.run(job_id)
+
+        return Job.query.get(job_id).format()
+
+    def test_rebuild_job_success(self):
+        """Test that a rebuild job rebuilds every movie and actor."""
+        total = Movie.query.count() + Actor.query.count()
+
+        job = self.run_job("rebuild")
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], {"rebuilt": total})
+
+    def test_rebuild_job_resume_success(self):
+        """Test that an interrupted rebuild job continues from its cursor."""
+        job = self.run_job("rebuild", json.dumps([1, 0]))
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], {"rebuilt": Actor.query.count()})
+
+
+class DeltaTestCase(unittest.TestCase):
+    """Contains the test cases for parsing delta sync cursors."""
+
+    def test_parse_timestamp_success(self):
+        """Test that timestamps are read as naive utc datetimes."""
+        expected = datetime.datetime(2020, 5, 4, 12, 30)
+
+        self.assertEqual(parse_timestamp("2020-05-04T12:30:00"), expected)
+        self.assertEqual(parse_timestamp("2020-05-04T12:30:00Z"), expected)
+        self.assertEqual(
+            parse_timestamp("2020-05-04T14:30:00+02:00"), expected
+        )
+
+    def test_parse_timestamp_fail(self):
+        """Test that malformed timestamps are refused."""
+        with self.assertRaises(ValueError):
+            parse_timestamp("yesterday")
+
+    def test_is_expired_success(self):
+        """Test that only syncs older than the tombstones are expired."""
+        now = datetime.datetime.utcnow()
+
+        self.assertFalse(is_expired(now - datetime.timedelta(minutes=1)))
+        self.assertTrue(is_expired(now - datetime.timedelta(days=365)))
+
+
+class TokensTestCase(unittest.TestCase):
+    """Contains the test cases for verifying minted tokens offline.
+
+    Attributes:
+        private_key: A str representing the key minting the tokens
+        keys: A LocalKeySet holding the key verifying the tokens
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Generates the key shared by the test cases."""
+        cls.private_key, jwks = generate_key("test", bits=1024)
+        cls.keys = LocalKeySet(jwks)
+
+    def verify(self, token):
+        """Verifies a token against the pinned key set.
+
+        Args:
+            token: A str representing the access token
+
+        Returns:
+            A dict representing the decoded access token
+        """
+        return verify_decode_jwt(token, get_token_rsa_key(token, self.keys))
+
+    def test_mint_token_success(self):
+        """Test that a minted token is verified with the pinned keys."""
+        token = mint_token(
+            self.private_key, "test", ROLES["casting-assistant"], sub="load|1"
+        )
+
+        payload = self.verify(token)
+
+        self.assertEqual(payload["sub"], "load|1")
+        self.assertEqual(payload["permissions"], ROLES["casting-assistant"])
+
+    def test_mint_token_expired_fail(self):
+        """Test that an expired minted token is refused."""
+        token = mint_token(self.private_key, "test", [], seconds=-60)
+
+        with self.assertRaises(AuthError) as context:
+            self.verify(token)
+
+        self.assertEqual(
+            context.exception.error["error_code"], "token_expired"
+        )
+
+    def test_get_token_rsa_key_success(self):
+        """Test that the key of a token is converted once and reused."""
+        token = mint_token(self.private_key, "test", [])
+
+        self.assertIs(
+            get_token_rsa_key(token, self.keys),
+            get_token_rsa_key(token, self.keys),
+        )
+
+    def test_get_token_rsa_key_malformed_fail(self):
+        """Test that a token whose header cannot be decoded is refused."""
+        for token in ("not a token", "e30.e30.", "eyJhbGciOiJub25lIn0.e30."):
+            with self.assertRaises(AuthError) as context:
+                get_token_rsa_key(token, self.keys)
+
+            self.assertEqual(
+                context.exception.error["error_code"], "invalid_header"
+            )
+
+    def test_mint_token_unknown_key_fail(self):
+        """Test that a token signed with an unpinned key is refused."""
+        token = mint_token(self.private_key, "other", [])
+
+        with self.assertRaises(AuthError) as context:
+            self.verify(token)
+
+        self.assertEqual(context.exception.status_code, 401)
+
+    def test_key_set_abstract_fail(self):
+        """Test that a key set must say where its keys come from."""
+        with self.assertRaises(TypeError):
+            KeySet()
+
+
+class StatementsTestCase(unittest.TestCase):
+    """Contains the test cases for the cached statements and baked queries.
+
+    Attributes:
+        app: A flask app from app.py
+        database_url: A str representing the location of the db used for
+            testing
+    """
+
+    def setUp(self):
+        """Set-up for StatementsTestCase."""
+        self.app = app
+        self.database_url = TEST_DATABASE_URL
+        setup_db(self.app, self.database_url)
+
+    def tearDown(self):
+        """Executed after each test."""
+        db.session.remove()
+
+    def test_execute_success(self):
+        """Test that a cached statement returns the same rows when reused."""
+        statement = CachedStatement(
+            "test_execute_success",
+            select([Movie.id])
+            .where(Movie.id <= bindparam("last_id"))
+            .order_by(Movie.id),
+        )
+
+        with self.app.app_context():
+            first = statement.execute(db.session, last_id=2).fetchall()
+            second = statement.execute(db.session, last_id=2).fetchall()
+            expected = [
+                (movie.id,)
+                for movie in Movie.query.filter(Movie.id <= 2).order_by(
+                    Movie.id
+                )
+            ]
+
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+
+    def test_find_live_success(self):
+        """Test that baked lookups match the ORM query for each model."""
+        with self.app.app_context():
+            movie = Movie.live().first()
+            actor = Actor.live().first()
+
+            self.assertIs(find_live(Movie, id=movie.id), movie)
+            self.assertEqual(
+                find_live(Movie, title=movie.title).title, movie.title
+            )
+            self.assertIs(find_live(Actor, id=actor.id), actor)
+            self.assertIsNone(find_live(Actor, id=0))
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """Contains the test cases for the sampling profiler."""
+
+    def test_sample_stacks_success(self):
+        """Test that the stacks of the other threads are sampled."""
+        done = threading.Event()
+
+        def wait_for_profile():
+            done.wait()
+
+        thread = threading.Thread(target=wait_for_profile, name="waiting")
+        thread.start()
+
+        try:
+            stacks = sample_stacks(0.05)
+        finally:
+            done.set()
+            thread.join()
+
+        waiting = [stack for stack in stacks if stack.startswith("waiting;")]
+
+        self.assertTrue(waiting)
+        self.assertIn("wait_for_profile (test_app.py:", waiting[0])
+        self.assertFalse(
+            any("sample_stacks" in stack for stack in stacks.elements())
+        )
+
+    def test_profile_success(self):
+        """Test that a profile is returned as folded stacks."""
+        folded = profile(0.05)
+
+        for line in folded.splitlines():
+            stack, count = line.rsplit(" ", 1)
+
+            self.assertTrue(stack)
+            self.assertGreater(int(count), 0)
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    """Contains the test cases for the slow query log."""
+
+    def setUp(self):
+        """Set-up for the SlowQueryLogTestCase."""
+        self.engine = create_engine("sqlite://")
+
+    def test_slow_statement_logged_success(self):
+        """Test that statements over the threshold are logged redacted."""
+        slow_query_log = SlowQueryLog(size=2, threshold=0)
+        slow_query_log.watch(self.engine)
+
+        for number in range(3):
+            self.engine.execute(f"SELECT ?, {number}", "secret")
+
+        snapshot = slow_query_log.snapshot()
+
+        self.assertEqual(snapshot["total"], 3)
+        self.assertEqual(len(snapshot["queries"]), 2)
+        self.assertEqual(snapshot["queries"][0]["statement"], "SELECT ?, 2")
+        self.assertEqual(snapshot["queries"][0]["parameters"], ["str"])
+        self.assertNotIn("secret", json.dumps(snapshot))
+        self.assertIsNone(snapshot["queries"][0]["route"])
+        self.assertIsNone(snapshot["queries"][0]["plan"])
+
+    def test_fast_statement_not_logged_success(self):
+        """Test that statements under the threshold are not logged."""
+        slow_query_log = SlowQueryLog(threshold=60)
+        slow_query_log.watch(self.engine)
+        self.engine.execute(select([1]))
+
+        self.assertEqual(slow_query_log.snapshot()["total"], 0)
+
+    def test_route_logged_success(self):
+        """Test that the route running a slow statement is logged."""
+        slow_query_log = SlowQueryLog(threshold=0)
+        slow_query_log.watch(self.engine)
+
+        with app.test_request_context("/api/movies/1"):
+            self.engine.execute(select([1]))
+
+        self.assertEqual(
+            slow_query_log.snapshot()["queries"][0]["route"],
+            "GET /api/movies/<int:movie_id>",
+        )
+
+    def test_redact_success(self):
+        """Test that parameter values are replaced with their types."""
+        self.assertEqual(
+            redact({"name": "x", "id": 1}), {"name": "str", "id": "int"}
+        )
+        self.assertEqual(redact(("x", None)), ["str", "NoneType"])
+        self.assertEqual(
+            redact([("x",), ("y",)]), {"rows": 2, "first": ["str"]}
+        )
+
+
+class TracingTestCase(unittest.TestCase):
+    """Contains the test cases for the request tracing."""
+
+    def setUp(self):
+        """Set-up for the TracingTestCase."""
+        self.exporter = MemoryExporter()
+        self.tracer = Tracer(self.exporter, sample_rate=1)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.tracer.finish_trace()
+
+    def test_parse_traceparent_success(self):
+        """Test that valid traceparent headers are parsed."""
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+        self.assertEqual(
+            parse_traceparent(f"00-{trace_id}-00f067aa0ba902b7-01"),
+            (trace_id, "00f067aa0ba902b7", True),
+        )
+        self.assertEqual(
+            parse_traceparent(f"01-{trace_id}-00f067aa0ba902b7-00-x"),
+            (trace_id, "00f067aa0ba902b7", False),
+        )
+
+    def test_parse_traceparent_fail(self):
+        """Test that invalid traceparent headers are ignored."""
+        for header in (
+            None,
+            "",
+            "00-4bf92f3577b34da6-00f067aa0ba902b7-01",
+            f"00-{'0' * 32}-00f067aa0ba902b7-01",
+            f"ff-{'a' * 32}-00f067aa0ba902b7-01",
+            f"00-{'a' * 32}-00f067aa0ba902b7-01-x",
+        ):
+            self.assertIsNone(parse_traceparent(header))
+
+    def test_spans_exported_success(self):
+        """Test that nested spans are exported with their parents."""
+        trace = self.tracer.start_trace("GET /")
+
+        with self.tracer.span("outer", size=1) as outer:
+            with self.tracer.span("inner"):
+                pass
+
+        self.tracer.finish_trace()
+        spans = {span["name"]: span for span in self.exporter.traces()[0]}
+
+        self.assertEqual(set(spans), {"GET /", "outer", "inner"})
+        self.assertEqual(spans["inner"]["parent_id"], outer.span_id)
+        self.assertEqual(spans["outer"]["parent_id"], trace.root.span_id)
+        self.assertEqual(spans["outer"]["attributes"], {"size": 1})
+        self.assertIsNone(spans["GET /"]["parent_id"])
+
+    def test_caller_trace_continued_success(self):
+        """Test that a trace continues the caller's, sampled or not."""
+        self.tracer.trust_parent = True
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        trace = self.tracer.start_trace(
+            "GET /", f"00-{trace_id}-00f067aa0ba902b7-00"
+        )
+
+        with self.tracer.span("skipped") as span:
+            self.assertIsNone(span)
+
+        self.tracer.finish_trace()
+
+        self.assertEqual(trace.trace_id, trace_id)
+        self.assertEqual(trace.root.parent_id, "00f067aa0ba902b7")
+        self.assertTrue(trace.traceparent().endswith("-00"))
+        self.assertEqual(self.exporter.traces(), [])
+
+    def test_caller_sampled_flag_ignored_success(self):
+        """Test that an untrusted caller cannot force its trace sampled."""
+        self.tracer.sample_rate = 0
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        trace = self.tracer.start_trace(
+            "GET /", f"00-{trace_id}-00f067aa0ba902b7-01"
+        )
+        self.tracer.finish_trace()
+
+        self.assertEqual(trace.trace_id, trace_id)
+        self.assertFalse(trace.sampled)
+        self.assertEqual(self.exporter.traces(), [])
+
+    def test_statement_spans_success(self):
+        """Test that each statement is timed as a span."""
+        engine = create_engine("sqlite://")
+        self.tracer.watch(engine)
+        self.tracer.start_trace("GET /")
+        engine.execute("SELECT 1")
+
+        with self.assertRaises(Exception):
+            engine.execute("SELECT missing")
+
+        self.tracer.finish_trace()
+        spans = [
+            span for span in self.exporter.traces()[0] if span["name"] == "sql"
+        ]
+
+        self.assertEqual(len(spans), 2)
+        self.assertEqual(spans[0]["attributes"], {"statement": "SELECT 1"})
+        self.assertEqual(spans[1]["attributes"]["error"], "OperationalError")
+
+    def test_request_traceparent_success(self):
+        """Test that responses carry the traceparent of the request."""
+        exporter, trust_parent = tracer.exporter, tracer.trust_parent
+        tracer.exporter, tracer.trust_parent = self.exporter, True
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+        try:
+            res = app.test_client().get(
+                "/auth_config",
+                headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+            )
+        finally:
+            tracer.exporter, tracer.trust_parent = exporter, trust_parent
+
+        traceparent = res.headers["traceparent"]
+        spans = self.exporter.traces()[0]
+
+        self.assertTrue(traceparent.startswith(f"00-{trace_id}-"))
+        self.assertTrue(traceparent.endswith("-01"))
+        self.assertEqual(spans[-1]["name"], "GET /auth_config")
+        self.assertEqual(spans[-1]["attributes"], {"status": 200})
+
+
 if __name__ == "__main__":
     unittest.main()
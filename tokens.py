@@ -0,0 +1,118 @@
+"""Minting of access tokens signed with a local key, for offline use.
+
+Tests, load tests and air-gapped deployments can verify tokens against a
+pinned key set (see AUTH0_JWKS and AUTH0_JWKS_FILE in auth.py) instead of
+Auth0's. generate_key creates a signing key along with the key set to pin,
+and mint_token signs tokens with it carrying the same audience, issuer and
+permissions claims as the tokens Auth0 issues.
+
+Attributes:
+    ROLES: A dict mapping role names to the permissions granted to them
+    TOKEN_SECONDS: An int representing how long minted tokens are valid by
+        default
+"""
+
+import base64
+import time
+
+import rsa
+from jose import jwt
+
+from auth import ALGORITHMS, API_IDENTIFIER, ISSUER
+
+ROLES = {
+    "casting-assistant": ["read:movies", "read:actors"],
+    "casting-director": [
+        "read:movies",
+        "read:actors",
+        "create:actors",
+        "update:actors",
+        "delete:actors",
+        "update:movies",
+    ],
+    "executive-producer": [
+        "read:movies",
+        "read:actors",
+        "create:actors",
+        "update:actors",
+        "delete:actors",
+        "create:movies",
+        "update:movies",
+        "delete:movies",
+    ],
+}
+TOKEN_SECONDS = 24 * 60 * 60
+
+
+def encode_integer(value):
+    """Encodes an integer as the base64url str used by JSON Web Keys.
+
+    Args:
+        value: An int representing the value to encode
+
+    Returns:
+        A str representing the unpadded base64url of its big-endian bytes
+    """
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def generate_key(kid, bits=2048):
+    """Generates an rsa key for signing tokens and the key set verifying them.
+
+    Args:
+        kid: A str representing the identifier of the key
+        bits: An int representing the size of the key (default: 2048)
+
+    Returns:
+        private_key: A str representing the private key in PEM format
+        jwks: A dict representing the JSON Web Key Set holding the public key
+    """
+    public_key, private_key = rsa.newkeys(bits)
+    jwks = {
+        "keys": [
+            {
+                "kty": "RSA",
+                "kid": kid,
+                "use": "sig",
+                "alg": ALGORITHMS[0],
+                "n": encode_integer(public_key.n),
+                "e": encode_integer(public_key.e),
+            }
+        ]
+    }
+
+    return private_key.save_pkcs1().decode(), jwks
+
+
+def mint_token(
+    private_key, kid, permissions, sub="offline|user", seconds=TOKEN_SECONDS
+):
+    """Signs an access token accepted by requires_auth.
+
+    Args:
+        private_key: A str representing the private key in PEM format
+        kid: A str representing the identifier of the key
+        permissions: A list of strs representing the permissions granted
+        sub: A str representing the user the token belongs to (default:
+            "offline|user")
+        seconds: An int representing how long the token is valid (default:
+            global TOKEN_SECONDS)
+
+    Returns:
+        A str representing the signed access token
+    """
+    now = int(time.time())
+    claims = {
+        "iss": ISSUER,
+        "sub": sub,
+        "aud": API_IDENTIFIER,
+        "iat": now,
+        "exp": now + seconds,
+        "permissions": list(permissions),
+    }
+
+    return jwt.encode(
+        claims, private_key, algorithm=ALGORITHMS[0], headers={"kid": kid}
+    )
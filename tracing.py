@@ -0,0 +1,572 @@
+"""Tracing of requests as trees of timed spans.
+
+A trace is started for each request, continuing the trace of the caller
+when it sends a W3C traceparent header, and the traceparent of the request
+is returned on the response. Spans time the steps of the request within
+it: authentication, each db statement and serialization. The spans of a
+finished trace are handed to an exporter.
+
+Traces are sampled at the head: the decision is made when the trace starts,
+following TRACE_SAMPLE_RATE, so the spans of unsampled requests cost only a
+context variable lookup each. The caller's sampled flag is only followed
+when TRACE_TRUST_PARENT is set, e.g. behind a proxy that sets it, as any
+client could otherwise have every one of its requests exported.
+
+Attributes:
+    BUFFER_SIZE: An int representing the number of traces kept by a
+        MemoryExporter
+    NO_SPAN: The context manager standing in for the spans of unsampled
+        traces
+    STATEMENT_LENGTH: An int representing the number of characters of a
+        statement kept on its span
+    TRACE_EXPORTER: A str representing where traces are exported: "none"
+        (the default), "memory", "file" or the "module:attribute" of an
+        exporter class
+    TRACE_FILE: A str representing the path the file exporter appends to
+    TRACE_SAMPLE_RATE: A float representing the share of traces started
+        here that are sampled, from 0 to 1
+    TRACE_TRUST_PARENT: A bool representing whether the sampled flag of the
+        caller's traceparent is followed
+    TRACEPARENT: A compiled regex matching W3C traceparent headers
+    current_span: A ContextVar holding the open Span innermost in the
+        current trace
+    tracer: The Tracer shared by the app
+
+Classes:
+    Span()
+    Trace()
+    MemoryExporter()
+    FileExporter()
+    Tracer()
+"""
+
+import collections
+import contextlib
+import contextvars
+import importlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUFFER_SIZE = 1000
+STATEMENT_LENGTH = 200
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))
+TRACE_TRUST_PARENT = os.environ.get("TRACE_TRUST_PARENT", "0") == "1"
+
+TRACEPARENT = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$"
+)
+
+NO_SPAN = contextlib.nullcontext()
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def new_id(size):
+    """Generates a random identifier for a trace or span.
+
+    Args:
+        size: An int representing the number of bytes of the identifier
+
+    Returns:
+        A str representing the identifier in lowercase hex
+    """
+    return os.urandom(size).hex()
+
+
+def parse_traceparent(header):
+    """Parses a W3C traceparent header.
+
+    Args:
+        header: A str representing the header, or None
+
+    Returns:
+        trace_id: A str representing the identifier of the trace
+        parent_id: A str representing the identifier of the caller's span
+        sampled: A bool representing whether the caller sampled the trace.
+            None is returned instead if the header is missing or invalid
+    """
+    match = TRACEPARENT.match((header or "").strip().lower())
+
+    if match is None:
+        return None
+
+    version, trace_id, parent_id, flags, rest = match.groups()
+
+    if (
+        version == "ff"
+        or (version == "00" and rest)
+        or trace_id == "0" * 32
+        or parent_id == "0" * 16
+    ):
+        return None
+
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+class Span:
+    """A timed step of a trace.
+
+    Attributes:
+        trace: The Trace the span belongs to
+        span_id: A str representing the identifier of the span
+        parent_id: A str representing the identifier of the enclosing span,
+            or None for the root span of a trace started here
+        name: A str representing the step the span times
+        attributes: A dict holding details of the step
+        start: A float representing the epoch seconds the span started at
+        duration: A float representing the seconds the span lasted, or None
+            while it is open
+    """
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start",
+        "duration",
+        "_started",
+        "_token",
+    )
+
+    def __init__(self, trace, parent_id, name, attributes):
+        """Set-up for Span, which starts timing it.
+
+        Args:
+            trace: The Trace the span belongs to
+            parent_id: A str representing the identifier of the enclosing
+                span
+            name: A str representing the step the span times
+            attributes: A dict holding details of the step
+        """
+        self.trace = trace
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    def __enter__(self):
+        """Makes the span current, so spans started within it are children.
+
+        Returns:
+            The Span
+        """
+        self._token = current_span.set(self)
+
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        """Finishes the span and makes its parent current again.
+
+        Args:
+            error_type: The type of the exception raised within the span, or
+                None
+            error: unused
+            traceback: unused
+        """
+        if error_type is not None:
+            self.attributes["error"] = error_type.__name__
+
+        current_span.reset(self._token)
+        self.finish()
+
+    def finish(self):
+        """Stops timing the span and adds it to its trace."""
+        self.duration = time.perf_counter() - self._started
+        self.trace.spans.append(self)
+
+    def format(self):
+        """Formats the span as a dict.
+
+        Returns:
+            A dict representing the span, with its times in milliseconds
+        """
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_milliseconds": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """The spans of one request.
+
+    Attributes:
+        trace_id: A str representing the identifier of the trace
+        sampled: A bool representing whether the spans are recorded
+        root: The Span timing the whole request
+        spans: A list of the finished Spans
+    """
+
+    def __init__(self, trace_id, parent_id, sampled, name):
+        """Set-up for Trace, which starts its root span.
+
+        Args:
+            trace_id: A str representing the identifier of the trace
+            parent_id: A str representing the identifier of the caller's
+                span, or None
+            sampled: A bool representing whether the spans are recorded
+            name: A str representing the name of the root span
+        """
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.root = Span(self, parent_id, name, {})
+
+    def traceparent(self):
+        """Formats the W3C traceparent identifying the root span.
+
+        Returns:
+            A str representing the traceparent header
+        """
+        flags = "01" if self.sampled else "00"
+
+        return f"00-{self.trace_id}-{self.root.span_id}-{flags}"
+
+
+class MemoryExporter:
+    """An exporter keeping the latest traces in memory, for tests."""
+
+    def __init__(self, size=BUFFER_SIZE):
+        """Set-up for MemoryExporter.
+
+        Args:
+            size: An int representing the number of traces kept (default:
+                global BUFFER_SIZE)
+        """
+        self._traces = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        """Keeps the spans of a finished trace.
+
+        Args:
+            spans: A list of dicts representing the spans of the trace
+        """
+        with self._lock:
+            self._traces.append(spans)
+
+    def traces(self):
+        """Gets the kept traces, oldest first.
+
+        Returns:
+            A list of lists of dicts representing the spans of each trace
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self):
+        """Forgets the kept traces."""
+        with self._lock:
+            self._traces.clear()
+
+
+class FileExporter:
+    """An exporter appending spans to a file, one json object per line.
+
+    Attributes:
+        path: A str representing the path of the file
+    """
+
+    def __init__(self, path=TRACE_FILE):
+        """Set-up for FileExporter.
+
+        Args:
+            path: A str representing the path of the file (default: global
+                TRACE_FILE)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        """Appends the spans of a finished trace to the file.
+
+        Args:
+            spans: A list of dicts representing the spans of the trace
+        """
+        lines = "".join(json.dumps(span) + "\n" for span in spans)
+
+        with self._lock:
+            with open(self.path, "a") as trace_file:
+                trace_file.write(lines)
+
+
+def load_exporter(name=TRACE_EXPORTER):
+    """Creates the exporter traces are handed to.
+
+    Args:
+        name: A str representing the exporter: "none", "memory", "file" or
+            the "module:attribute" of a class whose instances have an
+            export(spans) method (default: global TRACE_EXPORTER)
+
+    Returns:
+        An exporter, or None if traces are not exported
+    """
+    if name == "none":
+        return None
+
+    if name == "memory":
+        return MemoryExporter()
+
+    if name == "file":
+        return FileExporter()
+
+    module_name, _, attribute = name.partition(":")
+
+    if not attribute:
+        raise ValueError(
+            "TRACE_EXPORTER must be none, memory, file or module:attribute"
+        )
+
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+class Tracer:
+    """Starts traces, records their spans and exports them.
+
+    Attributes:
+        exporter: The exporter finished traces are handed to, or None to
+            sample no traces
+        sample_rate: A float representing the share of traces sampled when
+            the caller's sampled flag is not followed
+        trust_parent: A bool representing whether the sampled flag of the
+            caller's traceparent is followed
+    """
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate=TRACE_SAMPLE_RATE,
+        trust_parent=TRACE_TRUST_PARENT,
+    ):
+        """Set-up for Tracer.
+
+        Args:
+            exporter: The exporter finished traces are handed to (default:
+                None)
+            sample_rate: A float representing the share of traces sampled
+                when the caller's sampled flag is not followed (default:
+                global TRACE_SAMPLE_RATE)
+            trust_parent: A bool representing whether the sampled flag of
+                the caller's traceparent is followed (default: global
+                TRACE_TRUST_PARENT)
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.trust_parent = trust_parent
+        self._watching = set()
+
+    def start_trace(self, name, traceparent=None):
+        """Starts the trace of a request and makes its root span current.
+
+        A caller's trace is continued whether or not its sampled flag is
+        followed.
+
+        Args:
+            name: A str representing the name of the root span
+            traceparent: A str representing the caller's W3C traceparent
+                header, or None
+
+        Returns:
+            The Trace started
+        """
+        parent = parse_traceparent(traceparent)
+
+        if parent is None:
+            trace_id, parent_id, sampled = new_id(16), None, None
+        else:
+            trace_id, parent_id, sampled = parent
+
+        if sampled is None or not self.trust_parent:
+            sampled = random.random() < self.sample_rate
+
+        trace = Trace(
+            trace_id, parent_id, sampled and self.exporter is not None, name
+        )
+        current_span.set(trace.root)
+
+        return trace
+
+    def finish_trace(self, error=None):
+        """Finishes the current trace and exports it if it was sampled.
+
+        Args:
+            error: The exception that ended the trace, or None (default:
+                None)
+
+        Returns:
+            The Trace finished, or None if no trace was started
+        """
+        root = current_span.get()
+
+        if root is None:
+            return None
+
+        current_span.set(None)
+        trace = root.trace
+
+        if error is not None:
+            trace.root.attributes["error"] = type(error).__name__
+
+        trace.root.finish()
+
+        if trace.sampled:
+            self.exporter.export([span.format() for span in trace.spans])
+
+        return trace
+
+    def span(self, name, **attributes):
+        """Times a step of the current trace as a child span.
+
+        Args:
+            name: A str representing the step the span times
+            **attributes: The details of the step
+
+        Returns:
+            A context manager timing the step, entering as the Span started,
+            or as None if the trace is not sampled
+        """
+        parent = current_span.get()
+
+        if parent is None or not parent.trace.sampled:
+            return NO_SPAN
+
+        return Span(parent.trace, parent.span_id, name, attributes)
+
+    def traced(self, name):
+        """A decorator timing each call of a function as a span.
+
+        Args:
+            name: A str representing the step the span times
+        """
+
+        def traced_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                parent = current_span.get()
+
+                if parent is None or not parent.trace.sampled:
+                    return f(*args, **kwargs)
+
+                with self.span(name):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return traced_decorator
+
+    def watch(self, target=Engine):
+        """Starts timing the statements of the engines as spans.
+
+        Args:
+            target: A SQLAlchemy Engine to time, or the Engine class to time
+                every engine (default: Engine)
+        """
+        if target in self._watching:
+            return
+
+        event.listen(target, "before_cursor_execute", self.before_execute)
+        event.listen(target, "after_cursor_execute", self.after_execute)
+        event.listen(target, "handle_error", self.handle_error)
+        self._watching.add(target)
+
+    def before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=too-many-arguments,unused-argument
+        """Starts the span of a statement, as a before_cursor_execute event.
+
+        Args:
+            conn: unused
+            cursor: unused
+            statement: A str representing the SQL of the statement
+            parameters: unused
+            context: The SQLAlchemy ExecutionContext of the statement
+            executemany: A bool representing whether the statement runs once
+                per row of parameters
+        """
+        parent = current_span.get()
+
+        if parent is None or not parent.trace.sampled or context is None:
+            return
+
+        attributes = {"statement": statement[:STATEMENT_LENGTH]}
+
+        if executemany:
+            attributes["rows"] = len(parameters)
+
+        context.tracing_span = Span(
+            parent.trace, parent.span_id, "sql", attributes
+        )
+
+    def after_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=too-many-arguments,unused-argument
+        """Finishes the span of a statement, as an after_cursor_execute event.
+
+        Args:
+            conn: unused
+            cursor: unused
+            statement: unused
+            parameters: unused
+            context: The SQLAlchemy ExecutionContext of the statement
+            executemany: unused
+        """
+        span = getattr(context, "tracing_span", None)
+
+        if span is not None:
+            context.tracing_span = None
+            span.finish()
+
+    def handle_error(self, exception_context):
+        """Finishes the span of a failed statement, as a handle_error event.
+
+        Args:
+            exception_context: The SQLAlchemy ExceptionContext of the error
+        """
+        context = exception_context.execution_context
+        span = getattr(context, "tracing_span", None)
+
+        if span is not None:
+            context.tracing_span = None
+            span.attributes["error"] = type(
+                exception_context.original_exception
+            ).__name__
+            span.finish()
+
+
+def add_traceparent(response):
+    """Adds the traceparent of the current trace to a response.
+
+    Args:
+        response: The response object to add the header to
+    """
+    span = current_span.get()
+
+    if span is None:
+        return
+
+    trace = span.trace
+    trace.root.attributes["status"] = response.status_code
+    response.headers["traceparent"] = trace.traceparent()
+
+
+tracer = Tracer(load_exporter())